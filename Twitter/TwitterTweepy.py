@@ -1,11 +1,49 @@
-import itertools
-from datetime import datetime, timedelta
+import copy
+import json
+import logging
+from itertools import chain
 
-import pytz as pytz
 import tweepy
-import time
-from models import TwitterUser, TwitterList, TwitterRelationship
-from models import Tweet
+from backfill import BackfillJournal, plan_slices
+from converter import statuses_to_tweets
+from crawler import CrawlPlan, RelationshipCrawler
+from graph import EgoGraph, Relation
+from journal import CrawlJournal
+from keypool import KeyPool
+from metrics import metrics
+from models import TwitterUser, TwitterList
+from pipeline import HydrationPipeline, LOOKUP_SIZE, batches
+from ratelimit import RateLimitScheduler
+from retry import RetryPolicy
+from search import SeenIds, ShardedSearch, pack_queries, split_query, too_complex
+from stream import StreamSupervisor
+from usercache import UserIndex, shared_cache
+from watermark import WatermarkStore
+from writer import BackgroundWriter, BLOCK
+
+logger = logging.getLogger(__name__)
+
+# GET statuses/user_timeline returns at most 200 tweets per page and the 3200 most recent tweets of a user
+TIMELINE_PAGE_SIZE = 200
+TIMELINE_LIMIT = 3200
+
+# the pages of search/tweets and statuses/user_timeline are parsed as JSON only, the converter reads the dicts
+# and tweepy does not build Status objects that would be thrown away
+RAW_JSON = tweepy.parsers.JSONParser()
+
+
+def _flush(sink, tweet_index):
+    """
+    Flushes the sink and commits the ids of the tweets it stored to the tweet index
+    Ids buffered by other threads during the flush stay in the index until the next flush
+    :param sink: Sink or None
+    :param tweet_index: TweetIndex or None
+    """
+    ids = tweet_index.snapshot() if tweet_index is not None else None
+    if sink is not None:
+        sink.flush()
+    if tweet_index is not None:
+        tweet_index.commit(ids)
 
 
 class TwitterTweepy:
@@ -13,23 +51,65 @@ class TwitterTweepy:
     Access to twitter API with Tweepy library
     """
 
-    def __init__(self, keys, authentication='app_level'):
+    def __init__(self, keys, authentication='app_level', scheduler_factory=RateLimitScheduler, user_cache=None,
+                 sink=None, tweet_index=None, api_factory=None, retry_policy=None):
+        """
+        :param keys: a TwitterKeys object, or a list of TwitterKeys objects to spread the requests over
+        :param authentication: type of authentication
+        :param scheduler_factory: creates the rate limit scheduler of every set of keys
+        :param user_cache: UserCache checked before users are looked up, default the cache shared by the process
+        :param sink: Sink that stores the collected tweets and users, None to print the tweets
+        :param tweet_index: TweetIndex shared by all collectors, tweets already stored are skipped,
+                            None to store every tweet
+        :param api_factory: function that creates the api of a set of keys, default a tweepy.API,
+                            a fakeapi.FakeAPI serves the collectors offline
+        :param retry_policy: RetryPolicy of the requests, default retries transient errors up to 8 times
+        """
+        self.api_factory = api_factory
+        # retries transient errors, the collectors skip users and queries with permanent errors
+        self.retry = retry_policy if retry_policy is not None else RetryPolicy()
+        self.sink = sink
+        self.tweet_index = tweet_index
+        # users hydrated for one EGO-user are not looked up again for the next
+        self.user_cache = user_cache if user_cache is not None else shared_cache
         self.keys = keys
         # user app level authentication default, except for streaming (gives 401 error)
         self.authentication = authentication
+        # every set of keys has its own rate limit state, requests go to the keys with the most quota left
+        self.pool = KeyPool(keys, scheduler_factory)
         self.api = self.authenticate()
 
     def authenticate(self):
         """
-        Authenticate with Twitter API
+        Authenticate all keys of the pool with Twitter API
+        :return Twitter API wrapper object of the first keys
+        """
+        for credential in self.pool.credentials:
+            credential.api = (self.api_factory or self._create_api)(credential.keys)
+        return self.pool.credentials[0].api
+
+    def _create_api(self, keys):
+        """
+        Authenticate one set of keys with Twitter API
+        :param keys: TwitterKeys object
         :return Twitter API wrapper object
         """
         # http://www.karambelkar.info/2015/01/how-to-use-twitters-search-rest-api-most-effectively./
         # using appauthhandler instead of oauthhandler, should give higher limits as stated in above link
-        auth = tweepy.OAuthHandler(self.keys.consumer_key, self.keys.consumer_secret)
-        auth.set_access_token(self.keys.access_token, self.keys.access_token_secret)
-        return tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True, retry_count=3, retry_delay=5,
-                          retry_errors=set([401, 404, 500, 503]))
+        auth = tweepy.OAuthHandler(keys.consumer_key, keys.consumer_secret)
+        auth.set_access_token(keys.access_token, keys.access_token_secret)
+        # rate limits are handled by the scheduler and retries by the retry policy, not by tweepy
+        return tweepy.API(auth, wait_on_rate_limit=False, retry_count=0)
+
+    def _method(self, endpoint, name):
+        """
+        Returns an api method that is scheduled on the rate limit of its endpoint
+        Every call is sent with the keys of the pool that have the most quota left, and retried by the retry policy
+        :param endpoint: name of the endpoint, ex friends/ids
+        :param name: name of the tweepy api method, ex friends_ids
+        :return: the rate limited method, can be used in a tweepy.Cursor
+        """
+        return self.retry.wrap(endpoint, self.pool.method(endpoint, name))
 
     def user_exists(self, screen_name):
         """
@@ -37,26 +117,42 @@ class TwitterTweepy:
         :param screen_name: name to check
         :return: true if valid username, false if invalid username
         """
+        return self.users_exist([screen_name])[screen_name]
+
+    def users_exist(self, screen_names):
+        """
+        Check for a list of names whether they are valid twitter usernames, with 100 names per request
+        :param screen_names: list of names to check
+        :return: dict name -> true if valid username, false if invalid username
+        """
         try:
-            user_to_check = self.api.get_user(screen_name)
-            print(user_to_check.screen_name + ", " + screen_name)
-            if user_to_check.screen_name.lower() == screen_name.lower():
-                return True
+            users = self._lookup_screen_names(screen_names)
         except tweepy.TweepError:
-            print("Tweepy: Error in user_exists")
-        return False
+            logger.info("Tweepy: Error in users_exist")
+            users = dict()
+        return dict((screen_name, screen_name.lower() in users) for screen_name in screen_names)
 
     def get_id_of_user(self, username):
         """
         Get the id of a user by its username
         :param username: the name of the user
-        :return: id of the user
+        :return: id of the user, None if the user does not exist
+        """
+        return self.get_ids_of_users([username]).get(username)
+
+    def get_ids_of_users(self, usernames):
         """
-        user_for_id = self.api.get_user(username)
-        return user_for_id.id_str
+        Get the ids of a list of users by their usernames, with 100 names per request
+        :param usernames: list of names of users
+        :return: dict name -> id of the user, names that do not exist are left out
+        """
+        users = self._lookup_screen_names(usernames)
+        return dict((username, str(users[username.lower()].user_id)) for username in usernames
+                    if username.lower() in users)
 
-    def profile_information_search(self, names, friends=False, followers=False, max_followers={},
-                                   list_memberships=False, list_subscriptions=False, relationships_checked=False):
+    def profile_information_search(self, names, friends=False, followers=False, max_followers=None,
+                                   list_memberships=False, list_subscriptions=False, relationships_checked=False,
+                                   journal=None):
         """ Collect the information needed to build a relationship network
             The full user objects of the friends and followers of a list of usernames is collected
             The total number of friends and followers is calculated
@@ -64,480 +160,584 @@ class TwitterTweepy:
             :param names: comma separated list of EGO names entered by user
             :param friends: boolean Friends lookup yes or no
             :param followers: boolean Followers lookup yes or no
-            :param max_followers: maximum number of followers a EGO-name can have
+            :param max_followers: maximum number of followers a EGO-name can have, None for no maximum
             :param list_memberships: get the lists a user is a member of yes or no
             :param list_subscriptions: get the lists a users is subscribed on yes or no (also owned lists)
+            :param journal: path of the crawl journal, a search that is restarted with the same journal
+                            continues where it stopped
+            :return: EgoGraph with the relationships
         """
         # https://dev.twitter.com/rest/reference/get/users/lookup
         # get names from list, remove empty (otherwise error)
-        names_list = names.split(',')
-        # list of ego_users as TwitterUser-objects
-        list_ego_users = list()
-        # list with all EGO-users and the friends and followers of this ego users
-        list_total_users = list()
-        # convert names of EGO-users to twitter users objects and store
-        for name in names_list:
-            # string cannot not be empty
-            if name:
-                try:
-                    user = self.api.get_user(name)
-                    twitter_user = TwitterUser(user_id=user.id, name=user.name, screen_name=user.screen_name,
-                                               friends_count=user.friends_count, followers_count=user.followers_count, is_protected=user.protected,
-                                               user_description=user.description, date_created=user.created_at,
-                                               url=user.url, profile_image_url=user.profile_image_url, language=user.lang,
-                                               location=user.location, default_profile_image=user.default_profile_image,
-                                               verified=user.verified)
-                    if user.followers_count > max_followers:
-                        # exclude EGO-user if too many followers
-
-                        twitter_user.max_followers_exceeded = True
-                        names_list.remove(name)
-                    elif user.protected:
-                        # remove users with a protected account
-
-                        names_list.remove(name)
-                    else:
-                        list_ego_users.append(twitter_user)
-                        list_total_users.append(twitter_user)
-                    twitter_user.save()
-                except tweepy.TweepError:
-                    print("Error in profile_information_search: error get username EGO-user")
+        names_list = [name for name in names.split(',') if name]
+        # relationships found during the search
+        self.graph = EgoGraph()
+        # EGO-users as TwitterUser-objects, indexed by screen name and id
+        self.ego_users = UserIndex()
+        # all EGO-users and the friends and followers of this ego users, every user once
+        self.network_users = UserIndex()
+        # True if an earlier run with this journal already converted the EGO-users
+        resumed = False
+        if journal is not None:
+            journal = CrawlJournal(journal)
+            resumed = journal.phase_done("egos")
+            if resumed:
+                # continue an earlier run, with the users it already collected
+                self.ego_users.add_many(journal.load_users(is_ego=True))
+                # EGO-users excluded for their number of followers are only stored
+                self.network_users.add_many(user for user in journal.load_users() if not user.max_followers_exceeded)
+                names_list = [user.screen_name for user in self.ego_users]
+                if not relationships_checked:
+                    # relationships between the EGO-users and their friends and followers
+                    for relation in Relation:
+                        for from_user_id, to_user_id in journal.load_edges(relation.name.lower()):
+                            self.graph.add_edge(from_user_id, to_user_id, relation)
+                # the users of the pages stored in the journal are not looked up again
+                self.user_cache.put_many(list(self.network_users))
+                logger.info("Continue search with {0} users from the journal".format(len(self.network_users)))
+        # convert names of EGO-users to twitter users objects and store, EGO-users from the journal are already
+        # converted
+        if not resumed:
+            try:
+                # 100 names per request
+                found_users = self._lookup_screen_names(names_list)
+            except tweepy.TweepError:
+                logger.error("Error in profile_information_search: error get username EGO-user")
+                found_users = dict()
+            # only the EGO-users that are kept remain in the list of names
+            names_list = list()
+            # EGO-users with too many followers, stored with the flag but not searched
+            excluded_users = list()
+            for twitter_user in found_users.values():
+                if max_followers is not None and twitter_user.followers_count > max_followers:
+                    # exclude EGO-user if too many followers, the user in the user cache is shared and keeps no flag
+                    excluded_user = copy.copy(twitter_user)
+                    excluded_user.max_followers_exceeded = True
+                    excluded_users.append(excluded_user)
+                elif twitter_user.is_protected:
+                    # exclude users with a protected account
+                    pass
+                else:
+                    names_list.append(twitter_user.screen_name)
+                    self.ego_users.add(twitter_user)
+                    self.network_users.add(twitter_user)
+        if journal is not None and not resumed:
+            journal.save_users(list(self.ego_users), is_ego=True)
+            # a restarted run leaves the excluded EGO-users out, unless they were stored again as friend or follower
+            journal.save_users(excluded_users)
+            journal.finish_phase("egos")
+        if self.sink is not None and not resumed:
+            self.sink.add_users(list(self.ego_users) + excluded_users)
+
+        def save_users(users):
+            # every hydrated user goes into the index, and into the journal as soon as it arrives
+            self.network_users.add_many(users)
+            if journal is not None:
+                journal.save_users(users)
+            if self.sink is not None:
+                self.sink.add_users(users)
 
         # Collect friends of ego-users
         if friends:
-            print("Collect friends")
+            logger.info("Collect friends")
             # iterate over all ego names the user has entered
             for name in names_list:
                 # check first if name is not empty
                 if name:
-                    #print("Friend ids of {}".format(name))
+                    # friends collected in an earlier run
+                    if journal is not None and journal.phase_done("friends:" + name):
+                        continue
                     # get the ego user object to save the relationsship (not full ego network)
-                    ego_user = self._get_user(name, list_ego_users)
-                    ids = list()
-                    # get user ids of friends of user
-                    while True:
-                        try:
-                            for friend_ids in tweepy.Cursor(self.api.friends_ids, screen_name=name).pages():
-                                time.sleep(1)
-                                # add ids to list of ids
-                                for friend_id in friend_ids:
-                                    ids.append(friend_id)
-                            # get user objects from friend-ids and store in database
-                            # remove doubles
-                            id_set = set(ids)
-                            ids_no_doubles = list(id_set)
-                            for page in self._paginate(ids_no_doubles, 100):
-                                self._save_users(page, list_total_users)
-                            # if full ego network is not collected, save the relationships between the ego user
-                            # and the friends
-                            if not relationships_checked:
-                                for friend_id in ids_no_doubles:
-                                    relation = TwitterRelationship(from_user_id=ego_user.user_id, to_user_id=friend_id,
-                                                                   relation_used="friends")
-                                    relation.save()
-                        except tweepy.TweepError as e:
-                            # when api cannot connect, reset connection
-                            print("Error in getfriends: {0}".format(e))
-                            time.sleep(50)
-                            self.api = self.authenticate()
-                            continue
-                        break
-            print("End of collect friends")
+                    ego_user = self.ego_users.by_screen_name(name)
+                    # user objects are looked up while the friend ids are still being paged
+                    ids, finished = self._page_ego_ids(name, 'friends', ego_user, save_users, journal)
+                    # if full ego network is not collected, save the relationships between the ego user
+                    # and the friends that were found
+                    if not relationships_checked:
+                        self.graph.add_edges(ego_user.user_id, ids, Relation.FRIENDS)
+                    if journal is not None and finished:
+                        # the edges of an unfinished phase stay with its pages, a restarted run adds them
+                        journal.finish_phase("friends:" + name, [] if relationships_checked else
+                                             [(ego_user.user_id, friend_id) for friend_id in ids], "friends")
+            logger.info("End of collect friends")
 
         # Collect followers of ego users
         if followers:
-            print("Collect followers")
+            logger.info("Collect followers")
             for name in names_list:
                 # check first if name is not empty
                 if name:
-                    print("Follower ids of {}".format(name))
+                    # followers collected in an earlier run
+                    if journal is not None and journal.phase_done("followers:" + name):
+                        continue
+                    logger.info("Follower ids of %s", name)
                     # get the ego user object to save the relationsship (not full ego network)
-                    ego_user = self._get_user(name, list_ego_users)
-                    ids = list()
-                    # get user ids of followers of user
-                    while True:
-                        try:
-                            for follower_ids in tweepy.Cursor(self.api.followers_ids, screen_name=name).pages():
-                                time.sleep(1)
-                                for follower_id in follower_ids:
-                                    ids.append(follower_id)
-                            # get user objects from follower-ids and store in database
-                            # remove doubles
-                            id_set = set(ids)
-                            ids_no_doubles = list(id_set)
-                            for page in self._paginate(ids_no_doubles, 100):
-                                self._save_users(page, list_total_users)
-                            # if full ego network is not collected, save the relationships between the ego user
-                            # and the friends
-                            if not relationships_checked:
-                                for friend_id in ids_no_doubles:
-                                    relation = TwitterRelationship(from_user_id=ego_user.user_id, to_user_id=friend_id,
-                                                                   relation_used="followers")
-                                    #relation.save()
-                        except tweepy.TweepError as e:
-                            print("Error in get followers: {0}".format(e))
-                            # reset connection when api cannot connect
-                            time.sleep(50)
-                            self.api = self.authenticate()
-                            continue
-                        break
-            print("End of collect followers")
+                    ego_user = self.ego_users.by_screen_name(name)
+                    # user objects are looked up while the follower ids are still being paged
+                    ids, finished = self._page_ego_ids(name, 'followers', ego_user, save_users, journal)
+                    # if full ego network is not collected, save the relationships between the ego user
+                    # and the followers that were found
+                    if not relationships_checked:
+                        self.graph.add_edges(ego_user.user_id, ids, Relation.FOLLOWERS)
+                    if journal is not None and finished:
+                        # the edges of an unfinished phase stay with its pages, a restarted run adds them
+                        journal.finish_phase("followers:" + name, [] if relationships_checked else
+                                             [(ego_user.user_id, follower_id) for follower_id in ids], "followers")
+            logger.info("End of collect followers")
 
         if list_memberships:
-            print("Collect list memberships")
+            logger.info("Collect list memberships")
             for name in names_list:
                 if name:
                     # check first if list is not empty
-                    ego_user = self._get_user(name, list_ego_users)
-                    while True:
-                        try:
-                            for twitter_lists in tweepy.Cursor(self.api.lists_memberships, screen_name=name).pages():
-                                time.sleep(1)
-                                # for a many to many relationship, the object has to be saved first,
-                                # then the relationship can be added
-                                for twitter_list in twitter_lists:
-                                    twitterlist = TwitterList(list_id=twitter_list.id, list_name=twitter_list.name,
-                                                            list_full_name=twitter_list.full_name)
-                                    #twitterlist.save()
-                                    twitterlist.user_membership.add(ego_user)
-                        except tweepy.TweepError as e:
-                            print("Error in list memberships: {}".format(e))
-                            # reset connection when api cannot connect
-                            time.sleep(50)
-                            self.api = self.authenticate()
-                            continue
-                        break
-            print("End of collect list memberships")
+                    ego_user = self.ego_users.by_screen_name(name)
+                    try:
+                        for twitter_lists in tweepy.Cursor(self._method('lists/memberships', 'lists_memberships'),
+                                                           screen_name=name).pages():
+                            # for a many to many relationship, the object has to be saved first,
+                            # then the relationship can be added
+                            for twitter_list in twitter_lists:
+                                twitterlist = TwitterList(list_id=twitter_list.id, list_name=twitter_list.name,
+                                                        list_full_name=twitter_list.full_name)
+                                #twitterlist.save()
+                                twitterlist.user_membership.add(ego_user)
+                    except tweepy.TweepError as e:
+                        self.retry.skip('list_memberships', name, e)
+            logger.info("End of collect list memberships")
 
         # Collect lists the ego user subscribes to
         if list_subscriptions:
-            print("Collect list subscriptions")
+            logger.info("Collect list subscriptions")
             for name in names_list:
                 if name:
                     # check first if list is not empty
-                    ego_user = self._get_user(name, list_ego_users)
-                    while True:
-                        try:
-                            for twitter_lists in tweepy.Cursor(self.api.lists_subscriptions, screen_name=name).pages():
-                                time.sleep(1)
-                                for twitter_list in twitter_lists:
-                                    twitterlist = TwitterList(list_id=twitter_list.id, list_name=twitter_list.name,
-                                                              list_full_name=twitter_list.full_name)
-                                    #twitterlist.save()
-                                    twitterlist.user_subscription.add(ego_user)
-                        except tweepy.TweepError as e:
-                            # reset connection when api cannot connect
-                            print("Tweeperror in list subscriptions: {}".format(e))
-                            time.sleep(50)
-                            self.api = self.authenticate()
-                            continue
-                        print("End of collect list subscriptions")
-                        break
+                    ego_user = self.ego_users.by_screen_name(name)
+                    try:
+                        for twitter_lists in tweepy.Cursor(self._method('lists/subscriptions', 'lists_subscriptions'),
+                                                           screen_name=name).pages():
+                            for twitter_list in twitter_lists:
+                                twitterlist = TwitterList(list_id=twitter_list.id, list_name=twitter_list.name,
+                                                          list_full_name=twitter_list.full_name)
+                                #twitterlist.save()
+                                twitterlist.user_subscription.add(ego_user)
+                    except tweepy.TweepError as e:
+                        self.retry.skip('list_subscriptions', name, e)
+            logger.info("End of collect list subscriptions")
 
         # list with all ids of the EGO-users, and friends and followers (to speed up lookup later)
         if relationships_checked:
-            list_total_users_ids = set()
-            for user in list_total_users:
-                list_total_users_ids.add(user.user_id)
-            # Compare the total number of friends, and the total number of followers
-            # The lowest number will be used to build the relationship table
-            total_friends = 0
-            total_followers = 0
-            print("Total number of users: {0}".format(len(list_total_users)))
-            for user in list_total_users:
-                total_friends += user.friends_count
-                total_followers += user.followers_count
-            if total_friends <= total_followers:
-                print("Build relationships based on friends")
-                # build friends relationshis if the total number of friends is lower or equal to the followers count
-                for user in list_total_users:
-                    # check if user is not protected, otherwise endless loop in resetting connection
-                    if not user.is_protected:
-                        list_ids = list()
-                        # collect all friends ids of the user
-                        # counter to avoid eternal loop
-                        tweeperror_count = 0
-                        while True:
-                            time.sleep(20)
-                            try:
-                                for user_ids in tweepy.Cursor(self.api.friends_ids, user_id=user.user_id).pages():
-                                    for user_id in user_ids:
-                                        list_ids.append(user_id)
-                            except tweepy.TweepError as e:
-                                # to avoid eternal loop, break if too many tweeperrors
-                                tweeperror_count += 1
-                                if tweeperror_count > 20:
-                                    print("Too much times Tweeperror in relations based on friends, break")
-                                    break
-                                # Sometimes an Not authorized error is thrown for some users, resulting in endless loop
-                                # Catch this error and break when it happens
-                                if "Not authorized" in str(e):
-                                    print("Not authorized error in relationships based on followers")
-                                    break
-                                # Sometimes page does not exist error, catch and break
-                                if "page does not exist" in str(e):
-                                    print("Page does not exist error")
-                                    break
-                                # reset connection
-                                print("Tweeperror in relations friends: resetting connection {}".format(e))
-                                self.api = self.authenticate()
-                                time.sleep(50)
-                                continue
-                            break
-                        # remove duplicates
-                        set_ids = set(list_ids)
-                        list_no_duplicates = list(set_ids)
-                        for user_id in list_no_duplicates:
-                            if user_id in list_total_users_ids and user_id != user.user_id:
-                                relation = TwitterRelationship(from_user_id=user.user_id, to_user_id=user_id,
-                                                                   relation_used="friends")
-                                # try:
-                                #     relation = TwitterRelationship(from_user_id=user.user_id, to_user_id=user_id,
-                                #                                    relation_used="friends")
-                                #     relation.save()
-                                # except OperationalError as e:
-                                #     # if MySql closes the connection: reopen connection and retry one time
-                                #     print("Operationalerror: {}".format(e))
-                                #     connection.close()
-                                #     try:
-                                #         relation = TwitterRelationship(from_user_id=user.user_id, to_user_id=user_id,
-                                #                                        relation_used="followers")
-                                #         relation.save()
-                                #     except OperationalError as e:
-                                #         print("Two times operationalerror, stop retry");
-                    else:
-                        print("User is protected")
-                print("end of relationships friends")
-            else:
-                print("Build relationships based on followers")
-                # build followers relationships if the total numbert of followers is lower than
-                for user in list_total_users:
-                    # check if user is not protected, otherwise endless loop in resetting connection
-                    if not user.is_protected:
-                        list_ids = list()
-                        # collect all follower ids of the user
-                        # counter to avoid eternal loop
-                        tweeperror_count = 0
-                        while True:
-                            time.sleep(20)
-                            try:
-                                for user_ids in tweepy.Cursor(self.api.followers_ids, user_id=user.user_id).pages():
-                                    for user_id in user_ids:
-                                        list_ids.append(user_id)
-                            except tweepy.TweepError as e:
-                                # to avoid eternal loop, break if too many tweeperrors
-                                tweeperror_count += 1
-                                if tweeperror_count > 20:
-                                    print("Too much times Tweeperror in relations based on followers, break")
-                                    break
-                                # Sometimes an Not authorized error is thrown for some users, resulting in endless loop
-                                # Catch this error en break when it happens
-                                if "Not authorized" in str(e):
-                                    print("Not authorized error in relationships based on followers: {}".format(e))
-                                    break
-                                # Sometimes page does not exist error
-                                if "page does not exist" in str(e):
-                                    print("Page does not exist error")
-                                    break
-                                print("Tweeperror in relations followers, resetting connection: {}".format(e))
-                                self.api = self.authenticate()
-                                time.sleep(50)
-                                continue
-                            break
-                        # remove duplicates
-                        set_ids = set(list_ids)
-                        list_no_duplicates = list(set_ids)
-                        for user_id in list_no_duplicates:
-                            if user_id in list_total_users_ids and user_id != user.user_id:
-                                relation = TwitterRelationship(from_user_id=user.user_id, to_user_id=user_id,
-                                                               relation_used="followers")
-                                # try:
-                                #     relation = TwitterRelationship(from_user_id=user.user_id, to_user_id=user_id,
-                                #                                    relation_used="followers")
-                                #     relation.save()
-                                # except OperationalError as e:
-                                #     # if MySql closes the connection: retry one time
-                                #     print("Operationalerror: {}".format(e))
-                                #     connection.close()
-                                #     try:
-                                #         relation = TwitterRelationship(from_user_id=user.user_id, to_user_id=user_id,
-                                #                                        relation_used="followers")
-                                #         relation.save()
-                                #     except OperationalError as e:
-                                #         print("Two times operationalerror, stop retry");
-                    else:
-                        print("User is protected")
-                print("end of relationships followers")
-        print("End of search")
-
-    def get_tweets_searchterms_searchapi(self, query_params):
+            network_ids = self.network_users.ids()
+            # the number of cursor pages of friends and of followers decides which relationship is used,
+            # every user costs at least one request for a relationship it has
+            logger.info("Total number of users: {0}".format(len(self.network_users)))
+            plan = CrawlPlan(self.network_users, self.pool)
+            logger.info("Projected relationships budget: {0}".format(plan))
+            relation_used = plan.relation_used
+            logger.info("Build relationships based on {0}".format(relation_used))
+            # the id cursors of many users are walked at the same time, within the rate limit budget
+            crawler = RelationshipCrawler(self.pool, relation_used, network_ids, self.graph,
+                                          journal=journal, retry=self.retry)
+            crawler.crawl(list(self.network_users))
+            logger.info("end of relationships {0}".format(relation_used))
+        if journal is not None:
+            journal.close()
+        self._flush_sink()
+        logger.info("End of search")
+        return self.graph
+
+    def _page_ego_ids(self, name, relation_used, ego_user, save_users, journal):
+        """
+        Pages the friend or follower ids of an EGO-user, the users are looked up while the ids are still being paged
+        Every page is stored in the journal under the phase of the EGO-user, with the cursor of the next page.
+        A restarted run passes the stored pages through the pipeline again and continues with the next page
+        :param name: screen name of the EGO-user
+        :param relation_used: 'friends' or 'followers'
+        :param ego_user: TwitterUser object of the EGO-user
+        :param save_users: function that receives every list of hydrated users
+        :param journal: CrawlJournal, None to page from the first page
+        :return: tuple (set of the ids of all pages, True if the cursor reached the last page)
+        """
+        phase = relation_used + ":" + name
+        # the pipeline adds every id it hydrates or takes from the user cache, each id is looked up once
+        # and the set holds the ids of all pages once the cursor ends
+        ids = set()
+        pipeline = HydrationPipeline(self._lookup_users, save_users, seen=ids, cache=self.user_cache)
+        cursor = -1
+        stored_pages = list()
+        if journal is not None:
+            cursor = journal.next_cursor(ego_user.user_id, phase)
+            # the users of the stored pages come from the user cache, unless their lookup did not finish
+            stored_ids = [to_user_id for _, to_user_id in journal.load_edges(phase)]
+            if stored_ids:
+                stored_pages.append(stored_ids)
+        pages = tweepy.Cursor(self._method(relation_used + '/ids', relation_used + '_ids'), screen_name=name,
+                              cursor=cursor).pages()
+
+        def journaled_pages():
+            # a cursor of 0 is the end of the ids, tweepy would start from the first page
+            if cursor == 0:
+                return
+            for page in pages:
+                if journal is not None:
+                    journal.save_page(ego_user.user_id, phase, pages.next_cursor,
+                                      [(ego_user.user_id, user_id) for user_id in page])
+                yield page
+        try:
+            pipeline.run(chain(stored_pages, journaled_pages()))
+        except tweepy.TweepError as e:
+            # pages are retried by the policy, a restarted run continues after the last stored page
+            self.retry.skip(relation_used, name, e)
+            return ids, False
+        return ids, True
+
+    def get_tweets_searchterms_searchapi(self, query_params, watermarks=None, max_workers=8, slice_hours=None,
+                                         backfill=None):
         """
         Get tweets of seven days in the past, based on a list of search terms (ex hashtags)
         :param query: list of search terms
+        :param watermarks: path of the database with the newest tweet id of every query, a search that is repeated
+                           with the same database only fetches the tweets that are newer
+        :param max_workers: maximum number of queries searched at once
+        :param slice_hours: split the seven days of every query into slices of this many hours (24 for days),
+                            the slices are paged at the same time, None to page every query from the newest tweet
+        :param backfill: path of the database with the progress of every slice, a backfill that is restarted
+                         with the same database continues the slices it did not finish
         """
-        # using the Tweepy Cursor, there might be a memory leak that crashes the program
-        # TODO: check memory usage
+        watermarks = WatermarkStore(watermarks) if watermarks is not None else None
         # http://www.karambelkar.info/2015/01/how-to-use-twitters-search-rest-api-most-effectively./
+        # the search terms are quoted and connected with the OR operator, every query is filled up to the
+        # maximum query length, empty strings are removed
+        query_strings = pack_queries(query_params, '"{0}"'.format)
+        # a tweet matching several queries is stored once
+        seen = SeenIds()
+        if slice_hours is None:
+            ShardedSearch(self.pool, 'search/tweets', max_workers).run(
+                query_strings, lambda query_string: self._search_query(query_string, watermarks, seen))
+        else:
+            self._backfill(query_strings, watermarks, seen, slice_hours, backfill, max_workers)
+        self._flush_sink()
+        if watermarks is not None:
+            watermarks.close()
+        logger.info("End of search, {0} tweets, {1} duplicates".format(len(seen), seen.duplicates))
 
-        # split the query into 10 keywords per query, they will will be connected with the OR operator
-        # remove empty strings from parameters
-
-        query_params = filter(None, query_params)
-        query_strings = list()
-        query_operator = " OR "
-        # get date of today for until parameter
-        today = time.strftime("%Y-%m-%d")
-        date_today = datetime.strptime(today, "%Y-%m-%d").date()
-        since = date_today - timedelta(days=7)
-        # if more than 10 params, multiple queries will be necessary
-        for params in self._paginate(query_params, 10):
-            # join max 10 parameters with the OR operator and add quotes
-            query_strings.append(query_operator.join('"{0}"'.format(param) for param in params))
-        # lookup the tweets in chunks of 10 params
+    def _search_query(self, query_string, watermarks, seen):
+        """
+        Pages the tweets of one query from the newest tweet down to the watermark of the query
+        :param query_string: the query
+        :param watermarks: WatermarkStore, None to page the whole window
+        :param seen: SeenIds of the search
+        """
+        logger.debug("Get tweets based on query string: %s", query_string)
+        # the newest tweet of the previous run of the query, the search stops there
+        since_id = watermarks.since_id("search:" + query_string) if watermarks is not None else None
+        finished, newest_id, tweet_count = self._page_search(query_string, seen, since_id=since_id)
+        logger.info("Downloaded %d tweets for %s", tweet_count, query_string)
+        if finished and watermarks is not None and newest_id:
+            # the tweets are stored first, a run that stops before this fetches them again
+            self._flush_sink()
+            watermarks.advance("search:" + query_string, newest_id)
+
+    def _backfill(self, query_strings, watermarks, seen, slice_hours, backfill, max_workers):
+        """
+        Pages the time slices of all queries at the same time, the watermark of a query is advanced
+        once all its slices are finished
+        :param query_strings: list of queries
+        :param watermarks: WatermarkStore or None
+        :param seen: SeenIds of the search
+        :param slice_hours: length of a slice in hours
+        :param backfill: path of the BackfillJournal database or None
+        :param max_workers: maximum number of slices paged at once
+        """
+        journal = BackfillJournal(backfill) if backfill is not None else None
+        slices = list()
+        # query -> (finished, newest id) of every slice
+        results = dict((query_string, list()) for query_string in query_strings)
         for query_string in query_strings:
-            '''
-            print("Get tweets based on query string: {0}".format(query_string))
-            until = date_today + timedelta(days=1)
-            while True:
-                try:
-                    for statuses in tweepy.Cursor(self.api.search, q=query_string, since=since, until=until, count=100,
-                                                include_entities=True).pages():
-                        for status in statuses:
-                            try:
-                                self._save_tweet(status=status, task_id=task_id)
-                            except:
-                                print("Exception in save tweet")
-                                continue
-                        time.sleep(0.3)
-                    break
-                except tweepy.TweepError as e:
-                    print("Error in searchterms {0}".format(e))
-                    time.sleep(50)
-                    self.authenticate()
-                    continue
-            print("No more tweets for {0}".format(query_string))
-            '''
-            maxTweets = 10000000 # Some arbitrary large number
-            tweets_per_query = 100  # this is the max the API permits
-            since_id = None
+            since_id = watermarks.since_id("search:" + query_string) if watermarks is not None else None
+            for piece in plan_slices(query_string, slice_hours, since_id):
+                next_max_id, newest_id, done = (None, None, False) if journal is None else journal.progress(piece)
+                if done:
+                    results[query_string].append((True, newest_id))
+                else:
+                    slices.append(piece)
+        logger.info("Backfill of {0} queries in {1} slices of {2} hours".format(len(query_strings), len(slices),
+                                                                          slice_hours))
+        paged = ShardedSearch(self.pool, 'search/tweets', max_workers).run(
+            slices, lambda piece: self._search_slice(piece, watermarks, seen, journal))
+        for piece, result in paged.items():
+            results[piece.query].append(result)
+        self._flush_sink()
+        if watermarks is not None:
+            for query_string, slice_results in results.items():
+                newest_ids = [newest_id for finished, newest_id in slice_results if newest_id]
+                if newest_ids and all(finished for finished, newest_id in slice_results):
+                    watermarks.advance("search:" + query_string, max(newest_ids))
+        if journal is not None:
+            journal.close()
+
+    def _search_slice(self, piece, watermarks, seen, journal):
+        """
+        Pages the tweets of one slice, the progress is stored in the journal every few pages
+        The newest slice runs up to now and is paged again by every run, its progress is not stored
+        :param piece: Slice object
+        :param watermarks: WatermarkStore or None
+        :param seen: SeenIds of the search
+        :param journal: BackfillJournal or None
+        :return: tuple (finished, newest tweet id of the slice)
+        """
+        since_id = piece.since_id
+        if watermarks is not None:
+            since_id = max(since_id, watermarks.since_id("search:" + piece.query) or 0)
+        max_id, newest_id = piece.max_id, None
+        checkpoint = None
+        if journal is not None and piece.end is not None:
+            next_max_id, newest_id, _ = journal.progress(piece)
+            if next_max_id is not None:
+                max_id = next_max_id
+
+            def save_progress(next_max_id, newest_id, finished):
+                # the tweets above next_max_id are stored first
+                self._flush_sink()
+                journal.save(piece, next_max_id, newest_id, finished)
+            checkpoint = save_progress
+        finished, found_id, _ = self._page_search(piece.query, seen, since_id=since_id, max_id=max_id,
+                                                  newest_id=newest_id, checkpoint=checkpoint)
+        return finished, found_id
+
+    def _page_search(self, query_string, seen, since_id=None, max_id=None, newest_id=None, checkpoint=None,
+                     checkpoint_pages=10):
+        """
+        Pages the tweets of a query with max_id, from max_id down to since_id
+        :param query_string: the query
+        :param seen: SeenIds of the search
+        :param since_id: the search stops at this tweet id, None for the whole window
+        :param max_id: the search starts at this tweet id, None for the newest tweet
+        :param newest_id: highest tweet id found before, by an earlier run of the same pages
+        :param checkpoint: function called with the next max_id, the newest id and whether the search is finished,
+                           every checkpoint_pages pages and at the end, None to keep no progress
+        :param checkpoint_pages: number of pages between two checkpoints
+        :return: tuple (finished, newest tweet id, number of tweets)
+        """
+        maxTweets = 10000000 # Some arbitrary large number
+        tweets_per_query = 100  # this is the max the API permits
+        parameters = dict(q=query_string, count=tweets_per_query)
+        if since_id:
+            parameters['since_id'] = since_id
+        finished = False
+        tweet_count = 0
+        pages = 0
+        search = self._method('search/tweets', 'search')
+        while tweet_count < maxTweets:
             # If results only below a specific ID are, set max_id to that ID.
             # else default to no upper limit, start from the most recent tweet matching the search query.
-            max_id = -1
-            tweet_count = 0
-            while tweet_count < maxTweets:
-                try:
-                    if max_id <= 0:
-                        if not since_id:
-                            new_tweets = self.api.search(q=query_string, count=tweets_per_query)
-                        else:
-                            new_tweets = self.api.search(q=query_string, count=tweets_per_query, since_id=since_id)
-                    else:
-                        if not since_id:
-                            new_tweets = self.api.search(q=query_string, count=tweets_per_query, max_id=str(max_id - 1))
-                        else:
-                            new_tweets = self.api.search(q=query_string, count=tweets_per_query,max_id=str(max_id - 1)
-                                                         ,since_id=since_id)
-                    if not new_tweets:
-                        print("No more tweets found")
-                        break
-                    for tweet in new_tweets:
-                        try:
-                            print(tweet)
-                            #self._save_tweet(status=tweet)
-                        except:
-                            print("Exception in save tweet")
-                            continue
-                    tweet_count += len(new_tweets)
-                    print("Downloaded {0} tweets".format(tweet_count))
-                    max_id = new_tweets[-1].id
-                    time.sleep(1)
-                except tweepy.TweepError as e:
-                    # Just exit if any error
-                    print("some error : " + str(e))
-                    time.sleep(100)
-                    continue
-
-        print("End of search")
-
-    def get_tweets_names_searchapi(self, query_params):
+            if max_id is not None:
+                parameters['max_id'] = str(max_id)
+            try:
+                new_tweets = search(parser=RAW_JSON, **parameters)['statuses']
+            except tweepy.TweepError as e:
+                halves = split_query(query_string) if pages == 0 and too_complex(e) else None
+                if halves is None:
+                    # the query is not finished, its watermark stays and the checkpoint keeps the pages done
+                    self.retry.skip('search', query_string, e)
+                    break
+                # the halves of a query the API rejects are paged within the same bounds, the progress of the
+                # halves is not kept, a restarted run pages them again
+                logger.info("Query too complex, split in two: %s", query_string)
+                results = [self._page_search(half, seen, since_id=since_id, max_id=max_id, newest_id=newest_id)
+                           for half in halves]
+                finished = all(result[0] for result in results)
+                newest_id = max([newest_id or 0] + [result[1] or 0 for result in results]) or None
+                tweet_count += sum(result[2] for result in results)
+                break
+            if not new_tweets:
+                finished = True
+                break
+            newest_id = max(newest_id or 0, new_tweets[0]['id'])
+            self._save_tweets(new_tweets, seen)
+            tweet_count += len(new_tweets)
+            max_id = new_tweets[-1]['id'] - 1
+            pages += 1
+            if checkpoint is not None and pages % checkpoint_pages == 0:
+                checkpoint(max_id, newest_id, False)
+        if checkpoint is not None:
+            checkpoint(max_id, newest_id, finished)
+        return finished, newest_id, tweet_count
+
+    def get_tweets_names_searchapi(self, query_params, watermarks=None, max_workers=8):
         """
         Get tweets of seven days in the past, based on a list of usernames
         :param query_params: list of user names
+        :param watermarks: path of the database with the newest tweet id of every query, a search that is repeated
+                           with the same database only fetches the tweets that are newer
+        :param max_workers: maximum number of queries searched at once
         """
-        # add from: and to: to all usernames
-        query_params = filter(None, query_params)
-        query_strings = list()
-        query_operator_or = " OR "
-        query_operator_from = "from:"
-        query_operator_to = "to:"
-        for params in self._paginate(query_params, 5):
-            query_strings.append(query_operator_or.join('{0}{1} OR {2}{3}'
-                                                        .format(query_operator_from, param, query_operator_to, param)
-                                                        for param in params))
-        for query_string in query_strings:
-            print(query_string)
-            while True:
-                try:
-                    for statuses in tweepy.Cursor(self.api.search, q=query_string,  count=100,
-                                                include_entities=True).pages():
-                        for status in statuses:
-                            try:
-                                print(status)
-                                #self._save_tweet(status=status)
-                            except:
-                                print("Error in save tweet names searchapi")
-                                pass
-                            time.sleep(0.3)
-                except tweepy.TweepError as e:
-                    print("Error in cursor save tweet names searchapi: {}".format(e))
-                    time.sleep(50)
-                    self.authenticate()
-                    continue
-            print("No more tweets for {0}".format(query_string))
-        print("End of search")
-
-    def get_tweets_timeline(self, names):
+        watermarks = WatermarkStore(watermarks) if watermarks is not None else None
+        # add from: and to: to all usernames, every query is filled up to the maximum query length
+        query_strings = pack_queries(query_params, lambda name: "from:{0} OR to:{0}".format(name))
+        # the tweets between two of the users match two queries
+        seen = SeenIds()
+        search = self._method('search/tweets', 'search')
+        ShardedSearch(self.pool, 'search/tweets', max_workers).run(
+            query_strings, lambda query_string: self._collect_since(
+                watermarks, "search:" + query_string, search, "search",
+                seen=seen, q=query_string, count=100, include_entities=True))
+        self._flush_sink()
+        if watermarks is not None:
+            watermarks.close()
+        logger.info("End of search, {0} tweets, {1} duplicates".format(len(seen), seen.duplicates))
+
+    def get_tweets_timeline(self, names, watermarks=None, max_workers=16):
         """
         Get the tweets of a user using GET statuses/user_timeline
+        The timelines of many users are paged at the same time, within the rate limit budget
         :param names: a list of names to get the timeline of
+        :param watermarks: path of the database with the newest tweet id of every timeline, a search that is
+                           repeated with the same database only fetches the tweets that are newer
+        :param max_workers: maximum number of timelines paged at once
         """
-        user_names = filter(None, names)
+        watermarks = WatermarkStore(watermarks) if watermarks is not None else None
+        user_names = [name for name in names if name]
+        # 100 names per request, the timelines are asked by id
+        users = self._lookup_screen_names(user_names)
+        timelines = list()
         for name in user_names:
-            print("Timeline search of {0}".format(name))
-            while True:
-                try:
-                    for statuses in tweepy.Cursor(self.api.user_timeline, screen_name=name).pages():
-                        for status in statuses:
-                            try:
-                                print(status)
-                                #self._save_tweet(status=status)
-                            except:
-                                pass
-                            time.sleep(0.3)
-                except tweepy.TweepError as e:
-                    print("Error in cursor in timeline: {}".format(e))
-                    time.sleep(50)
-                    self.authenticate()
-                    continue
-        print("Timeline search ended")
+            user = users.get(name.lower())
+            if user is None:
+                logger.info("Timeline search of %s: user does not exist", name)
+            elif user.is_protected:
+                logger.info("Timeline search of %s: user is protected", name)
+            elif name.lower() not in timelines:
+                timelines.append(name.lower())
+        ShardedSearch(self.pool, 'statuses/user_timeline', max_workers).run(
+            timelines, lambda name: self._harvest_timeline(users[name], watermarks))
+        self._flush_sink()
+        if watermarks is not None:
+            watermarks.close()
+        logger.info("Timeline search ended")
+
+    def _harvest_timeline(self, user, watermarks):
+        """
+        Pages the timeline of one user with max_id, from the newest tweet down to the watermark of the user or
+        the 3200 tweets the API returns at most
+        :param user: TwitterUser object
+        :param watermarks: WatermarkStore, None to page the whole timeline
+        """
+        query = "timeline:" + user.screen_name.lower()
+        since_id = watermarks.since_id(query) if watermarks is not None else None
+        # the user of every status is the same, trim_user leaves it out of the pages
+        parameters = dict(user_id=user.user_id, count=TIMELINE_PAGE_SIZE, trim_user=True, include_rts=True)
+        if since_id:
+            parameters['since_id'] = since_id
+        newest_id = since_id
+        tweet_count = 0
+        timeline = self._method('statuses/user_timeline', 'user_timeline')
+        while tweet_count < TIMELINE_LIMIT:
+            try:
+                statuses = timeline(parser=RAW_JSON, **parameters)
+            except tweepy.TweepError as e:
+                # the watermark is not advanced, the next run pages the timeline again
+                self.retry.skip('timeline', user.screen_name, e)
+                return
+            if not statuses:
+                break
+            newest_id = max(newest_id or 0, statuses[0]['id'])
+            self._save_tweets(statuses, screen_name=user.screen_name)
+            tweet_count += len(statuses)
+            parameters['max_id'] = statuses[-1]['id'] - 1
+        logger.info("Downloaded %d tweets of %s", tweet_count, user.screen_name)
+        if watermarks is not None and newest_id:
+            # the tweets are stored first, a run that stops before this fetches them again
+            self._flush_sink()
+            watermarks.advance(query, newest_id)
 
     def collect_random_tweets(self):
         """
         Collect a number of random tweets from the search API
         """
-        print("Random tweet search started")
+        logger.info("Random tweet search started")
         query = "en OR of OR is OR het OR de"
         while True:
             try:
-                for statuses in tweepy.Cursor(self.api.search, q=query, lang='nl').pages():
-                    for status in statuses:
-                        print(status)
-                        #self._save_tweet(status=status)
+                for statuses in tweepy.Cursor(self._method('search/tweets', 'search'), q=query, lang='nl').pages():
+                    self._save_tweets(statuses)
             except tweepy.TweepError as e:
-                print("Error in random tweets: {}".format(e))
-                self.authenticate()
-                continue
-        print("Random tweet search ended")
+                # the requests were retried by the policy already
+                self.retry.skip('random', query, e)
+                break
+        self._flush_sink()
+        logger.info("Random tweet search ended")
+
+    def _collect_since(self, watermarks, query, method, collector, seen=None, **kwargs):
+        """
+        Pages the statuses of a query from the newest tweet down to its watermark and stores them,
+        the watermark is advanced once the cursor has no more pages
+        :param watermarks: WatermarkStore, None to page the whole window
+        :param query: key of the query in the WatermarkStore
+        :param method: rate limited api method that returns statuses
+        :param collector: name of the collector, recorded by the retry policy when the query is skipped
+        :param seen: SeenIds the statuses are deduplicated against, None to store all statuses
+        :param kwargs: parameters of the method
+        """
+        since_id = watermarks.since_id(query) if watermarks is not None else None
+        if since_id:
+            kwargs['since_id'] = since_id
+        newest_id = since_id
+        pages = 0
+        try:
+            for statuses in tweepy.Cursor(method, **kwargs).pages():
+                if statuses:
+                    # the newest tweet comes first
+                    newest_id = max(newest_id or 0, statuses[0].id)
+                self._save_tweets(statuses, seen)
+                pages += 1
+        except tweepy.TweepError as e:
+            halves = split_query(kwargs['q']) if 'q' in kwargs and pages == 0 and too_complex(e) else None
+            if halves is not None:
+                # the halves of a query the API rejects are searched on their own, with their own watermarks
+                logger.info("Query too complex, split in two: %s", kwargs['q'])
+                kwargs.pop('since_id', None)
+                for half in halves:
+                    self._collect_since(watermarks, "search:" + half, method, collector, seen=seen,
+                                        **dict(kwargs, q=half))
+                return
+            # the pages were retried by the policy, the watermark stays so the next run fetches the query again
+            self.retry.skip(collector, query, e)
+            return
+        if watermarks is not None and newest_id:
+            # the tweets are stored first, a run that stops before this fetches them again
+            self._flush_sink()
+            watermarks.advance(query, newest_id)
+
+    def stream_terms(self, terms, languages=None, **listener_options):
+        """
+        Collect the tweets of a list of search terms with the streaming API, the stream runs on a background
+        thread and reconnects after errors and disconnects
+        :param terms: list of search terms (ex hashtags)
+        :param languages: list of language codes the tweets are filtered on, None for all languages
+        :param listener_options: options of the TweetsStreamListener, ex overflow
+        :return: the StreamSupervisor, update changes the terms, stop ends the stream
+        """
+        return self._stream(listener_options, track=[term for term in terms if term], languages=languages)
+
+    def stream_users(self, ids, **listener_options):
+        """
+        Collect the tweets of and to a list of users with the streaming API, the stream runs on a background
+        thread and reconnects after errors and disconnects
+        :param ids: list of ids of users
+        :param listener_options: options of the TweetsStreamListener, ex overflow
+        :return: the StreamSupervisor, update changes the users, stop ends the stream
+        """
+        return self._stream(listener_options, follow=[str(user_id) for user_id in ids if user_id])
+
+    def _stream(self, listener_options, **predicates):
+        """
+        Starts a supervised stream with the keys of the first credential, one stream is allowed per account
+        :param listener_options: options of the TweetsStreamListener
+        :param predicates: track, follow and languages of the filter
+        :return: the started StreamSupervisor
+        """
+        listener = TweetsStreamListener(self.api, sink=self.sink, tweet_index=self.tweet_index, **listener_options)
+        return StreamSupervisor(self.api.auth, listener, **predicates).start()
 
     def get_ids_from_screennames(self, screennames):
         """
@@ -549,153 +749,166 @@ class TwitterTweepy:
         # Returns fully-hydrated user objects for up to 100 users per request,
         # as specified by comma-separated values passed to the user_id and/or screen_name parameters.
 
-        # paginate in chunks of 100
-        ids_list = list()
-        for names in self._paginate(screennames, 100):
-            users = self.api.lookup_users(screen_names=names)
-            for user in users:
-                ids_list.append(user.id_str)
-        return ids_list
+        return [str(user.user_id) for user in self._lookup_screen_names(screennames).values()]
 
-    def _save_users(self, ids,user_list):
+    def _lookup_screen_names(self, screen_names):
+        """
+        converts screen names to objects, 100 names per request, users in the user cache are not looked up
+        :param screen_names: list of screen names
+        :return: dict lower case screen name -> TwitterUser object, names that do not exist are left out
+        """
+        users = dict()
+        missing_names = list()
+        for screen_name in screen_names:
+            cached_user = self.user_cache.get_by_screen_name(screen_name)
+            if cached_user is None:
+                missing_names.append(screen_name)
+            else:
+                users[screen_name.lower()] = cached_user
+        # paginate in chunks of 100
+        for names in batches(missing_names, LOOKUP_SIZE):
+            try:
+                found_users = self._method('users/lookup', 'lookup_users')(screen_names=names)
+            except tweepy.TweepError as e:
+                # error 17: none of the names in the request exists
+                if e.api_code == 17:
+                    continue
+                raise
+            new_users = [self._twitter_user(user) for user in found_users]
+            self.user_cache.put_many(new_users)
+            for twitter_user in new_users:
+                users[twitter_user.screen_name.lower()] = twitter_user
+        return users
+
+    def _lookup_users(self, ids):
         """
-        converts a hundred ids of users to objects, saves them and adds them to a list
+        converts a hundred ids of users to objects, users in the user cache are not looked up
         :param ids: max 100
-        :param user_list: a list the users will be added to
-        """
-        users = self.api.lookup_users(user_ids=ids)
-        for user in users:
-            twitter_user = TwitterUser(user_id=user.id, name=user.name, screen_name=user.screen_name,
-                                       friends_count=user.friends_count, followers_count=user.followers_count, is_protected=user.protected,
-                                       user_description=user.description, date_created=user.created_at,
-                                       url=user.url, profile_image_url=user.profile_image_url, language=user.lang,
-                                       location=user.location, default_profile_image=user.default_profile_image,
-                                       verified=user.verified)
-            #twitter_user.save()
-            user_list.append(twitter_user)
-
-    def _paginate(self, iterable, page_size):
-        """
-        iterates over an iterable in <page size> pieces
-        code from http://stackoverflow.com/questions/14265082/query-regarding-pagination-in-
-        tweepy-get-followers-of-a-particular-twitter-use
-        http://stackoverflow.com/questions/3744451/is-this-how-you-paginate-or-is-there-a-better-algorithm/3744531#3744531
-        :param iterable: the iterable to iterate over
-        :param page_size: the max page size returned
-        :return: generator
+        :return: a list of TwitterUser objects
         """
-        while True:
-            # https://docs.python.org/3.5/library/itertools.html
-            # itertools.tee(iterable, n=2) Return n independent iterators from a single iterable
-            # tee returns two copies of the iterable
-            i1, i2 = itertools.tee(iterable)
-            # start of iterable is shifted page_size times / first -> page size items placed in page
-            iterable, page = (itertools.islice(i1, page_size, None), list(itertools.islice(i2, page_size)))
-            if len(page) == 0:
-                break
-            yield page
-
-    def _get_user(self, name, list_users):
-        """
-        returns the user with the username from the given list
-        :param name: name of the user
-        :param list_users: the list of users
-        :return: TwitterUser object with the name
-        """
-        for user in list_users:
-            print("get user method {} {}".format(name, user.screen_name))
-            if user.screen_name.lower() == name.lower():
-                return user
-
-    def _save_tweet(self, status):
-        """
-        saves a tweet into the database
-        :param status: the tweet
-        """
-        text_of_tweet = ""
-        hashtags = ""
-        urls = ""
-        mentions = ""
-        delimiter = ";"
-        is_retweet = False
-        status_id = 0
-        # check is the tweet is a retweet
-        # if it is, add is_retweet = True and get the text from the original tweet (normal text is truncated)
-        if hasattr(status, 'retweeted_status'):
-            text_of_tweet = status.retweeted_status.text
-            is_retweet = True
+        user_list, missing_ids = self.user_cache.partition(ids)
+        if missing_ids:
+            try:
+                users = self._method('users/lookup', 'lookup_users')(user_ids=missing_ids)
+            except tweepy.TweepError as e:
+                # error 17: none of the ids exists, ids of friends and followers can be deleted or suspended users
+                if e.api_code != 17:
+                    raise
+                users = list()
+            new_users = [self._twitter_user(user) for user in users]
+            self.user_cache.put_many(new_users)
+            user_list.extend(new_users)
+        return user_list
+
+    def _twitter_user(self, user):
+        """
+        converts a tweepy user to a TwitterUser object
+        :param user: the tweepy user
+        :return: TwitterUser object
+        """
+        return TwitterUser(user_id=user.id, name=user.name, screen_name=user.screen_name,
+                           friends_count=user.friends_count, followers_count=user.followers_count, is_protected=user.protected,
+                           user_description=user.description, date_created=user.created_at,
+                           url=user.url, profile_image_url=user.profile_image_url, language=user.lang,
+                           location=user.location, default_profile_image=user.default_profile_image,
+                           verified=user.verified)
+
+    def _save_tweets(self, statuses, seen=None, screen_name=None):
+        """
+        converts a page of statuses and pushes them to the sink, prints them if there is no sink
+        :param statuses: list of tweepy statuses or raw status dicts
+        :param seen: SeenIds, statuses already stored by another query are skipped
+        :param screen_name: name of the tweeter of statuses without user (trim_user)
+        """
+        received = len(statuses)
+        if seen is not None:
+            statuses = seen.new(statuses)
+        if self.tweet_index is not None:
+            # before conversion, a tweet stored by an earlier page, collector or run costs nothing more
+            statuses = self.tweet_index.new(statuses)
+        metrics.inc('duplicates_total', received - len(statuses))
+        metrics.inc('tweets_total', len(statuses), source='rest')
+        if self.sink is None:
+            for status in statuses:
+                logger.debug("%s", status)
         else:
-            text_of_tweet = status.text
-        # get mentions, urls & hashtags
-        if hasattr(status, 'entities'):
-            for hashtag in status.entities['hashtags']:
-                hashtags += hashtag['text'] + delimiter
-            for mention in status.entities['user_mentions']:
-                mentions += mention['screen_name'] + delimiter
-            for url in status.entities['urls']:
-                urls += url['expanded_url'] + delimiter
-
-        # avoid a Runtimewarning: convert naive to non naive datetime
-        # TODO: still error maybe?
-        # quoted_status_id only exists if tweet is a quoted tweet
-        if hasattr(status, 'quoted_status_id'):
-            status_id = status.quoted_status_id
-        date_tweet = pytz.utc.localize(status.created_at)
-        tweet = Tweet(tweet_id=status.id_str,
-                      tweeter_id=status.user.id, tweeter_name=status.user.screen_name, tweet_text=text_of_tweet,
-                      tweet_date=date_tweet, is_retweet=is_retweet,
-                      mentions=mentions, hashtags=hashtags, hyperlinks=urls,
-                      coordinates=status.coordinates, favorite_count=status.favorite_count, id_str=status.id_str,
-                      in_reply_to_screen_name=status.in_reply_to_screen_name, retweet_count=status.retweet_count,
-                      source=status.source, quoted_status_id=status_id)
-        # retry if an operationalerror is thrown (deadlock)
-        # retry = True
-        # retry_times = 0
-        # while retry:
-        #     try:
-        #         tweet.save()
-        #         retry = False
-        #     except OperationalError as e:
-        #         print("Operationalerror in save tweet {0}: retry times = {1}".format(e, retry_times))
-        #         retry_times += 1
-        #         if retry_times > 10:
-        #             print("Too many times OperationalError, quitting save tweet")
-        #             retry = False
-        #     except UnicodeEncodeError as e:
-        #         print("Unicode error in save tweet: {0}".format(e))
-        #         retry = False
-        # del tweet
-
-
+            with metrics.timer('conversion_seconds', source='rest'):
+                tweets = statuses_to_tweets(statuses, screen_name)
+            self.sink.add_tweets(tweets)
+        if self.tweet_index is not None:
+            self.tweet_index.buffered(statuses)
+            if self.tweet_index.commit_due:
+                self._flush_sink()
+
+    def _flush_sink(self):
+        """
+        writes the tweets still buffered in the sink, at the end of a collector, and then marks their ids
+        as stored in the tweet index
+        """
+        _flush(self.sink, self.tweet_index)
 
 
 class TweetsStreamListener(tweepy.StreamListener):
     """
     Class for starting the stream api search based on names
+    The read thread of the stream only puts the raw statuses on the queue of a BackgroundWriter,
+    conversion and storage run on its workers so a slow sink does not back up the connection
     http://www.brettdangerfield.com/post/realtime_data_tag_cloud/
-    http://www.rabbitmq.com/tutorials/tutorial-one-python.html
     (21/12/2015)
     """
 
-    def __init__(self, api):
+    def __init__(self, api, sink=None, workers=2, max_queue=10000, overflow=BLOCK, spill_path=None,
+                 tweet_index=None):
+        """
+        :param api: tweepy api
+        :param sink: Sink that stores the tweets of the stream, None to print them
+        :param workers: number of threads converting and storing statuses
+        :param max_queue: maximum number of statuses waiting for the workers
+        :param overflow: what happens to a status when the queue is full: BLOCK, DROP_OLDEST or SPILL
+        :param spill_path: file statuses are spilled to with the SPILL policy
+        :param tweet_index: TweetIndex the statuses are checked against on the writer threads, None to store all
+        """
         self.api = api
+        self.sink = sink
+        self.tweet_index = tweet_index
         super(tweepy.StreamListener, self).__init__()
-
-        # setup of rabbitMQ connection
-        # connection = pika.BlockingConnection(pika.ConnectionParameters(''))
-        # self.channel = connection.channel()
-        # args = {"x-max-length": 2000}
-        # self.channel.queue_declare(queue='twitter_toppic_feed', arguments=args)
+        # read by the StreamSupervisor: HTTP status of the last failed connection, number of connections made
+        self.last_error = None
+        self.connects = 0
+        self.writer = None
+        if sink is not None:
+            self.writer = BackgroundWriter(self._store, workers=workers, max_size=max_queue, overflow=overflow,
+                                           spill_path=spill_path)
+
+    def on_data(self, raw_data):
+        """
+        Statuses are queued as raw JSON, without building tweepy objects on the read thread
+        Other messages (delete, limit, disconnect...) are handled by tweepy
+        :param raw_data: one message of the stream
+        """
+        if self.writer is None:
+            return super().on_data(raw_data)
+        data = json.loads(raw_data)
+        if 'in_reply_to_status_id' in data:
+            self.writer.put(data)
+            return True
+        return super().on_data(raw_data)
 
     def on_status(self, status):
-        self._save_tweet(status=status)
+        # only without a sink, the statuses go to the writer otherwise
+        logger.debug("%s", status)
+
+    def on_connect(self):
+        self.connects += 1
 
     def on_error(self, status_code):
-        print("Error in streaming tweets by name: " + str(status_code))
-        # return True
+        logger.warning("Error in streaming tweets by name: %s", status_code)
+        self.last_error = status_code
+        # the supervisor reconnects with its own backoff
+        return False
 
     def on_timeout(self):
-        print("timeout")
+        logger.warning("timeout")
         # return True
 
     def on_disconnect(self, notice):
@@ -705,56 +918,28 @@ class TweetsStreamListener(tweepy.StreamListener):
         """
         return False
 
-    def _save_tweet(self, status):
-        text_of_tweet = ""
-        hashtags = ""
-        urls = ""
-        mentions = ""
-        delimiter = ";"
-        is_retweet = False
-        status_id = 0
-        # check is the tweet is a retweet
-        # if it is, add is_retweet = True and get the text from the original tweet (normal text is truncated)
-        if hasattr(status, 'retweeted_status'):
-            text_of_tweet = status.retweeted_status.text
-            is_retweet = True
-        else:
-            text_of_tweet = status.text
-        # get mentions, urls & hashtags
-        if hasattr(status, 'entities'):
-            for hashtag in status.entities['hashtags']:
-                print(str(hashtag))
-                hashtags += hashtag['text'] + delimiter
-            for mention in status.entities['user_mentions']:
-                print(str(mention))
-                mentions += mention['screen_name'] + delimiter
-            for url in status.entities['urls']:
-                print(str(url))
-                urls += url['expanded_url'] + delimiter
-
-        # avoid a Runtimewarning: convert naive to non naive datetime
-        date_tweet = pytz.utc.localize(status.created_at)
-        if hasattr(status, 'quoted_status_id'):
-            status_id = status.quoted_status_id
-        tweet = Tweet(tweet_id=status.id_str,
-                      tweeter_id=status.user.id, tweeter_name=status.user.screen_name, tweet_text=text_of_tweet,
-                      tweet_date=date_tweet, is_retweet=is_retweet,
-                      mentions=mentions, hashtags=hashtags, hyperlinks=urls,
-                      coordinates=status.coordinates, favorite_count=status.favorite_count, id_str=status.id_str,
-                      in_reply_to_screen_name=status.in_reply_to_screen_name, retweet_count=status.retweet_count,
-                      source=status.source, quoted_status_id=status_id)
-        # retry if an operationalerror is thrown (deadlock)
-        # retry = True
-        # retry_times = 0
-        # while retry:
-        #     try:
-        #         tweet.save()
-        #         retry = False
-        #     except OperationalError:
-        #         print("Operationalerror in save tweet: retry times = {}".format(retry_times))
-        #         retry_times += 1
-        #         if retry_times > 10:
-        #             print("To many times OperationalError, quitting save tweet")
-        #             retry = False
-        #     except UnicodeEncodeError:
-        #         retry = False
+    def close(self):
+        """
+        Stores the statuses that are still queued and flushes the sink
+        """
+        if self.writer is not None:
+            self.writer.close()
+        _flush(self.sink, self.tweet_index)
+
+    def _store(self, statuses):
+        """
+        converts a batch of raw statuses and pushes them to the sink, runs on the writer threads
+        :param statuses: list of status dicts
+        """
+        received = len(statuses)
+        if self.tweet_index is not None:
+            statuses = self.tweet_index.new(statuses)
+        metrics.inc('duplicates_total', received - len(statuses))
+        metrics.inc('tweets_total', len(statuses), source='stream')
+        with metrics.timer('conversion_seconds', source='stream'):
+            tweets = statuses_to_tweets(statuses)
+        self.sink.add_tweets(tweets)
+        if self.tweet_index is not None:
+            self.tweet_index.buffered(statuses)
+            if self.tweet_index.commit_due:
+                _flush(self.sink, self.tweet_index)
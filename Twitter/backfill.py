@@ -0,0 +1,120 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# tweet ids are snowflakes: milliseconds since this epoch, shifted left by 22 bits
+TWITTER_EPOCH = 1288834974657
+
+# the standard search API only returns the tweets of the last seven days
+SEARCH_WINDOW = 7 * 24 * 60 * 60
+
+
+def id_at(moment):
+    """
+    :param moment: epoch seconds
+    :return: the lowest tweet id that can be created at or after the moment
+    """
+    return max(0, int(moment * 1000) - TWITTER_EPOCH) << 22
+
+
+class Slice:
+    """
+    One time slice of the search window of a query, paged on its own
+    The slice holds the tweets from start up to end, as since_id and max_id bounds
+    """
+    __slots__ = ('query', 'start', 'end')
+
+    def __init__(self, query, start, end=None):
+        """
+        :param query: the query string
+        :param start: epoch seconds of the start of the slice
+        :param end: epoch seconds of the end of the slice, None for the newest slice which runs up to now
+        """
+        self.query = query
+        self.start = start
+        self.end = end
+
+    @property
+    def since_id(self):
+        return id_at(self.start) - 1
+
+    @property
+    def max_id(self):
+        return None if self.end is None else id_at(self.end) - 1
+
+    def __str__(self):
+        return "{0} [{1}]".format(self.query, datetime.utcfromtimestamp(self.start).strftime("%Y-%m-%d %H:%M"))
+
+
+def plan_slices(query, slice_hours=24, since_id=None, now=None, window=SEARCH_WINDOW):
+    """
+    Splits the search window of a query into slices, newest first
+    The slice boundaries are whole multiples of the slice length, so a restarted backfill finds its slices back
+    :param query: the query string
+    :param slice_hours: length of a slice in hours, 24 for day slices
+    :param since_id: watermark of the query, slices that hold no newer tweets are left out
+    :param now: epoch seconds, default the current time
+    :param window: number of seconds the search API looks back
+    :return: list of Slice objects
+    """
+    length = int(slice_hours * 60 * 60)
+    now = time.time() if now is None else now
+    start = now - now % length
+    slices = [Slice(query, start)]
+    while start > now - window:
+        slices.append(Slice(query, start - length, start))
+        start -= length
+    if since_id:
+        slices = [piece for piece in slices if piece.max_id is None or piece.max_id > since_id]
+    return slices
+
+
+class BackfillJournal:
+    """
+    Progress of the slices of a backfill, stored in a SQLite database
+    Keeps the max_id to continue every slice with and the newest tweet id it found,
+    so a restarted backfill only pages the slices and the pages it did not finish
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the database file, created if it does not exist
+        """
+        self.path = path
+        # the slices are paged from several threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS slices (query TEXT, start INTEGER, "
+                                     "next_max_id INTEGER, newest_id INTEGER, done INTEGER NOT NULL DEFAULT 0, "
+                                     "PRIMARY KEY (query, start))")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def progress(self, piece):
+        """
+        :param piece: Slice object
+        :return: tuple (next_max_id, newest_id, done), (None, None, False) if the slice was not started
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT next_max_id, newest_id, done FROM slices "
+                                           "WHERE query = ? AND start = ?", (piece.query, int(piece.start))).fetchone()
+        if row is None:
+            return None, None, False
+        return row[0], row[1], bool(row[2])
+
+    def save(self, piece, next_max_id, newest_id, done=False):
+        """
+        Stores the progress of a slice, only call this once the tweets above next_max_id are stored
+        :param piece: Slice object
+        :param next_max_id: max_id of the next page
+        :param newest_id: highest tweet id found in the slice
+        :param done: True if the slice has no more tweets
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?, ?)",
+                                     (piece.query, int(piece.start), next_max_id, newest_id, int(done)))
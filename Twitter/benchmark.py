@@ -0,0 +1,534 @@
+"""
+Micro-benchmarks of the collection hot paths, no network or credentials needed
+Run with: python benchmark.py [name ...]
+"""
+import gzip
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from datetime import datetime, timedelta
+
+import pytz
+import tweepy
+
+from converter import statuses_to_tweets
+from dedup import TweetIndex
+from fakeapi import FakeAPI, FakeClock, FakeTwitter
+from graph import IdFilter, np
+from models import Tweet, TwitterKeys, TwitterUser
+from pipeline import batches
+from ratelimit import RateLimitScheduler
+from retry import RetryPolicy
+from TwitterTweepy import TwitterTweepy, TweetsStreamListener
+from usercache import UserCache
+from writer import BLOCK, DROP_OLDEST, SPILL
+from sink import Sink, JSONLinesSink, ParquetSink, SQLiteSink, TWEET_COLUMNS, TWEETS, USERS, pa, tweet_to_row
+
+
+def _best_of(function, repeat=3):
+    """
+    :param function: function without arguments to time
+    :param repeat: number of runs
+    :return: the fastest run in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_filter(network_size=50000, pages=200, page_size=5000):
+    """
+    Compares the set-membership loop the relationships phase used with IdFilter, for pages as lists (tweepy)
+    The pages look like the followers of a celebrity: few of the ids are part of the network
+    """
+    network_ids = random.sample(range(1, 10 ** 10), network_size)
+    network_set = set(network_ids)
+    member_ids = network_ids[:page_size // 100]
+    id_pages = list()
+    for _ in range(pages):
+        page = [random.randrange(1, 10 ** 10) for _ in range(page_size - len(member_ids))] + member_ids
+        random.shuffle(page)
+        id_pages.append(page)
+    id_filter = IdFilter(network_ids)
+
+    def loop():
+        for page in id_pages:
+            [user_id for user_id in page if user_id in network_set and user_id != 1]
+
+    def filter_lists():
+        for page in id_pages:
+            id_filter.filter(page, exclude=1)
+
+    benchmarks = [("set loop", loop), ("IdFilter list", filter_lists)]
+
+    ids = pages * page_size
+    for name, function in benchmarks:
+        elapsed = _best_of(function)
+        print("filter {0:<16} {1:8.3f} s  {2:12.0f} ids/s".format(name, elapsed, ids / elapsed))
+
+
+class DictTwitterUser:
+    """
+    TwitterUser as it was before it had slots, to compare the memory use with
+    """
+    def __init__(self, user_id, name, screen_name, user_description, date_created, url, profile_image_url, language,
+                 location, default_profile_image, verified, friends_count, followers_count, is_protected,
+                 max_followers_exceeded=False):
+        self.user_id = user_id
+        self.name = name
+        self.screen_name = screen_name
+        self.user_description = user_description
+        self.date_created = date_created
+        self.url = url
+        self.profile_image_url = profile_image_url
+        self.language = language
+        self.location = location
+        self.default_profile_image = default_profile_image
+        self.verified = verified
+        self.friends_count = friends_count
+        self.followers_count = followers_count
+        self.is_protected = is_protected
+        self.max_followers_exceeded = max_followers_exceeded
+
+
+def _user_json(count):
+    """
+    :param count: number of users
+    :return: JSON text of count users, decoded it gives every user its own string objects like tweepy does
+    """
+    languages = ['nl', 'en', 'fr', 'de', 'es']
+    locations = ['Belgium', 'Gent, Belgie', 'Brussels', 'Antwerpen', '', 'Amsterdam']
+    users = list()
+    for i in range(count):
+        users.append({'id': 10 ** 9 + i, 'name': "User {0}".format(i), 'screen_name': "user_{0}".format(i),
+                      'description': "Description of user {0}".format(i), 'url': None,
+                      'profile_image_url': "http://pbs.twimg.com/profile_images/{0}/normal.jpg".format(i),
+                      'lang': random.choice(languages), 'location': random.choice(locations),
+                      'friends_count': random.randrange(5000), 'followers_count': random.randrange(100000)})
+    return json.dumps(users)
+
+
+def bench_memory(count=200000):
+    """
+    Compares the memory of count users with the old dict backed TwitterUser and the slotted TwitterUser
+    """
+    data = _user_json(count)
+    date_created = datetime(2015, 1, 1)
+    for name, user_class in (("dict", DictTwitterUser), ("slots", TwitterUser)):
+        tracemalloc.start()
+        users = json.loads(data)
+        converted = [user_class(user_id=user['id'], name=user['name'], screen_name=user['screen_name'],
+                                user_description=user['description'], date_created=date_created, url=user['url'],
+                                profile_image_url=user['profile_image_url'], language=user['lang'],
+                                location=user['location'], default_profile_image=False, verified=False,
+                                friends_count=user['friends_count'], followers_count=user['followers_count'],
+                                is_protected=False) for user in users]
+        # the decoded JSON is dropped, only the objects and strings the users hold stay
+        del users
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("memory {0:<6} {1:8.1f} MB  {2:6.0f} bytes/user".format(name, size / 2 ** 20, size / count))
+        del converted
+
+
+def synthetic_statuses(count):
+    """
+    Generates raw statuses that look like the results of a hashtag search
+    :param count: number of statuses
+    :return: list of status dicts
+    """
+    sources = ['<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+               '<a href="http://twitter.com/download/android" rel="nofollow">Twitter for Android</a>',
+               '<a href="http://twitter.com" rel="nofollow">Twitter Web Client</a>']
+    start = datetime(2016, 1, 1)
+    statuses = list()
+    for i in range(count):
+        status = {'id': 7 * 10 ** 17 + i, 'id_str': str(7 * 10 ** 17 + i),
+                  'created_at': (start + timedelta(seconds=i)).strftime("%a %b %d %H:%M:%S +0000 %Y"),
+                  'text': "Tweet number {0} #hashtag{1} @user{2} http://t.co/{0}".format(i, i % 50, i % 1000),
+                  'user': {'id': i % 10000, 'screen_name': "user{0}".format(i % 10000)},
+                  'entities': {'hashtags': [{'text': "hashtag{0}".format(i % 50)}, {'text': "tag"}],
+                               'user_mentions': [{'screen_name': "user{0}".format(i % 1000)}],
+                               'urls': [{'expanded_url': "http://example.com/{0}".format(i)}]},
+                  'coordinates': None, 'favorite_count': i % 7, 'retweet_count': i % 11,
+                  'in_reply_to_status_id': None, 'in_reply_to_screen_name': None, 'source': random.choice(sources)}
+        if i % 3 == 0:
+            status['retweeted_status'] = {'text': "Original text of tweet {0}".format(i)}
+        if i % 10 == 0:
+            status['quoted_status_id'] = i
+        statuses.append(status)
+    return statuses
+
+
+def load_statuses(count):
+    """
+    Statuses recorded as gzipped JSON lines in the file of TWITTER_STATUS_FIXTURE,
+    synthetic statuses if the variable is not set
+    :param count: maximum number of statuses
+    :return: list of status dicts
+    """
+    path = os.environ.get('TWITTER_STATUS_FIXTURE')
+    if not path:
+        return synthetic_statuses(count)
+    statuses = list()
+    with gzip.open(path, 'rt') as fixture:
+        for line in fixture:
+            statuses.append(json.loads(line))
+            if len(statuses) == count:
+                break
+    return statuses
+
+
+def legacy_convert(status):
+    """
+    The status to Tweet conversion as TwitterTweepy and TweetsStreamListener did it, to compare with
+    """
+    hashtags = ""
+    urls = ""
+    mentions = ""
+    delimiter = ";"
+    is_retweet = False
+    status_id = 0
+    if hasattr(status, 'retweeted_status'):
+        text_of_tweet = status.retweeted_status.text
+        is_retweet = True
+    else:
+        text_of_tweet = status.text
+    if hasattr(status, 'entities'):
+        for hashtag in status.entities['hashtags']:
+            hashtags += hashtag['text'] + delimiter
+        for mention in status.entities['user_mentions']:
+            mentions += mention['screen_name'] + delimiter
+        for url in status.entities['urls']:
+            urls += url['expanded_url'] + delimiter
+    if hasattr(status, 'quoted_status_id'):
+        status_id = status.quoted_status_id
+    date_tweet = pytz.utc.localize(status.created_at)
+    return Tweet(tweet_id=status.id_str,
+                 tweeter_id=status.user.id, tweeter_name=status.user.screen_name, tweet_text=text_of_tweet,
+                 tweet_date=date_tweet, is_retweet=is_retweet,
+                 mentions=mentions, hashtags=hashtags, hyperlinks=urls,
+                 coordinates=status.coordinates, favorite_count=status.favorite_count, id_str=status.id_str,
+                 in_reply_to_screen_name=status.in_reply_to_screen_name, retweet_count=status.retweet_count,
+                 source=status.source, quoted_status_id=status_id)
+
+
+def bench_convert(count=100000):
+    """
+    Compares the old status conversion with the shared converter
+    The old conversion needs tweepy statuses, it is timed with and without building them from the JSON.
+    The converter is timed on the JSON, as the stream and the search and timeline pages get it, and on
+    tweepy statuses, as the collectors that page with a tweepy.Cursor get them
+    """
+    statuses = load_statuses(count)
+    tweepy_statuses = [tweepy.models.Status.parse(None, status) for status in statuses]
+
+    def legacy():
+        for status in tweepy_statuses:
+            legacy_convert(status)
+
+    def parse_legacy():
+        for status in statuses:
+            legacy_convert(tweepy.models.Status.parse(None, status))
+
+    def shared():
+        statuses_to_tweets(statuses)
+
+    def shared_statuses():
+        statuses_to_tweets(tweepy_statuses)
+
+    for name, function in (("legacy", legacy), ("parse+legacy", parse_legacy), ("converter json", shared),
+                           ("converter tweepy", shared_statuses)):
+        elapsed = _best_of(function)
+        print("convert {0:<16} {1:8.3f} s  {2:10.0f} tweets/s".format(name, elapsed, len(statuses) / elapsed))
+
+
+def bench_sink(count=10000):
+    """
+    Compares storing tweets one row per insert, committed one by one like the old tweet.save(),
+    with the batched sinks
+    Every sink writes into a new temporary directory, the conversion of the statuses is not timed
+    """
+    tweets = statuses_to_tweets(load_statuses(count))
+
+    def row_per_insert(directory):
+        connection = sqlite3.connect(os.path.join(directory, "tweets.db"))
+        connection.execute("CREATE TABLE tweets ({0}, PRIMARY KEY (tweet_id))".format(", ".join(TWEET_COLUMNS)))
+        statement = "INSERT OR IGNORE INTO tweets VALUES ({0})".format(", ".join("?" * len(TWEET_COLUMNS)))
+        for tweet in tweets:
+            connection.execute(statement, tweet_to_row(tweet))
+            connection.commit()
+        connection.close()
+
+    def batched(sink_factory):
+        def run(directory):
+            with sink_factory(directory) as sink:
+                for i in range(0, len(tweets), 100):
+                    # the collectors push a page of 100 tweets at a time
+                    sink.add_tweets(tweets[i:i + 100])
+        return run
+
+    benchmarks = [("row per insert", row_per_insert),
+                  ("SQLiteSink", batched(lambda directory: SQLiteSink(os.path.join(directory, "tweets.db")))),
+                  ("JSONLinesSink", batched(JSONLinesSink))]
+    if pa is not None:
+        benchmarks.append(("ParquetSink", batched(ParquetSink)))
+    for name, function in benchmarks:
+        def timed():
+            directory = tempfile.mkdtemp()
+            try:
+                function(directory)
+            finally:
+                shutil.rmtree(directory)
+        elapsed = _best_of(timed)
+        print("sink {0:<15} {1:8.3f} s  {2:10.0f} tweets/s".format(name, elapsed, len(tweets) / elapsed))
+
+
+class SlowSink(Sink):
+    """
+    Sink that stalls on every every-th write, like a database that checkpoints
+    """
+    def __init__(self, stall=0.5, every=20, **kwargs):
+        super().__init__(**kwargs)
+        self.stall = stall
+        self.every = every
+        self.writes = 0
+
+    def _write(self, kind, records):
+        self.writes += 1
+        if self.writes % self.every == 0:
+            time.sleep(self.stall)
+
+
+def bench_stream(count=20000):
+    """
+    Feeds a fake stream of raw statuses to TweetsStreamListener with a sink that stalls now and then
+    Measures how fast the read thread gets rid of the messages and its longest pause, with storage on the
+    read thread as before and with the background writer under every overflow policy
+    """
+    messages = [json.dumps(status) for status in load_statuses(count)]
+
+    def feed(handle):
+        """
+        :return: (seconds the read thread needed, longest pause of the read thread)
+        """
+        longest = 0
+        start = time.perf_counter()
+        for message in messages:
+            before = time.perf_counter()
+            handle(message)
+            longest = max(longest, time.perf_counter() - before)
+        return time.perf_counter() - start, longest
+
+    sink = SlowSink(batch_size=100)
+    read, longest = feed(lambda message: sink.add_tweets(statuses_to_tweets([json.loads(message)])))
+    sink.close()
+    print("stream {0:<12} read {1:6.3f} s  {2:8.0f} statuses/s  longest pause {3:6.3f} s"
+          .format("synchronous", read, count / read, longest))
+    for overflow in (BLOCK, DROP_OLDEST, SPILL):
+        directory = tempfile.mkdtemp()
+        listener = TweetsStreamListener(None, sink=SlowSink(batch_size=100), max_queue=5000, overflow=overflow,
+                                        spill_path=os.path.join(directory, "spill.jsonl"))
+        read, longest = feed(listener.on_data)
+        listener.close()
+        shutil.rmtree(directory)
+        counters = listener.writer.counters()
+        print("stream {0:<12} read {1:6.3f} s  {2:8.0f} statuses/s  longest pause {3:6.3f} s  processed {4} "
+              "dropped {5} spilled {6}".format(overflow, read, count / read, longest, counters['processed'],
+                                               counters['dropped'], counters['spilled']))
+
+
+def bench_dedup(count=100000, repeats=0.3):
+    """
+    Compares converting every status with checking the TweetIndex first, for pages where a share of the
+    statuses was stored before (overlapping queries and reruns), and the memory of the index
+    """
+    statuses = load_statuses(count)
+    stored = statuses[:int(len(statuses) * repeats)]
+
+    def convert_all():
+        statuses_to_tweets(statuses)
+
+    def with_index():
+        directory = tempfile.mkdtemp()
+        try:
+            index = TweetIndex(os.path.join(directory, "ids.db"), capacity=count)
+            index.buffered(index.new(stored))
+            index.commit()
+            statuses_to_tweets(index.new(statuses))
+            index.close()
+        finally:
+            shutil.rmtree(directory)
+
+    for name, function in (("convert all", convert_all), ("TweetIndex", with_index)):
+        elapsed = _best_of(function)
+        print("dedup {0:<12} {1:8.3f} s  {2:10.0f} statuses/s".format(name, elapsed, count / elapsed))
+    # start of a rerun: the stored Bloom filter is loaded, without it every stored id is added again
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "ids.db")
+        index = TweetIndex(path, capacity=count)
+        index.buffered(index.new(statuses))
+        index.close()
+        for name in ("stored filter", "replay ids"):
+            if name == "replay ids":
+                connection = sqlite3.connect(path)
+                with connection:
+                    connection.execute("DELETE FROM bloom")
+                connection.close()
+            start = time.perf_counter()
+            index = TweetIndex(path, capacity=count)
+            elapsed = time.perf_counter() - start
+            index.close()
+            print("dedup start {0:<14} {1:8.3f} s  for {2} stored ids".format(name, elapsed, count))
+    finally:
+        shutil.rmtree(directory)
+    tracemalloc.start()
+    index = TweetIndex(capacity=10000000)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    index.close()
+    print("dedup Bloom filter of {0} ids: {1:.1f} MB".format(index.bloom.capacity, size / 2 ** 20))
+
+
+def legacy_paginate(iterable, page_size):
+    """
+    The itertools.tee pagination TwitterTweepy used, to compare with
+    """
+    while True:
+        i1, i2 = itertools.tee(iterable)
+        iterable, page = (itertools.islice(i1, page_size, None), list(itertools.islice(i2, page_size)))
+        if len(page) == 0:
+            break
+        yield page
+
+
+def bench_paginate(count=10000000, legacy_count=50000, page_size=100):
+    """
+    Compares the tee pagination, which wraps one more tee and islice around the rest of the ids for every page,
+    with batches on a list, an iterator, an array and a numpy array of ids
+    The tee pagination is quadratic, it only gets legacy_count ids
+    """
+    ids = list(range(10 ** 9, 10 ** 9 + count))
+
+    def consume(pages):
+        pages_seen = 0
+        for _ in pages:
+            pages_seen += 1
+        return pages_seen
+
+    benchmarks = [("tee", legacy_count, lambda: consume(legacy_paginate(ids[:legacy_count], page_size))),
+                  ("list", count, lambda: consume(batches(ids, page_size))),
+                  ("iterator", count, lambda: consume(batches(iter(ids), page_size)))]
+    id_array = array('q', ids)
+    benchmarks.append(("array", count, lambda: consume(batches(id_array, page_size))))
+    if np is not None:
+        id_numpy = np.array(ids, dtype=np.int64)
+        benchmarks.append(("numpy", count, lambda: consume(batches(id_numpy, page_size))))
+    for name, size, function in benchmarks:
+        elapsed = _best_of(function, repeat=1 if name == "tee" else 3)
+        print("paginate {0:<9} {1:9d} ids {2:8.3f} s  {3:12.0f} ids/s".format(name, size, elapsed, size / elapsed))
+
+
+class NullSink(Sink):
+    """
+    Sink that only counts the records, in Sink.written
+    """
+    def _write(self, kind, records):
+        pass
+
+
+def load_world():
+    """
+    The FakeTwitter recorded in the file of TWITTER_WORLD_FIXTURE (FakeTwitter.save of a RecordingAPI),
+    a synthetic network if the variable is not set
+    """
+    path = os.environ.get('TWITTER_WORLD_FIXTURE')
+    if not path:
+        return FakeTwitter.synthetic()
+    return FakeTwitter.load(path)
+
+
+def bench_collectors(latency=0.002, keys=2, error_rate=0.01):
+    """
+    Runs every collector of TwitterTweepy against a FakeAPI and reports users/s, edges/s and tweets/s
+    Wall time is the time the client needs with the given latency per request. API time adds the time it
+    would have waited for rate limit windows (the FakeClock skips the waits), the rates per hour of API
+    time are what the collection reaches on the live API
+    A share of the requests fails with HTTP 503, the backoffs of the retry policy count as API time
+    """
+    world = load_world()
+    egos = sorted((user for user in world.users.values() if not user.get('protected')),
+                  key=lambda user: user['followers_count'], reverse=True)
+    ego_names = ",".join(user['screen_name'] for user in egos[:5])
+    hashtags = sorted(set(hashtag['text'] for status in world.statuses.values()
+                          for hashtag in status['entities']['hashtags']))
+    timeline_names = [user['screen_name'] for user in egos[:100]]
+    modes = [("profile", lambda client: client.profile_information_search(ego_names, friends=True, followers=True)),
+             ("relationships", lambda client: client.profile_information_search(ego_names, friends=True,
+                                                                                relationships_checked=True)),
+             ("search", lambda client: client.get_tweets_searchterms_searchapi(hashtags)),
+             ("backfill", lambda client: client.get_tweets_searchterms_searchapi(hashtags, slice_hours=24)),
+             ("names", lambda client: client.get_tweets_names_searchapi(timeline_names)),
+             ("timeline", lambda client: client.get_tweets_timeline(timeline_names))]
+    for name, collect in modes:
+        clock = FakeClock()
+        apis = dict()
+
+        def api_factory(twitter_keys):
+            # authenticate may be called again, the keys keep their rate limit windows
+            if id(twitter_keys) not in apis:
+                apis[id(twitter_keys)] = FakeAPI(world, clock=clock, latency=latency, error_rate=error_rate,
+                                                 seed=len(apis))
+            return apis[id(twitter_keys)]
+
+        sink = NullSink()
+        client = TwitterTweepy([TwitterKeys("", "", "", "", None) for _ in range(keys)],
+                               scheduler_factory=lambda: RateLimitScheduler(clock=clock.time, sleep=clock.sleep),
+                               user_cache=UserCache(), sink=sink, api_factory=api_factory,
+                               retry_policy=RetryPolicy(sleep=clock.sleep, seed=1))
+        start = time.perf_counter()
+        graph = collect(client)
+        wall = time.perf_counter() - start
+        api_time = clock.elapsed()
+        counts = [("users", sink.written[USERS]), ("edges", len(graph) if graph is not None else 0),
+                  ("tweets", sink.written[TWEETS])]
+        requests = sum(sum(api.requests.values()) for api in apis.values())
+        print("collectors {0:<13} wall {1:7.2f} s  api time {2:8.0f} s  {3:6d} requests  {4:3d} skipped  {5}".format(
+            name, wall, api_time, requests, len(client.retry.skipped), "  ".join("{0} {1:8.0f}/s {2:10.0f}/h".format(
+                kind, count / wall, count / api_time * 3600) for kind, count in counts if count)))
+
+
+BENCHMARKS = {
+    'collectors': bench_collectors,
+    'convert': bench_convert,
+    'dedup': bench_dedup,
+    'filter': bench_filter,
+    'memory': bench_memory,
+    'paginate': bench_paginate,
+    'sink': bench_sink,
+    'stream': bench_stream,
+}
+
+
+def main(args):
+    names = args or sorted(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import pytz
+
+from models import Tweet
+
+# hashtags, mentions and urls are joined with this delimiter when a tweet is stored
+ENTITY_DELIMITER = ";"
+
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+EMPTY = ()
+
+# source html -> name of the client, there are few different sources
+_sources = dict()
+
+
+def parse_created_at(created_at):
+    """
+    Parses the created_at field of Twitter without strptime
+    :param created_at: ex "Wed Aug 27 13:08:45 +0000 2008", always in UTC
+    :return: non naive datetime in UTC
+    """
+    return datetime(int(created_at[26:30]), MONTHS[created_at[4:7]], int(created_at[8:10]),
+                    int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19]), tzinfo=pytz.utc)
+
+
+def parse_source(source):
+    """
+    :param source: html link of the client that posted the tweet
+    :return: the name of the client, like tweepy returns it
+    """
+    name = _sources.get(source)
+    if name is None:
+        name = source[source.find('>') + 1:source.rfind('<')] if source.startswith('<') else source
+        if len(_sources) > 10000:
+            _sources.clear()
+        _sources[source] = name
+    return name
+
+
+def join_entities(entities):
+    """
+    :param entities: tuple of hashtags, mentions or urls
+    :return: the entities as one string, for storage
+    """
+    return ENTITY_DELIMITER.join(entities)
+
+
+def _entities(entities):
+    """
+    :param entities: the entities dict of a status, or None
+    :return: tuple (hashtags, mentions, urls), each a tuple of strings
+    """
+    if not entities:
+        return EMPTY, EMPTY, EMPTY
+    hashtags = entities.get('hashtags')
+    mentions = entities.get('user_mentions')
+    urls = entities.get('urls')
+    return (tuple([hashtag['text'] for hashtag in hashtags]) if hashtags else EMPTY,
+            tuple([mention['screen_name'] for mention in mentions]) if mentions else EMPTY,
+            tuple([url['expanded_url'] for url in urls]) if urls else EMPTY)
+
+
+def status_to_tweet(status, screen_name=None):
+    """
+    Converts the raw JSON of a status to a Tweet
+    If the status is a retweet, the text is taken from the original tweet (normal text is truncated)
+    :param status: the status as a dict (status._json for tweepy statuses)
+    :param screen_name: name of the tweeter if the user of the status is trimmed to its id
+    :return: Tweet object, hashtags, mentions and hyperlinks are tuples
+    """
+    retweeted_status = status.get('retweeted_status')
+    text_source = status if retweeted_status is None else retweeted_status
+    text_of_tweet = text_source.get('full_text') or text_source.get('text')
+    hashtags, mentions, urls = _entities(status.get('entities'))
+    user = status['user']
+    source = status.get('source')
+    return Tweet(tweet_id=status['id_str'], tweeter_id=user['id'], tweeter_name=user.get('screen_name', screen_name),
+                 tweet_text=text_of_tweet, tweet_date=parse_created_at(status['created_at']),
+                 is_retweet=retweeted_status is not None, mentions=mentions, hashtags=hashtags, hyperlinks=urls,
+                 coordinates=status.get('coordinates'), favorite_count=status.get('favorite_count'),
+                 id_str=status['id_str'], in_reply_to_screen_name=status.get('in_reply_to_screen_name'),
+                 retweet_count=status.get('retweet_count'),
+                 source=parse_source(source) if source else source,
+                 # quoted_status_id only exists if tweet is a quoted tweet
+                 quoted_status_id=status.get('quoted_status_id', 0))
+
+
+def parsed_status_to_tweet(status, screen_name=None):
+    """
+    Converts a tweepy status, with the values tweepy parsed already: created_at is not parsed again
+    and the source is already the name of the client
+    :param status: tweepy status
+    :param screen_name: name of the tweeter if the user of the status is trimmed to its id
+    :return: Tweet object, hashtags, mentions and hyperlinks are tuples
+    """
+    # the attributes of a tweepy model are the keys of the JSON, dict lookups are cheaper than getattr
+    fields = status.__dict__
+    retweeted_status = fields.get('retweeted_status')
+    text_source = fields if retweeted_status is None else retweeted_status.__dict__
+    text_of_tweet = text_source.get('full_text') or text_source.get('text')
+    hashtags, mentions, urls = _entities(fields.get('entities'))
+    user = fields['user'].__dict__
+    return Tweet(tweet_id=fields['id_str'], tweeter_id=user['id'], tweeter_name=user.get('screen_name', screen_name),
+                 tweet_text=text_of_tweet, tweet_date=pytz.utc.localize(fields['created_at']),
+                 is_retweet=retweeted_status is not None, mentions=mentions, hashtags=hashtags, hyperlinks=urls,
+                 coordinates=fields.get('coordinates'), favorite_count=fields.get('favorite_count'),
+                 id_str=fields['id_str'], in_reply_to_screen_name=fields.get('in_reply_to_screen_name'),
+                 retweet_count=fields.get('retweet_count'), source=fields.get('source'),
+                 # quoted_status_id only exists if tweet is a quoted tweet
+                 quoted_status_id=fields.get('quoted_status_id', 0))
+
+
+def statuses_to_tweets(statuses, screen_name=None):
+    """
+    Converts a page of statuses
+    :param statuses: iterable of tweepy statuses or raw status dicts
+    :param screen_name: name of the tweeter if the users of the statuses are trimmed to their id
+    :return: list of Tweet objects
+    """
+    return [status_to_tweet(status, screen_name) if type(status) is dict else parsed_status_to_tweet(status, screen_name)
+            for status in statuses]
@@ -0,0 +1,181 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tweepy
+
+from graph import IdFilter, Relation
+from metrics import metrics
+from ratelimit import DEFAULT_LIMITS, WINDOW
+from retry import ACTIONS, SKIP, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# endpoint and tweepy method used for each type of relationship
+ENDPOINTS = {
+    'friends': ('friends/ids', 'friends_ids'),
+    'followers': ('followers/ids', 'followers_ids'),
+}
+
+# attribute of TwitterUser with the number of ids a cursor of the relationship returns
+COUNTS = {
+    'friends': 'friends_count',
+    'followers': 'followers_count',
+}
+
+# maximum number of ids on one page of friends/ids and followers/ids
+IDS_PAGE_SIZE = 5000
+
+
+def pages(count):
+    """
+    :param count: number of ids of a user
+    :return: number of requests needed to page the ids, 0 if the user has none
+    """
+    return -(-count // IDS_PAGE_SIZE) if count and count > 0 else 0
+
+
+class CrawlPlan:
+    """
+    Number of requests the relationships phase needs with friends and with followers, and the time it takes
+    An edge is found from the friends of one user or from the followers of the other, so all users are
+    crawled in the same direction: a user crawled by followers and one crawled by friends would both miss
+    the edge from the first to the second
+    The cost of a user is the number of pages of its ids, a user without ids in a direction costs nothing
+    """
+    def __init__(self, users, pool):
+        """
+        :param users: the TwitterUser objects of the network, protected users are not crawled
+        :param pool: the KeyPool requests are dispatched to
+        """
+        users = [user for user in users if not user.is_protected]
+        self.pool = pool
+        self.users = len(users)
+        self.requests = dict((relation_used, sum(pages(getattr(user, count)) for user in users))
+                             for relation_used, count in COUNTS.items())
+        # the cheapest direction, friends when equal
+        self.relation_used = min(('friends', 'followers'), key=lambda relation_used: self.requests[relation_used])
+
+    def eta(self, relation_used=None):
+        """
+        :param relation_used: 'friends' or 'followers', default the cheapest
+        :return: the number of seconds the requests need within the rate limits of all keys of the pool
+        """
+        relation_used = relation_used or self.relation_used
+        endpoint = ENDPOINTS[relation_used][0]
+        per_window = sum(getattr(credential.scheduler, 'limits', DEFAULT_LIMITS).get(endpoint, 15)
+                         for credential in self.pool.credentials)
+        # the requests left in the current windows go first
+        waiting = max(0, self.requests[relation_used] - self.pool.remaining(endpoint))
+        return -(-waiting // per_window) * WINDOW
+
+    def __str__(self):
+        return "; ".join("{0}: {1} requests, {2:.1f} hours".format(
+            relation_used, self.requests[relation_used], self.eta(relation_used) / 3600)
+            for relation_used in ('friends', 'followers'))
+
+
+class RelationshipCrawler:
+    """
+    Walks the friends or followers id cursors of many users at the same time
+    The number of cursors running at once is bounded by the rate limit budget of the endpoint,
+    the ids of every page are merged into the graph as soon as the page arrives
+    """
+    def __init__(self, pool, relation_used, network_ids, graph, max_workers=16, journal=None, retry=None):
+        """
+        :param pool: the KeyPool requests are dispatched to
+        :param relation_used: 'friends' or 'followers'
+        :param network_ids: set of ids of all users in the network, edges to other users are dropped
+        :param graph: the EgoGraph the edges are added to
+        :param max_workers: maximum number of cursors running at once
+        :param journal: CrawlJournal to continue from and to store every page in, or None
+        :param retry: RetryPolicy of the pages, default a RetryPolicy with its default settings
+        """
+        self.pool = pool
+        self.relation_used = relation_used
+        self.relation = Relation[relation_used.upper()]
+        self.endpoint, self.method_name = ENDPOINTS[relation_used]
+        self.count = COUNTS[relation_used]
+        # pages are intersected with the network ids in one vectorized step
+        self.id_filter = IdFilter(network_ids)
+        self.max_workers = max_workers
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.graph = graph
+        self.users_done = 0
+        self.journal = journal
+        if journal is not None:
+            # edges of the pages collected in an earlier run
+            for from_user_id, to_user_id in journal.load_edges(relation_used):
+                graph.add_edge(from_user_id, to_user_id, self.relation)
+        self._lock = threading.Lock()
+
+    def _workers(self, number_of_users):
+        # more cursors than requests left in the window would only wait on the scheduler
+        budget = self.pool.remaining(self.endpoint)
+        return max(1, min(self.max_workers, budget, number_of_users))
+
+    def crawl(self, users):
+        """
+        Collect the relationships between all given users
+        :param users: list of TwitterUser objects, protected users are skipped
+        :return: the graph
+        """
+        # users without friends (followers) have no cursor pages to walk
+        users = [user for user in users if not user.is_protected and pages(getattr(user, self.count))]
+        if self.journal is not None:
+            # users finished in an earlier run are skipped
+            users = [user for user in users if self.journal.next_cursor(user.user_id, self.relation_used) != 0]
+        if not users:
+            return self.graph
+        workers = self._workers(len(users))
+        logger.info("Crawl {0} of {1} users with {2} workers".format(self.relation_used, len(users), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.crawl_user, user) for user in users]
+            for future in as_completed(futures):
+                future.result()
+                with self._lock:
+                    self.users_done += 1
+                    if self.users_done % 100 == 0:
+                        logger.info("Relationships of %d/%d users collected, %d edges",
+                                    self.users_done, len(users), len(self.graph))
+        return self.graph
+
+    def crawl_user(self, user):
+        """
+        Walks the id cursor of one user and merges every page into the graph
+        :param user: TwitterUser object
+        """
+        method = self.retry.wrap(self.endpoint, self.pool.method(self.endpoint, self.method_name))
+        cursor = -1
+        if self.journal is not None:
+            cursor = self.journal.next_cursor(user.user_id, self.relation_used)
+        while cursor != 0:
+            try:
+                ids, cursors = method(user_id=user.user_id, cursor=cursor)
+            except tweepy.TweepError as e:
+                # the page was retried by the policy, the pages already collected are kept and a restarted
+                # crawl continues the user, unless the error is permanent
+                if ACTIONS[self.retry.skip(self.relation_used, user.user_id, e)] == SKIP:
+                    self._give_up(user)
+                return
+            cursor = cursors[1]
+            self._merge(user.user_id, ids, cursor)
+
+    def _give_up(self, user):
+        # a restarted crawl does not retry users that failed permanently
+        if self.journal is not None:
+            self.journal.save_page(user.user_id, self.relation_used, 0, [])
+
+    def _merge(self, user_id, ids, next_cursor):
+        """
+        Adds the ids of one page that are part of the network to the graph
+        :param user_id: id of the user the page belongs to
+        :param ids: ids of the friends or followers on the page
+        :param next_cursor: cursor of the next page of the user, 0 if it was the last page
+        """
+        to_user_ids = self.id_filter.filter(ids, exclude=user_id)
+        if self.journal is not None:
+            self.journal.save_page(user_id, self.relation_used, next_cursor,
+                                   [(user_id, other_id) for other_id in to_user_ids])
+        self.graph.add_edges(user_id, to_user_ids, self.relation)
+        metrics.inc('edges_total', len(to_user_ids), relation=self.relation_used)
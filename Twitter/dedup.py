@@ -0,0 +1,252 @@
+import math
+import sqlite3
+import threading
+
+MASK = (1 << 64) - 1
+# odd 64 bit constant of Fibonacci hashing, one multiplication spreads consecutive tweet ids over the word
+GOLDEN = 0x9E3779B97F4A7C15
+
+# number of ids checked in one query on the database
+QUERY_SIZE = 500
+
+
+class BloomFilter:
+    """
+    Set of integers with a fixed size in memory, membership can give false positives but no false negatives
+    The size follows from the capacity, the false positive rate and the number of hashes, above the capacity
+    the rate goes up
+    Every probe is a Python step, so the filter uses few hashes and a few more bits than the optimum
+    (4 hashes take 20.4 bits per id at a rate of 0.001, the optimal 10 hashes 14.4 bits)
+    """
+    def __init__(self, capacity=10000000, error_rate=0.001, hashes=4):
+        """
+        :param capacity: number of ids the filter is sized for
+        :param error_rate: false positive rate at capacity
+        :param hashes: number of bits set per id
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.hashes = hashes
+        self.size = max(8, int(-hashes * capacity / math.log(1 - error_rate ** (1 / hashes))))
+        self._bits = bytearray((self.size + 7) // 8)
+        # number of ids added that were not in the filter yet, false positives are not counted
+        self.count = 0
+
+    def __contains__(self, value):
+        hashed = (value * GOLDEN) & MASK
+        # the xor-shift mixes the high bits into the low ones, which alone only depend on the low bits of the id
+        hashed ^= hashed >> 29
+        # double hashing: the k positions come from the two halves of one 64 bit hash
+        position, step, size, bits = hashed >> 32, (hashed & 0xFFFFFFFF) | 1, self.size, self._bits
+        for _ in range(self.hashes):
+            position %= size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+    def add(self, value):
+        """
+        Adds a value, and tells whether it was there already, with one hash
+        :param value: integer
+        :return: True if the value may have been added before
+        """
+        hashed = (value * GOLDEN) & MASK
+        hashed ^= hashed >> 29
+        position, step, size, bits = hashed >> 32, (hashed & 0xFFFFFFFF) | 1, self.size, self._bits
+        found = True
+        for _ in range(self.hashes):
+            position %= size
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                found = False
+            position += step
+        if not found:
+            self.count += 1
+        return found
+
+    def to_bytes(self):
+        """
+        :return: the bit array, to store the filter
+        """
+        return bytes(self._bits)
+
+    def load(self, data, count):
+        """
+        Replaces the bits with those of a stored filter of the same size
+        :param data: bytes of to_bytes
+        :param count: count of the stored filter
+        """
+        if len(data) != len(self._bits):
+            raise ValueError("The stored filter has another size")
+        self._bits = bytearray(data)
+        self.count = count
+
+
+class TweetIndex:
+    """
+    Ids of the tweets that were stored by any collector, so a tweet is converted and stored only once
+    A Bloom filter answers most lookups in memory: an id that is not in the filter is new. The ids that
+    may be in it are checked against the exact set in a SQLite database, which also survives the run
+    An id is only written to the database once its tweet is stored: new marks it, buffered tells the index
+    the tweet is in the sink, and commit writes it after the sink was flushed
+    The bits of the Bloom filter are stored in the database as well, a new run loads them and only adds the ids
+    committed after they were stored
+    """
+    def __init__(self, path=":memory:", capacity=10000000, error_rate=0.001, commit_size=10000,
+                 snapshot_size=1000000):
+        """
+        :param path: path of the database file with the exact set, created if it does not exist
+        :param capacity: number of ids the Bloom filter is sized for, the memory used does not grow above it
+        :param error_rate: false positive rate of the Bloom filter, the share of new ids looked up on disk
+        :param commit_size: number of buffered ids after which commit_due asks the caller to flush and commit
+        :param snapshot_size: number of committed ids after which the Bloom filter is stored again
+        """
+        self.path = path
+        self.commit_size = commit_size
+        self.snapshot_size = snapshot_size
+        self.bloom = BloomFilter(capacity, error_rate)
+        # ids returned by new whose tweets are not yet handed to the sink
+        self._pending = set()
+        # ids whose tweets are in the sink, written to the database by commit
+        self._buffered = set()
+        self.duplicates = 0
+        # ids checked in the database, and the number of queries they took
+        self.disk_lookups = 0
+        self.disk_queries = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS tweet_ids (tweet_id INTEGER PRIMARY KEY)")
+            # the stored Bloom filter, and the ids committed after it was stored
+            self._connection.execute("CREATE TABLE IF NOT EXISTS bloom (size INTEGER, hashes INTEGER, "
+                                     "count INTEGER, bits BLOB)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS recent_ids (tweet_id INTEGER PRIMARY KEY)")
+        # the filter of a new run starts from the ids of the earlier runs
+        row = self._connection.execute("SELECT size, hashes, count, bits FROM bloom").fetchone()
+        if row is not None and row[:2] == (self.bloom.size, self.bloom.hashes):
+            self.bloom.load(row[3], row[2])
+            replay = "SELECT tweet_id FROM recent_ids"
+            self._filter_stored = True
+        else:
+            # no filter was stored, or one of another size: it is built from all ids once and stored on close
+            replay = "SELECT tweet_id FROM tweet_ids"
+            self._filter_stored = False
+        for (tweet_id,) in self._connection.execute(replay):
+            self.bloom.add(tweet_id)
+        self._recent = self._connection.execute("SELECT COUNT(*) FROM recent_ids").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self.bloom.count
+
+    def new(self, statuses):
+        """
+        Marks the ids of statuses as stored
+        :param statuses: list of tweepy statuses or raw status dicts
+        :return: the statuses whose id was not stored before, in the same order
+        """
+        ids = [status['id'] if isinstance(status, dict) else status.id for status in statuses]
+        new_statuses = list()
+        with self._lock:
+            pending, buffered = self._pending, self._buffered
+            # the ids the filter may hold are checked in the database at once, ids that are not in it are new
+            candidates = [tweet_id for tweet_id in ids
+                          if self.bloom.add(tweet_id) and tweet_id not in pending and tweet_id not in buffered]
+            stored = self._stored(candidates) if candidates else ()
+            for status, tweet_id in zip(statuses, ids):
+                if tweet_id in pending or tweet_id in buffered or tweet_id in stored:
+                    self.duplicates += 1
+                    continue
+                pending.add(tweet_id)
+                new_statuses.append(status)
+        return new_statuses
+
+    def buffered(self, statuses):
+        """
+        Marks the statuses returned by new as handed to the sink, commit writes their ids once the sink is flushed
+        :param statuses: list of tweepy statuses or raw status dicts
+        """
+        with self._lock:
+            for status in statuses:
+                tweet_id = status['id'] if isinstance(status, dict) else status.id
+                self._pending.discard(tweet_id)
+                self._buffered.add(tweet_id)
+
+    @property
+    def commit_due(self):
+        """
+        :return: True if commit_size ids wait for a commit, the caller flushes the sink and commits
+        """
+        with self._lock:
+            return len(self._buffered) >= self.commit_size
+
+    def snapshot(self):
+        """
+        :return: the ids buffered so far, take it before the sink is flushed and pass it to commit
+        """
+        with self._lock:
+            return frozenset(self._buffered)
+
+    def _stored(self, ids):
+        """
+        :param ids: list of tweet ids
+        :return: set of the ids that are in the database
+        """
+        # lock must be held
+        stored = set()
+        for start in range(0, len(ids), QUERY_SIZE):
+            chunk = ids[start:start + QUERY_SIZE]
+            stored.update(tweet_id for (tweet_id,) in self._connection.execute(
+                "SELECT tweet_id FROM tweet_ids WHERE tweet_id IN ({0})".format(", ".join("?" * len(chunk))),
+                chunk))
+            self.disk_queries += 1
+        self.disk_lookups += len(ids)
+        return stored
+
+    def commit(self, ids=None):
+        """
+        Writes buffered ids to the database, call this once the sink stored their tweets
+        Other threads can buffer ids while the sink is flushed, those tweets may not be stored yet: take a
+        snapshot before the flush and commit only its ids
+        :param ids: ids of a snapshot taken before the sink was flushed, None for all buffered ids
+        """
+        with self._lock:
+            self._commit(ids)
+
+    def _commit(self, ids=None):
+        ids = self._buffered if ids is None else self._buffered.intersection(ids)
+        if not ids:
+            return
+        rows = [(tweet_id,) for tweet_id in ids]
+        with self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO tweet_ids VALUES (?)", rows)
+            self._connection.executemany("INSERT OR IGNORE INTO recent_ids VALUES (?)", rows)
+            self._recent += len(rows)
+            if self._recent >= self.snapshot_size:
+                self._save_filter()
+        self._buffered.difference_update(ids)
+
+    def _save_filter(self):
+        # lock must be held, in the transaction of the last commit: the stored filter holds every committed id
+        self._connection.execute("DELETE FROM bloom")
+        self._connection.execute("INSERT INTO bloom VALUES (?, ?, ?, ?)", (self.bloom.size, self.bloom.hashes,
+                                                                         self.bloom.count, self.bloom.to_bytes()))
+        self._connection.execute("DELETE FROM recent_ids")
+        self._recent = 0
+        self._filter_stored = True
+
+    def close(self):
+        """
+        Commits all buffered ids, only call this after the sink is flushed
+        """
+        with self._lock:
+            self._commit()
+            # a database in memory does not outlive the index, its filter is not stored
+            if self.path != ":memory:" and (self._recent or not self._filter_stored):
+                with self._connection:
+                    self._save_filter()
+            self._connection.close()
@@ -0,0 +1,577 @@
+"""
+Offline stand-in for tweepy.API, to measure the collectors without credentials or network
+A FakeTwitter holds the users, relationships and tweets, a FakeAPI serves them in pages like the REST API does,
+with rate limit windows and headers, latency and injected errors
+"""
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+import tweepy
+
+from backfill import TWITTER_EPOCH
+from ratelimit import DEFAULT_LIMITS, WINDOW
+
+# page sizes of the REST API
+IDS_PAGE_SIZE = 5000
+LOOKUP_SIZE = 100
+SEARCH_PAGE_SIZE = 100
+TIMELINE_PAGE_SIZE = 200
+TIMELINE_LIMIT = 3200
+
+DATE_FORMAT = "%a %b %d %H:%M:%S +0000 %Y"
+
+
+class FakeTwitter:
+    """
+    The data a FakeAPI serves: users as their JSON, friends and followers ids per user and statuses as their JSON
+    Built synthetically or recorded from the live API with a RecordingAPI, stored as gzipped JSON
+    """
+    def __init__(self):
+        # user id -> user JSON
+        self.users = dict()
+        # lower case screen name -> user id
+        self.names = dict()
+        # user id -> list of ids, in the order of the API (newest relationship first)
+        self.friends = dict()
+        self.followers = dict()
+        # user id -> JSON of the lists the user is a member of, and of the lists the user subscribes to
+        self.memberships = dict()
+        self.subscriptions = dict()
+        # status id -> status JSON
+        self.statuses = dict()
+        # user id -> status ids of the timeline, oldest first
+        self.timelines = dict()
+        # query -> ids of the matching statuses, oldest first
+        self._results = dict()
+        # word, from:screen_name or to:screen_name -> ids of the statuses, built on the first search
+        self._words = None
+        self._lock = threading.Lock()
+
+    def add_users(self, users):
+        """
+        :param users: iterable of user JSON dicts
+        """
+        with self._lock:
+            for user in users:
+                self.users[user['id']] = user
+                self.names[user['screen_name'].lower()] = user['id']
+
+    def add_statuses(self, statuses):
+        """
+        :param statuses: iterable of status JSON dicts, their users are added as well
+        """
+        with self._lock:
+            for status in statuses:
+                user = status['user']
+                if 'screen_name' in user:
+                    self.users.setdefault(user['id'], user)
+                    self.names.setdefault(user['screen_name'].lower(), user['id'])
+                if status['id'] not in self.statuses:
+                    self.timelines.setdefault(user['id'], list()).append(status['id'])
+                self.statuses[status['id']] = status
+            for ids in self.timelines.values():
+                ids.sort()
+            self._results.clear()
+            self._words = None
+
+    def add_ids(self, relationships, user_id, ids):
+        """
+        :param relationships: friends or followers of the FakeTwitter
+        :param user_id: id of the user the ids belong to
+        :param ids: a page of ids
+        """
+        with self._lock:
+            relationships.setdefault(user_id, list()).extend(ids)
+
+    def user_id(self, user_id=None, screen_name=None):
+        """
+        :return: the id of the user given by id or by screen name, None if the user is unknown
+        """
+        if user_id is not None:
+            return int(user_id)
+        return self.names.get(screen_name.lower()) if screen_name else None
+
+    def search(self, query):
+        """
+        The matching statuses are kept per query, so paging a search does not evaluate the query again
+        :param query: the query string
+        :return: list of the ids of the statuses that match the query, oldest first
+        """
+        with self._lock:
+            ids = self._results.get(query)
+            if ids is None:
+                if self._words is None:
+                    self._words = self._index_words()
+                found = set()
+                for term in terms(query):
+                    words = WORD.findall(term)
+                    if not words:
+                        continue
+                    candidates = self._words.get(words[0], ())
+                    if len(words) == 1:
+                        found.update(candidates)
+                    else:
+                        # a phrase, the statuses with its first word are checked
+                        found.update(status_id for status_id in candidates
+                                     if term_matches(self.statuses[status_id], term))
+                ids = sorted(found)
+                self._results[query] = ids
+            return ids
+
+    def _index_words(self):
+        # lock must be held
+        words = dict()
+        for status_id, status in self.statuses.items():
+            keys = set(WORD.findall(status.get('text', '').lower()))
+            keys.add("from:" + status['user'].get('screen_name', '').lower())
+            keys.add("to:" + (status.get('in_reply_to_screen_name') or '').lower())
+            for key in keys:
+                words.setdefault(key, list()).append(status_id)
+        return words
+
+    def save(self, path):
+        """
+        :param path: gzipped JSON file
+        """
+        with self._lock:
+            data = {'users': list(self.users.values()),
+                    'friends': [[user_id, ids] for user_id, ids in self.friends.items()],
+                    'followers': [[user_id, ids] for user_id, ids in self.followers.items()],
+                    'memberships': [[user_id, lists] for user_id, lists in self.memberships.items()],
+                    'subscriptions': [[user_id, lists] for user_id, lists in self.subscriptions.items()],
+                    'statuses': list(self.statuses.values())}
+        with gzip.open(path, 'wt') as output:
+            json.dump(data, output)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: gzipped JSON file written by save
+        :return: FakeTwitter
+        """
+        with gzip.open(path, 'rt') as data_file:
+            data = json.load(data_file)
+        world = cls()
+        world.add_users(data['users'])
+        world.friends = dict((user_id, ids) for user_id, ids in data['friends'])
+        world.followers = dict((user_id, ids) for user_id, ids in data['followers'])
+        world.memberships = dict((user_id, lists) for user_id, lists in data.get('memberships', ()))
+        world.subscriptions = dict((user_id, lists) for user_id, lists in data.get('subscriptions', ()))
+        world.add_statuses(data['statuses'])
+        return world
+
+    @classmethod
+    def synthetic(cls, users=2000, egos=20, statuses=50000, hashtags=500, seed=1, now=None):
+        """
+        Generates a network with a few popular users and many small ones, and a week of tweets with hashtags
+        :param users: number of users
+        :param egos: number of popular users, the first users, with ego_0... as screen name
+        :param statuses: number of statuses
+        :param hashtags: number of different hashtags, named tag0...
+        :param seed: seed of the random generator, the same seed gives the same network
+        :param now: epoch seconds of the newest tweet, default the current time
+        :return: FakeTwitter
+        """
+        generator = random.Random(seed)
+        now = time.time() if now is None else now
+        world = cls()
+        created = datetime(2012, 1, 1).strftime(DATE_FORMAT)
+        user_ids = [10 ** 9 + i for i in range(users)]
+        user_list = list()
+        for i, user_id in enumerate(user_ids):
+            screen_name = "ego_{0}".format(i) if i < egos else "user_{0}".format(i)
+            user_list.append({'id': user_id, 'id_str': str(user_id), 'name': "User {0}".format(i),
+                              'screen_name': screen_name, 'description': "Description of user {0}".format(i),
+                              'created_at': created, 'url': None, 'lang': 'nl', 'location': 'Belgium',
+                              'profile_image_url': "http://pbs.twimg.com/profile_images/{0}/normal.jpg".format(i),
+                              'default_profile_image': False, 'verified': i < egos,
+                              'protected': i >= egos and i % 50 == 0,
+                              'friends_count': 0, 'followers_count': 0})
+        friends = dict((user_id, set()) for user_id in user_ids)
+        # the popular users follow a share of everyone and are followed by most, the others follow a few users
+        for i, user_id in enumerate(user_ids):
+            follows = generator.sample(user_ids, min(users - 1, users // 4 if i < egos else 20))
+            friends[user_id].update(friend_id for friend_id in follows if friend_id != user_id)
+            if i >= egos:
+                friends[user_id].update(generator.sample(user_ids[:egos], max(1, egos // 2)))
+        followers = dict((user_id, list()) for user_id in user_ids)
+        for user_id, friend_ids in friends.items():
+            world.friends[user_id] = sorted(friend_ids)
+            for friend_id in world.friends[user_id]:
+                followers[friend_id].append(user_id)
+        world.followers = followers
+        for user in user_list:
+            user['friends_count'] = len(world.friends[user['id']])
+            user['followers_count'] = len(world.followers[user['id']])
+        world.add_users(user_list)
+        sources = ['<a href="http://twitter.com/download/iphone" rel="nofollow">Twitter for iPhone</a>',
+                   '<a href="http://twitter.com" rel="nofollow">Twitter Web Client</a>']
+        week = 7 * 24 * 60 * 60
+        status_list = list()
+        for i in range(statuses):
+            # the popular users tweet the most
+            user = user_list[(int(generator.paretovariate(1.2)) - 1) % users]
+            moment = now - week * i / statuses
+            status_id = (int(moment * 1000) - TWITTER_EPOCH) << 22 | i % (1 << 22)
+            tags = generator.sample(range(hashtags), 2)
+            mention = user_list[generator.randrange(users)]['screen_name']
+            status_list.append({
+                'id': status_id, 'id_str': str(status_id),
+                'created_at': datetime.utcfromtimestamp(moment).strftime(DATE_FORMAT),
+                'text': "Tweet {0} #tag{1} #tag{2} @{3}".format(i, tags[0], tags[1], mention),
+                'user': user,
+                'entities': {'hashtags': [{'text': "tag{0}".format(tag)} for tag in tags],
+                             'user_mentions': [{'screen_name': mention}], 'urls': []},
+                'coordinates': None, 'favorite_count': i % 7, 'retweet_count': i % 11,
+                'in_reply_to_status_id': None, 'in_reply_to_screen_name': mention if i % 5 == 0 else None,
+                'source': generator.choice(sources)})
+        world.add_statuses(status_list)
+        return world
+
+
+# words of a text as the search index sees them, from: and to: terms are kept whole
+WORD = re.compile(r"(?:from:|to:)?\w+")
+
+
+def terms(query):
+    """
+    :param query: terms connected with OR
+    :return: list of the lower case terms without quotes
+    """
+    return [term.strip().strip('"').lower() for term in query.split(" OR ")]
+
+
+def term_matches(status, term):
+    """
+    :param status: status JSON
+    :param term: lower case term without quotes: a phrase, a word, from:screen_name or to:screen_name
+    :return: True if the status matches the term
+    """
+    if term.startswith("from:"):
+        return status['user'].get('screen_name', '').lower() == term[5:]
+    if term.startswith("to:"):
+        return (status.get('in_reply_to_screen_name') or '').lower() == term[3:]
+    # a word matches the word and the hashtag or mention, not a longer word
+    return bool(term) and re.search(r"(?<!\w){0}(?!\w)".format(re.escape(term)), status.get('text', '').lower())
+
+
+def matches(status, query):
+    """
+    Evaluates the queries the collectors build: terms connected with OR, a term is a quoted phrase,
+    a word, from:screen_name or to:screen_name
+    :param status: status JSON
+    :param query: the query string
+    :return: True if the status matches one of the terms
+    """
+    return any(term_matches(status, term) for term in terms(query))
+
+
+class FakeResponse:
+    """
+    The parts of a requests response the rate limit scheduler reads
+    """
+    def __init__(self, endpoint, status_code=200, remaining=None, reset=None):
+        self.url = "https://api.twitter.com/1.1/{0}.json".format(endpoint)
+        self.status_code = status_code
+        self.headers = dict()
+        if remaining is not None:
+            self.headers['x-rate-limit-remaining'] = str(remaining)
+            self.headers['x-rate-limit-reset'] = str(int(reset))
+
+
+class FakeMethod:
+    """
+    What a tweepy api method returns when it is called with create=True: the payload type the model parser
+    of a tweepy.Cursor reads
+    """
+    def __init__(self, payload_type, payload_list=False):
+        self.api = None
+        self.payload_type = payload_type
+        self.payload_list = payload_list
+
+
+def respond(payload, payload_type, payload_list=False, parser=None):
+    """
+    Returns the JSON of a response the way the parser of the call would
+    :param payload: the JSON of the response
+    :param payload_type: the tweepy model of the response, ex status
+    :param payload_list: True if the response is a list of models
+    :param parser: None for tweepy models, a JSONParser for the JSON itself, other parsers get the JSON as text
+                   (a tweepy.Cursor pages by id with a RawParser)
+    :return: the parsed response
+    """
+    if parser is None:
+        model = getattr(tweepy.models.ModelFactory, payload_type)
+        return model.parse_list(None, payload) if payload_list else model.parse(None, payload)
+    if type(parser) is tweepy.parsers.JSONParser:
+        return payload
+    return parser.parse(FakeMethod(payload_type, payload_list), json.dumps(payload))
+
+
+class FakeClock:
+    """
+    Clock shared by a FakeAPI and the rate limit schedulers: time runs as usual, but sleep returns at once
+    and moves the clock forward, so waiting for a rate limit window costs no real time
+    The seconds slept are the time the collection would have waited on the live API
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.slept = 0
+        self._lock = threading.Lock()
+        # time each thread read last, its sleep is counted from there
+        self._read = threading.local()
+
+    def time(self):
+        now = time.time() + self.slept
+        self._read.now = now
+        return now
+
+    def sleep(self, seconds):
+        """
+        Threads that wait for the same window reset wake up at the same moment, the clock moves forward once
+        """
+        with self._lock:
+            start = getattr(self._read, 'now', None) or time.time() + self.slept
+            self.slept = max(self.slept, start + max(0, seconds) - time.time())
+
+    def elapsed(self):
+        """
+        :return: seconds since the clock was made, including the seconds slept
+        """
+        return self.time() - self.start
+
+
+class FakeAPI:
+    """
+    Serves a FakeTwitter with the methods of tweepy.API the collectors use
+    Every endpoint has a rate limit window with the limits of DEFAULT_LIMITS, last_response holds its headers
+    and a request over the limit raises tweepy.RateLimitError
+    """
+    def __init__(self, world, clock=None, latency=0, error_rate=0, limits=None, seed=None, max_query_terms=None):
+        """
+        :param world: the FakeTwitter that is served
+        :param clock: FakeClock or an object with time(), default the real time
+        :param latency: seconds every request takes
+        :param error_rate: share of the requests that fail with HTTP 503
+        :param limits: dict endpoint -> requests per window, replaces DEFAULT_LIMITS for those endpoints
+        :param seed: seed of the error generator
+        :param max_query_terms: number of terms above which a search query is rejected as too complex,
+                                None to accept every query
+        """
+        self.world = world
+        self.max_query_terms = max_query_terms
+        self.clock = clock if clock is not None else time
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.last_response = None
+        # the parser of a tweepy.API, a tweepy.Cursor over a bound method swaps it while it pages by id
+        self.parser = tweepy.parsers.ModelParser()
+        # endpoint -> [requests left, reset time]
+        self.windows = dict()
+        self.requests = dict()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self, endpoint):
+        """
+        Counts a request to the endpoint, waits the latency and raises the errors of the API
+        """
+        with self._lock:
+            now = self.clock.time()
+            window = self.windows.get(endpoint)
+            if window is None or now >= window[1]:
+                window = [self.limits.get(endpoint, 15), now + WINDOW]
+                self.windows[endpoint] = window
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            failed = self.error_rate and self._random.random() < self.error_rate
+            if window[0] <= 0:
+                response = FakeResponse(endpoint, 429, 0, window[1])
+            else:
+                window[0] -= 1
+                response = FakeResponse(endpoint, 503 if failed else 200, window[0], window[1])
+            self.last_response = response
+        if self.latency:
+            time.sleep(self.latency)
+        if response.status_code == 429:
+            raise tweepy.RateLimitError([{'message': "Rate limit exceeded", 'code': 88}], response)
+        if response.status_code != 200:
+            raise tweepy.TweepError("Twitter error response: status code = {0}".format(response.status_code),
+                                    response)
+
+    def _ids(self, endpoint, relationships, user_id=None, screen_name=None, cursor=None, count=IDS_PAGE_SIZE,
+             **kwargs):
+        self._request(endpoint)
+        owner = self.world.user_id(user_id, screen_name)
+        if owner is None or owner not in self.world.users:
+            raise tweepy.TweepError("Sorry, that page does not exist.", FakeResponse(endpoint, 404), api_code=34)
+        if self.world.users[owner].get('protected'):
+            raise tweepy.TweepError("Not authorized.", FakeResponse(endpoint, 401))
+        ids = relationships.get(owner, [])
+        # the cursor is the position of the page, -1 for the first page
+        start = max(0, cursor or 0) if cursor != -1 else 0
+        page = ids[start:start + count]
+        next_cursor = start + count if start + count < len(ids) else 0
+        if cursor is None:
+            return page
+        return page, (-start if start else 0, next_cursor)
+
+    def friends_ids(self, **kwargs):
+        return self._ids('friends/ids', self.world.friends, **kwargs)
+    friends_ids.pagination_mode = 'cursor'
+
+    def followers_ids(self, **kwargs):
+        return self._ids('followers/ids', self.world.followers, **kwargs)
+    followers_ids.pagination_mode = 'cursor'
+
+    def get_user(self, id=None, user_id=None, screen_name=None, create=False, parser=None, **kwargs):
+        if create:
+            return FakeMethod('user')
+        self._request('users/show')
+        owner = self.world.user_id(user_id or (id if str(id).isdigit() else None),
+                                   screen_name or (None if str(id).isdigit() else id))
+        if owner not in self.world.users:
+            raise tweepy.TweepError("User not found.", FakeResponse('users/show', 404), api_code=50)
+        return respond(self.world.users[owner], 'user', parser=parser)
+
+    def _lists(self, endpoint, lists, user_id=None, screen_name=None, cursor=None, count=20, create=False,
+               **kwargs):
+        if create:
+            return FakeMethod('list', payload_list=True)
+        self._request(endpoint)
+        owner = self.world.user_id(user_id, screen_name)
+        if owner not in self.world.users:
+            raise tweepy.TweepError("Sorry, that page does not exist.", FakeResponse(endpoint, 404), api_code=34)
+        user_lists = lists.get(owner, [])
+        start = max(0, cursor or 0) if cursor != -1 else 0
+        page = respond(user_lists[start:start + count], 'list', payload_list=True)
+        next_cursor = start + count if start + count < len(user_lists) else 0
+        if cursor is None:
+            return page
+        return page, (-start if start else 0, next_cursor)
+
+    def lists_memberships(self, **kwargs):
+        return self._lists('lists/memberships', self.world.memberships, **kwargs)
+    lists_memberships.pagination_mode = 'cursor'
+
+    def lists_subscriptions(self, **kwargs):
+        return self._lists('lists/subscriptions', self.world.subscriptions, **kwargs)
+    lists_subscriptions.pagination_mode = 'cursor'
+
+    def lookup_users(self, user_ids=None, screen_names=None, **kwargs):
+        self._request('users/lookup')
+        user_ids = [self.world.user_id(user_id) for user_id in user_ids or ()]
+        user_ids += [self.world.user_id(screen_name=name) for name in screen_names or ()]
+        users = [tweepy.models.User.parse(None, self.world.users[user_id]) for user_id in user_ids[:LOOKUP_SIZE]
+                 if user_id in self.world.users]
+        if not users:
+            raise tweepy.TweepError("No user matches for specified terms.", FakeResponse('users/lookup', 404),
+                                    api_code=17)
+        return users
+
+    def _statuses(self, status_ids, since_id=None, max_id=None, count=20, trim_user=False):
+        """
+        :param status_ids: ids of the statuses, oldest first
+        :return: the JSON of the count newest statuses with an id above since_id and up to max_id, newest first
+        """
+        since_id = int(since_id) if since_id else 0
+        end = bisect_right(status_ids, int(max_id)) if max_id else len(status_ids)
+        start = max(bisect_right(status_ids, since_id), end - count)
+        page = list()
+        for status_id in reversed(status_ids[start:end]):
+            status = self.world.statuses[status_id]
+            if trim_user:
+                status = dict(status, user={'id': status['user']['id'], 'id_str': status['user']['id_str']})
+            page.append(status)
+        return page
+
+    def search(self, q=None, count=15, since_id=None, max_id=None, create=False, parser=None, **kwargs):
+        if create:
+            return FakeMethod('search_results')
+        self._request('search/tweets')
+        if self.max_query_terms is not None and len(terms(q)) > self.max_query_terms:
+            raise tweepy.TweepError("There were errors processing your request: Query is too complex",
+                                    FakeResponse('search/tweets', 403), api_code=195)
+        statuses = self._statuses(self.world.search(q), since_id, max_id, min(count, SEARCH_PAGE_SIZE))
+        # the JSON of search/tweets holds the statuses next to the search metadata
+        return respond({'statuses': statuses, 'search_metadata': {'query': q, 'count': count}}, 'search_results',
+                       parser=parser)
+    search.pagination_mode = 'id'
+
+    def user_timeline(self, user_id=None, screen_name=None, count=20, since_id=None, max_id=None, trim_user=False,
+                      create=False, parser=None, **kwargs):
+        if create:
+            return FakeMethod('status', payload_list=True)
+        self._request('statuses/user_timeline')
+        owner = self.world.user_id(user_id, screen_name)
+        # only the most recent tweets of a timeline can be paged
+        status_ids = self.world.timelines.get(owner, [])[-TIMELINE_LIMIT:]
+        return respond(self._statuses(status_ids, since_id, max_id, min(count, TIMELINE_PAGE_SIZE),
+                                      trim_user=trim_user), 'status', payload_list=True, parser=parser)
+    user_timeline.pagination_mode = 'id'
+
+
+class RecordingAPI:
+    """
+    Wraps a tweepy.API and adds every user, page of ids and status it returns to a FakeTwitter,
+    the FakeTwitter can be saved and replayed offline with a FakeAPI
+    Statuses are recorded with the JSON tweepy keeps in _json
+    """
+    def __init__(self, api, world=None):
+        """
+        :param api: the tweepy.API requests are sent with
+        :param world: FakeTwitter the responses are added to, default a new one
+        """
+        self.api = api
+        self.world = world if world is not None else FakeTwitter()
+
+    def __getattr__(self, name):
+        # everything that is not recorded goes to the wrapped api
+        return getattr(self.api, name)
+
+    def _record_ids(self, relationships, result, user_id=None, screen_name=None, **kwargs):
+        ids = result[0] if isinstance(result, tuple) else result
+        owner = self.world.user_id(user_id, screen_name)
+        if owner is not None:
+            self.world.add_ids(relationships, owner, ids)
+        return result
+
+    def friends_ids(self, **kwargs):
+        return self._record_ids(self.world.friends, self.api.friends_ids(**kwargs), **kwargs)
+    friends_ids.pagination_mode = 'cursor'
+
+    def followers_ids(self, **kwargs):
+        return self._record_ids(self.world.followers, self.api.followers_ids(**kwargs), **kwargs)
+    followers_ids.pagination_mode = 'cursor'
+
+    def lookup_users(self, *args, **kwargs):
+        users = self.api.lookup_users(*args, **kwargs)
+        self.world.add_users(user._json for user in users)
+        return users
+
+    def _record_statuses(self, result):
+        if isinstance(result, FakeMethod) or not isinstance(result, (str, dict, list)):
+            # create=True returns the api method itself
+            return result
+        # a tweepy.Cursor asks for the text of the JSON, a JSONParser for the JSON, the ModelParser for models
+        statuses = json.loads(result) if isinstance(result, str) else result
+        if isinstance(statuses, dict):
+            statuses = statuses['statuses']
+        self.world.add_statuses(getattr(status, '_json', status) for status in statuses)
+        return result
+
+    def search(self, *args, **kwargs):
+        return self._record_statuses(self.api.search(*args, **kwargs))
+    search.pagination_mode = 'id'
+
+    def user_timeline(self, *args, **kwargs):
+        return self._record_statuses(self.api.user_timeline(*args, **kwargs))
+    user_timeline.pagination_mode = 'id'
@@ -0,0 +1,247 @@
+import threading
+from array import array
+from bisect import bisect_left
+from enum import IntEnum
+
+try:
+    import numpy as np
+except ImportError:
+    # the store works without numpy, building the CSR form is slower
+    np = None
+
+from models import TwitterRelationship
+
+
+class Relation(IntEnum):
+    """
+    Relationship that was used to find an edge
+    """
+    FRIENDS = 0
+    FOLLOWERS = 1
+
+
+class IdFilter:
+    """
+    Keeps the ids of a cursor page that belong to the network
+    The pages arrive as lists (the JSON of tweepy) and are intersected with a set in one C-level call,
+    converting a list to a sorted array costs more than the set lookups it would save
+    """
+    def __init__(self, network_ids):
+        """
+        :param network_ids: iterable of the ids of all users in the network
+        """
+        self.network_ids = set(network_ids)
+
+    def __len__(self):
+        return len(self.network_ids)
+
+    def filter(self, ids, exclude=None):
+        """
+        :param ids: iterable of the ids of one cursor page
+        :param exclude: id that is dropped as well (the user the page belongs to)
+        :return: list of the ids that are part of the network
+        """
+        members = self.network_ids.intersection(ids)
+        members.discard(exclude)
+        return list(members)
+
+
+def counting_csr(sources, targets, relations, users):
+    """
+    Builds the CSR form of an edge list without numpy, with two stable counting sorts over the typed arrays:
+    no Python object is kept per edge, the build needs about 9 bytes per edge next to the edge list
+    :param sources: array of the source index of every edge
+    :param targets: array of the target index of every edge
+    :param relations: array of the Relation of every edge
+    :param users: number of user indices
+    :return: (offsets, targets, relations) sorted by source, target and relation, duplicate edges removed
+    """
+    edges = len(sources)
+    kinds = max(relations) + 1 if edges else 1
+    # first on (target, relation)
+    counts = array('q', [0]) * (users * kinds + 1)
+    for target, relation in zip(targets, relations):
+        counts[target * kinds + relation + 1] += 1
+    for key in range(users * kinds):
+        counts[key + 1] += counts[key]
+    order = array('i', [0]) * edges
+    for position, (target, relation) in enumerate(zip(targets, relations)):
+        key = target * kinds + relation
+        order[counts[key]] = position
+        counts[key] += 1
+    del counts
+    # then on source, the sort is stable so the edges of a source stay sorted on (target, relation)
+    offsets = array('q', [0]) * (users + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    for i in range(users):
+        offsets[i + 1] += offsets[i]
+    slots = offsets[:-1]
+    sorted_targets = array('i', [0]) * edges
+    sorted_relations = array('b', [0]) * edges
+    for position in order:
+        source = sources[position]
+        slot = slots[source]
+        sorted_targets[slot] = targets[position]
+        sorted_relations[slot] = relations[position]
+        slots[source] = slot + 1
+    del order, slots
+    # duplicate edges are next to each other, the first one is kept
+    kept = 0
+    start = 0
+    for source in range(users):
+        end = offsets[source + 1]
+        previous = None
+        for i in range(start, end):
+            edge = (sorted_targets[i], sorted_relations[i])
+            if edge != previous:
+                sorted_targets[kept], sorted_relations[kept] = edge
+                kept += 1
+                previous = edge
+        offsets[source + 1] = kept
+        start = end
+    del sorted_targets[kept:]
+    del sorted_relations[kept:]
+    return offsets, sorted_targets, sorted_relations
+
+
+class EgoGraph:
+    """
+    Compact store of the edges of an ego network
+    User ids are interned to small integer indices, edges are appended to typed arrays while crawling
+    (9 bytes per edge instead of a Python object per edge) and turned into CSR form for queries
+    """
+    def __init__(self):
+        # user id -> index, and index -> user id
+        self._index = dict()
+        self.ids = array('q')
+        # edge list, in the order the edges were added
+        self._sources = array('i')
+        self._targets = array('i')
+        self._relations = array('b')
+        # (offsets, targets, relations) sorted by source and target, None if edges were added since the last build
+        self._csr = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __contains__(self, user_id):
+        return user_id in self._index
+
+    def _intern(self, user_id):
+        # lock must be held
+        index = self._index.get(user_id)
+        if index is None:
+            index = len(self.ids)
+            self._index[user_id] = index
+            self.ids.append(user_id)
+        return index
+
+    def add_user(self, user_id):
+        """
+        Adds a user without edges
+        :param user_id: id of the user
+        """
+        with self._lock:
+            self._intern(user_id)
+
+    def add_edge(self, from_user_id, to_user_id, relation):
+        """
+        :param from_user_id: id of the user the relationship starts from
+        :param to_user_id: id of the other user
+        :param relation: Relation used to find the edge
+        """
+        self.add_edges(from_user_id, (to_user_id,), relation)
+
+    def add_edges(self, from_user_id, to_user_ids, relation):
+        """
+        Adds the edges from one user to many users
+        :param from_user_id: id of the user the relationships start from
+        :param to_user_ids: iterable of ids of the other users
+        :param relation: Relation used to find the edges
+        """
+        with self._lock:
+            source = self._intern(from_user_id)
+            targets = array('i', [self._intern(user_id) for user_id in to_user_ids])
+            self._sources.extend(array('i', [source]) * len(targets))
+            self._targets.extend(targets)
+            self._relations.extend(array('b', [int(relation)]) * len(targets))
+            self._csr = None
+
+    def _build(self):
+        """
+        Builds the CSR form: the edges sorted by source and target, duplicate edges removed
+        :return: (offsets, targets, relations), the edges of user index i are offsets[i]:offsets[i + 1]
+        """
+        with self._lock:
+            if self._csr is not None:
+                return self._csr
+            users = len(self.ids)
+            if np is not None and len(self._sources):
+                sources = np.frombuffer(self._sources, dtype=np.int32)
+                targets = np.frombuffer(self._targets, dtype=np.int32)
+                relations = np.frombuffer(self._relations, dtype=np.int8)
+                order = np.lexsort((relations, targets, sources))
+                sources, targets, relations = sources[order], targets[order], relations[order]
+                keep = np.ones(len(sources), dtype=bool)
+                keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1]) | \
+                           (relations[1:] != relations[:-1])
+                sources, targets, relations = sources[keep], targets[keep], relations[keep]
+                offsets = np.zeros(users + 1, dtype=np.int64)
+                np.cumsum(np.bincount(sources, minlength=users), out=offsets[1:])
+                self._csr = (array('q', offsets.tobytes()), array('i', targets.tobytes()),
+                             array('b', relations.tobytes()))
+            else:
+                self._csr = counting_csr(self._sources, self._targets, self._relations, users)
+            return self._csr
+
+    def neighbours(self, user_id, relation=None):
+        """
+        :param user_id: id of the user
+        :param relation: only edges found with this Relation, all edges if None
+        :return: list of ids of the users the user has an edge to
+        """
+        index = self._index.get(user_id)
+        if index is None:
+            return []
+        offsets, targets, relations = self._build()
+        return [self.ids[targets[i]] for i in range(offsets[index], offsets[index + 1])
+                if relation is None or relations[i] == relation]
+
+    def has_edge(self, from_user_id, to_user_id, relation=None):
+        """
+        :param from_user_id: id of the user the relationship starts from
+        :param to_user_id: id of the other user
+        :param relation: only edges found with this Relation, any edge if None
+        :return: True if the edge is in the store
+        """
+        source = self._index.get(from_user_id)
+        target = self._index.get(to_user_id)
+        if source is None or target is None:
+            return False
+        offsets, targets, relations = self._build()
+        # the targets of a user are sorted
+        i = bisect_left(targets, target, offsets[source], offsets[source + 1])
+        while i < offsets[source + 1] and targets[i] == target:
+            if relation is None or relations[i] == relation:
+                return True
+            i += 1
+        return False
+
+    def edges(self):
+        """
+        :return: generator of (from_user_id, to_user_id, Relation) tuples, without duplicates
+        """
+        offsets, targets, relations = self._build()
+        for source in range(len(offsets) - 1):
+            for i in range(offsets[source], offsets[source + 1]):
+                yield self.ids[source], self.ids[targets[i]], Relation(relations[i])
+
+    def relationships(self):
+        """
+        :return: generator of TwitterRelationship objects, created only when they are needed
+        """
+        for from_user_id, to_user_id, relation in self.edges():
+            yield TwitterRelationship(from_user_id=from_user_id, to_user_id=to_user_id,
+                                      relation_used=relation.name.lower())
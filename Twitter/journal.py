@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+from datetime import datetime
+
+from models import TwitterUser
+
+# attributes of TwitterUser stored in the journal, in column order
+USER_COLUMNS = TwitterUser.__slots__
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def user_to_row(user):
+    """
+    :param user: TwitterUser object
+    :return: tuple with the values of USER_COLUMNS
+    """
+    row = list()
+    for column in USER_COLUMNS:
+        value = getattr(user, column)
+        if isinstance(value, datetime):
+            value = value.strftime(DATE_FORMAT)
+        row.append(value)
+    return tuple(row)
+
+
+def row_to_user(row):
+    """
+    :param row: tuple with the values of USER_COLUMNS
+    :return: TwitterUser object
+    """
+    values = dict(zip(USER_COLUMNS, row))
+    if values['date_created']:
+        values['date_created'] = datetime.strptime(values['date_created'], DATE_FORMAT)
+    for column in ('default_profile_image', 'verified', 'is_protected', 'max_followers_exceeded'):
+        values[column] = bool(values[column])
+    return TwitterUser(**values)
+
+
+class CrawlJournal:
+    """
+    Persistent state of a profile information search, stored in a SQLite database
+    Keeps the collected users, the finished phases, the next cursor of every user in the relationships phase
+    and of every EGO-user in the friends and followers phases, and the edges already collected, so a crawl that
+    is restarted continues where it stopped
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the database file, created if it does not exist
+        """
+        self.path = path
+        # the relationship crawler writes from several threads
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS users ({0}, is_ego INTEGER NOT NULL DEFAULT 0, "
+                                     "PRIMARY KEY (user_id))".format(", ".join(USER_COLUMNS)))
+            self._connection.execute("CREATE TABLE IF NOT EXISTS phases (name TEXT PRIMARY KEY)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS cursors (user_id INTEGER, relation_used TEXT, "
+                                     "next_cursor INTEGER, PRIMARY KEY (user_id, relation_used))")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS edges (from_user_id INTEGER, to_user_id INTEGER, "
+                                     "relation_used TEXT, PRIMARY KEY (from_user_id, to_user_id, relation_used))")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def phase_done(self, name):
+        """
+        :param name: name of the phase, ex friends:screen_name
+        :return: True if the phase was finished in an earlier run
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM phases WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def finish_phase(self, name, edges=(), relation_used=None):
+        """
+        Marks a phase as finished, together with the edges it found in one transaction
+        :param name: name of the phase
+        :param edges: list of (from_user_id, to_user_id) tuples
+        :param relation_used: 'friends' or 'followers', the relation of the edges
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO edges VALUES (?, ?, ?)",
+                                         [(from_id, to_id, relation_used) for from_id, to_id in edges])
+            self._connection.execute("INSERT OR IGNORE INTO phases (name) VALUES (?)", (name,))
+
+    def save_users(self, users, is_ego=False):
+        """
+        Stores hydrated users, a user that is stored again gets the new values
+        An EGO-user stays an EGO-user when it is stored again as the friend or follower of another EGO-user
+        :param users: list of TwitterUser objects
+        :param is_ego: True if the users are EGO-users
+        """
+        rows = [user_to_row(user) + (int(is_ego),) for user in users]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT INTO users VALUES ({0}) ON CONFLICT(user_id) DO UPDATE SET {1}, "
+                "is_ego = MAX(is_ego, excluded.is_ego)".format(
+                    ", ".join("?" * (len(USER_COLUMNS) + 1)),
+                    ", ".join("{0} = excluded.{0}".format(column) for column in USER_COLUMNS
+                              if column != 'user_id')), rows)
+
+    def load_users(self, is_ego=None):
+        """
+        :param is_ego: only EGO-users if True, only other users if False, all users if None
+        :return: list of TwitterUser objects
+        """
+        query = "SELECT {0} FROM users".format(", ".join(USER_COLUMNS))
+        params = ()
+        if is_ego is not None:
+            query += " WHERE is_ego = ?"
+            params = (int(is_ego),)
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [row_to_user(row) for row in rows]
+
+    def next_cursor(self, user_id, relation_used):
+        """
+        :param user_id: id of the user
+        :param relation_used: 'friends' or 'followers', or the phase of an EGO-user, ex friends:screen_name
+        :return: the cursor to continue with, -1 if the user was not started, 0 if the user is finished
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT next_cursor FROM cursors WHERE user_id = ? AND relation_used = ?",
+                                           (user_id, relation_used)).fetchone()
+        return -1 if row is None else row[0]
+
+    def save_page(self, user_id, relation_used, next_cursor, edges):
+        """
+        Stores the edges of one cursor page together with the cursor of the next page
+        Both are written in one transaction, a page is never stored half
+        :param user_id: id of the user the page belongs to
+        :param relation_used: 'friends' or 'followers', or the phase of an EGO-user, ex friends:screen_name
+        :param next_cursor: cursor of the next page, 0 if the user is finished
+        :param edges: list of (from_user_id, to_user_id) tuples
+        """
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR IGNORE INTO edges VALUES (?, ?, ?)",
+                                         [(from_id, to_id, relation_used) for from_id, to_id in edges])
+            self._connection.execute("INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)",
+                                     (user_id, relation_used, next_cursor))
+
+    def load_edges(self, relation_used):
+        """
+        :param relation_used: 'friends' or 'followers'
+        :return: list of (from_user_id, to_user_id) tuples collected in earlier runs
+        """
+        with self._lock:
+            return self._connection.execute("SELECT from_user_id, to_user_id FROM edges WHERE relation_used = ?",
+                                            (relation_used,)).fetchall()
@@ -0,0 +1,82 @@
+import threading
+
+from ratelimit import RateLimitScheduler
+
+
+class Credential:
+    """
+    One set of TwitterKeys with its own api object and rate limit state
+    """
+    def __init__(self, keys, scheduler):
+        self.keys = keys
+        self.scheduler = scheduler
+        # set by TwitterTweepy.authenticate
+        self.api = None
+
+
+class KeyPool:
+    """
+    Pool of TwitterKeys, every request is dispatched to the keys with the most quota left for the endpoint
+    With n key sets the pool can send n times the requests of a single app per rate limit window
+    """
+    def __init__(self, keys, scheduler_factory=RateLimitScheduler):
+        """
+        :param keys: a TwitterKeys object or a list of TwitterKeys objects
+        :param scheduler_factory: creates the rate limit scheduler of a key set
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+        if not keys:
+            raise ValueError("KeyPool needs at least one set of TwitterKeys")
+        self.credentials = [Credential(key, scheduler_factory()) for key in keys]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def select(self, endpoint):
+        """
+        Returns the credential with the most requests left for the endpoint
+        If all windows are used up, the credential whose window resets first is returned
+        :param endpoint: name of the endpoint, ex friends/ids
+        :return: Credential object
+        """
+        with self._lock:
+            best = None
+            best_key = None
+            for credential in self.credentials:
+                remaining = credential.scheduler.remaining(endpoint)
+                reset = credential.scheduler.reset_time(endpoint) or 0
+                # most remaining first, earliest reset when nothing is left
+                key = (remaining, -reset if remaining <= 0 else 0)
+                if best_key is None or key > best_key:
+                    best = credential
+                    best_key = key
+            return best
+
+    def remaining(self, endpoint):
+        """
+        :param endpoint: name of the endpoint
+        :return: the total number of requests left for the endpoint over all keys
+        """
+        return sum(credential.scheduler.remaining(endpoint) for credential in self.credentials)
+
+    def method(self, endpoint, name):
+        """
+        Returns an api method that sends every call with the best credential for the endpoint
+        Cursor positions are not bound to keys, so consecutive pages of a cursor can use different keys
+        :param endpoint: name of the endpoint, ex friends/ids
+        :param name: name of the tweepy api method, ex friends_ids
+        :return: the dispatching method, can be used in a tweepy.Cursor
+        """
+        def call(*args, **kwargs):
+            # no request is made, any api will do
+            if kwargs.get('create'):
+                return getattr(self.credentials[0].api, name)(*args, **kwargs)
+            credential = self.select(endpoint)
+            return credential.scheduler.limited(endpoint, getattr(credential.api, name), credential.api)(*args,
+                                                                                                          **kwargs)
+        method = getattr(self.credentials[0].api, name)
+        if hasattr(method, 'pagination_mode'):
+            call.pagination_mode = method.pagination_mode
+        return call
@@ -0,0 +1,241 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# upper bounds in seconds of the buckets of the timing histograms
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# prefix of the metric names in the Prometheus text format
+PREFIX = "twitter_"
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, str(value).replace('"', '\\"')) for name, value in pairs) + "}"
+
+
+class Histogram:
+    """
+    Counts of observed durations per bucket, with their number and sum
+    """
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class Metrics:
+    """
+    Counters, gauges and timing histograms of the collectors, with labels
+    Read as a dict with snapshot, as Prometheus text with prometheus, over HTTP with serve
+    or as JSON lines written every few seconds with write_snapshots
+    """
+    def __init__(self, clock=time.time):
+        """
+        :param clock: function returning the current time
+        """
+        self.clock = clock
+        self.started = clock()
+        self._counters = dict()
+        self._gauges = dict()
+        self._histograms = dict()
+        # prefix -> function returning a dict of gauges, ex the counters of a BackgroundWriter
+        self._collectors = dict()
+        # counters and time of the previous snapshot, for the rates
+        self._previous = (self.started, dict())
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds to a counter
+        :param name: name of the counter, ex api_calls_total
+        :param value: amount added
+        :param labels: labels of the counter, ex endpoint='search/tweets'
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Sets a gauge
+        """
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Adds a duration to a histogram
+        :param name: name of the histogram, ex network_seconds
+        :param seconds: the duration
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observes the duration of a with block in a histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def collect(self, prefix, function):
+        """
+        Reads gauges from a function at every snapshot
+        :param prefix: prefix of the gauge names, a later function with the same prefix replaces this one
+        :param function: function returning a dict name -> number
+        """
+        with self._lock:
+            self._collectors[prefix] = function
+
+    def remove(self, prefix):
+        with self._lock:
+            self._collectors.pop(prefix, None)
+
+    def counter(self, name, **labels):
+        """
+        :return: the value of a counter, 0 if it was never increased
+        """
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def _collected(self):
+        # lock must be held
+        gauges = dict(self._gauges)
+        for prefix, function in self._collectors.items():
+            for name, value in function().items():
+                gauges[_key("{0}_{1}".format(prefix, name), {})] = value
+        return gauges
+
+    def snapshot(self):
+        """
+        :return: dict with the time, the uptime, the counters, their rates per second since the previous snapshot,
+                 the gauges and the histograms; names with labels are written as name{label="value"}
+        """
+        with self._lock:
+            now = self.clock()
+            previous_time, previous = self._previous
+            counters = dict(self._counters)
+            elapsed = max(now - previous_time, 1e-9)
+            self._previous = (now, counters)
+            return {
+                'time': now,
+                'uptime': now - self.started,
+                'counters': dict((name + _labels(labels), value) for (name, labels), value in counters.items()),
+                'rates': dict((name + _labels(labels), (value - previous.get((name, labels), 0)) / elapsed)
+                              for (name, labels), value in counters.items()),
+                'gauges': dict((name + _labels(labels), value)
+                               for (name, labels), value in self._collected().items()),
+                'histograms': dict((name + _labels(labels), {'count': histogram.count, 'sum': histogram.sum,
+                                                             'buckets': dict(zip(BUCKETS + ('+Inf',),
+                                                                                 histogram.counts))})
+                                   for (name, labels), histogram in self._histograms.items()),
+            }
+
+    def prometheus(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = list()
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._collected().items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        typed = set()
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in values:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append("# TYPE {0}{1} {2}".format(PREFIX, name, kind))
+                lines.append("{0}{1}{2} {3}".format(PREFIX, name, _labels(labels), value))
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {0}{1} histogram".format(PREFIX, name))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append("{0}{1}_bucket{2} {3}".format(PREFIX, name, _labels(labels, [('le', bound)]),
+                                                           cumulative))
+            lines.append("{0}{1}_sum{2} {3}".format(PREFIX, name, _labels(labels), histogram.sum))
+            lines.append("{0}{1}_count{2} {3}".format(PREFIX, name, _labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        """
+        Serves the Prometheus text on /metrics and the snapshot as JSON on /metrics.json, on a daemon thread
+        :param port: port of the HTTP server
+        :param host: address the server listens on
+        :return: the HTTPServer, shutdown stops it
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry.prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(registry.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        return server
+
+    def write_snapshots(self, path, interval=60):
+        """
+        Appends a JSON snapshot to a file every interval seconds, on a daemon thread
+        :param path: file of JSON lines
+        :param interval: seconds between two snapshots
+        :return: threading.Event, set it to stop writing
+        """
+        stop = threading.Event()
+
+        def write():
+            while not stop.wait(interval):
+                with open(path, 'a', encoding='utf-8') as snapshots:
+                    snapshots.write(json.dumps(self.snapshot()) + "\n")
+
+        threading.Thread(target=write, name="metrics-snapshots", daemon=True).start()
+        return stop
+
+
+# registry of the process, the collectors of all TwitterTweepy objects count in it
+metrics = Metrics()
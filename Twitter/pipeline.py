@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+
+from metrics import metrics
+
+# maximum number of ids in one users/lookup request
+LOOKUP_SIZE = 100
+
+
+def dedup(id_pages, seen):
+    """
+    Removes the ids that were already seen from a stream of cursor pages
+    :param id_pages: iterable of pages of ids
+    :param seen: set of ids already seen, new ids are added to it
+    :return: generator of ids that were not seen before
+    """
+    for page in id_pages:
+        for user_id in page:
+            if user_id not in seen:
+                seen.add(user_id)
+                yield user_id
+
+
+def batches(ids, size=LOOKUP_SIZE):
+    """
+    Groups ids into lists of at most size ids, in one pass
+    A sequence is sliced, so an array.array or numpy array gives slices of the same type (numpy slices are
+    views, nothing is copied); other iterables, like a stream of cursor pages, are consumed lazily
+    :param ids: iterable of ids
+    :param size: maximum size of a batch
+    :return: generator of batches
+    """
+    if hasattr(ids, '__getitem__') and hasattr(ids, '__len__') and not isinstance(ids, (dict, str)):
+        for start in range(0, len(ids), size):
+            yield ids[start:start + size]
+        return
+    iterator = iter(ids)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class HydrationPipeline:
+    """
+    Turns the id pages of a cursor into user objects while the cursor is still running
+    cursor pages -> dedup -> user cache -> batches of 100 ids -> concurrent users/lookup -> sink
+    At most max_pending lookups are in flight, so memory stays bounded by the pages being processed
+    """
+    def __init__(self, lookup, sink, seen=None, cache=None, workers=4, max_pending=8):
+        """
+        :param lookup: function that converts a list of at most 100 ids to a list of users
+        :param sink: function that receives every list of users, called on the thread running the pipeline
+        :param seen: set of ids already hydrated, shared between runs to skip ids after a retry
+        :param cache: UserCache, cached users go to the sink without a lookup, None to look up every id
+        :param workers: number of lookups running at once
+        :param max_pending: maximum number of batches waiting for a lookup
+        """
+        self.lookup = lookup
+        self.sink = sink
+        self.seen = seen if seen is not None else set()
+        self.cache = cache
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.users = 0
+
+    def run(self, id_pages):
+        """
+        Hydrates all new ids of the pages
+        If a lookup fails, its ids are removed from seen so a retry hydrates them, and the error is raised
+        once the other lookups in flight are delivered
+        :param id_pages: iterable of pages of ids, ex tweepy.Cursor(...).pages()
+        :return: the number of users delivered to the sink
+        """
+        pending = dict()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for batch in batches(self._uncached(dedup(id_pages, self.seen))):
+                    pending[executor.submit(self.lookup, batch)] = batch
+                    if len(pending) >= self.max_pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        error = self._deliver(done, pending) or error
+                        if error is not None:
+                            break
+            finally:
+                # deliver what is still in flight, also when the cursor raised
+                if pending:
+                    done, _ = wait(pending)
+                    error = self._deliver(done, pending) or error
+        if error is not None:
+            raise error
+        return self.users
+
+    def _uncached(self, ids):
+        """
+        Sends the cached users to the sink, so only the missing ids fill the lookup batches
+        :param ids: iterable of ids
+        :return: generator of the ids that are not cached
+        """
+        if self.cache is None:
+            for user_id in ids:
+                yield user_id
+            return
+        hits = list()
+        for user_id in ids:
+            user = self.cache.get(user_id)
+            if user is None:
+                yield user_id
+                continue
+            hits.append(user)
+            if len(hits) == LOOKUP_SIZE:
+                self.users += len(hits)
+                metrics.inc('users_total', len(hits))
+                self.sink(hits)
+                hits = list()
+        if hits:
+            self.users += len(hits)
+            metrics.inc('users_total', len(hits))
+            self.sink(hits)
+
+    def _deliver(self, done, pending):
+        """
+        Sends the users of finished lookups to the sink
+        :return: the first error of a failed lookup, or None
+        """
+        error = None
+        for future in done:
+            batch = pending.pop(future)
+            try:
+                users = future.result()
+            except Exception as e:
+                self.seen.difference_update(batch)
+                error = error or e
+                continue
+            self.users += len(users)
+            metrics.inc('users_total', len(users))
+            self.sink(users)
+        return error
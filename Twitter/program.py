@@ -1,8 +1,11 @@
+import logging
 import sys
 from models import TwitterKeys
 from TwitterTweepy import TwitterTweepy
 
 def main(args):
+    # the progress messages of the collectors are logged at INFO
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
     keys = TwitterKeys()
     tweepy = TwitterTweepy(keys)
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+
+import tweepy
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# length of a rate limit window of the REST API in seconds
+WINDOW = 15 * 60
+
+# requests per 15 minute window for each endpoint (user authentication)
+# https://dev.twitter.com/rest/public/rate-limits
+DEFAULT_LIMITS = {
+    'friends/ids': 15,
+    'followers/ids': 15,
+    'users/lookup': 900,
+    'users/show': 900,
+    'search/tweets': 180,
+    'statuses/user_timeline': 900,
+    'lists/memberships': 75,
+    'lists/subscriptions': 15,
+}
+
+
+class TokenBucket:
+    """
+    Request budget of one endpoint for the current rate limit window
+    The bucket is decremented optimistically before every request and corrected with
+    the x-rate-limit-remaining and x-rate-limit-reset headers of every response
+    """
+    def __init__(self, limit, window=WINDOW):
+        self.limit = limit
+        self.window = window
+        self.remaining = limit
+        # epoch seconds at which the window resets, None if no window is running
+        self.reset = None
+        # True once the reset of the window comes from the headers, before that it is a local guess
+        self.confirmed = False
+
+    def reserve(self, now):
+        """
+        Take one request from the bucket
+        :param now: the current time
+        :return: 0 if the request can be sent, otherwise the number of seconds until the window resets
+        """
+        if self.reset is not None and now >= self.reset:
+            # window is over, full quota again
+            self.remaining = self.limit
+            self.reset = None
+        if self.remaining > 0:
+            self.remaining -= 1
+            if self.reset is None:
+                # the window of the keys may have started earlier (another run), the headers correct this guess
+                self.reset = now + self.window
+                self.confirmed = False
+            return 0
+        return self.reset - now
+
+    def update(self, remaining, reset):
+        """
+        Correct the bucket with the values Twitter returned
+        :param remaining: value of x-rate-limit-remaining, or None
+        :param reset: value of x-rate-limit-reset, or None
+        """
+        if reset is not None and (not self.confirmed or self.reset is None or reset > self.reset):
+            # the first headers of a window, or a new window has started: the headers are authoritative
+            self.reset = reset
+            self.confirmed = True
+            if remaining is not None:
+                self.remaining = remaining
+        elif remaining is not None:
+            # responses can arrive out of order, never give back quota within a window
+            self.remaining = min(self.remaining, remaining)
+
+    def exhaust(self, reset, confirmed=False):
+        """
+        Mark the window as used up (after a rate limit error)
+        :param reset: time the window resets
+        :param confirmed: True if reset comes from the headers
+        """
+        self.remaining = 0
+        self.reset = reset
+        self.confirmed = confirmed
+
+
+class RateLimitScheduler:
+    """
+    Keeps a token bucket per endpoint and only waits when the window of an endpoint is used up
+    The clock and sleep functions can be replaced to run the scheduler against a fake clock
+    """
+    def __init__(self, limits=None, clock=time.time, sleep=time.sleep, margin=2):
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.clock = clock
+        self.sleep = sleep
+        # extra seconds waited after a reset, Twitter's clock and ours are not in sync
+        self.margin = margin
+        self.buckets = dict()
+        self.waited = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, endpoint):
+        # lock must be held
+        bucket = self.buckets.get(endpoint)
+        if bucket is None:
+            bucket = TokenBucket(self.limits.get(endpoint, 15))
+            self.buckets[endpoint] = bucket
+        return bucket
+
+    def acquire(self, endpoint):
+        """
+        Blocks until a request to the endpoint is allowed
+        :param endpoint: name of the endpoint, ex friends/ids
+        """
+        while True:
+            with self._lock:
+                delay = self._bucket(endpoint).reserve(self.clock())
+            if delay <= 0:
+                return
+            logger.info("Rate limit of %s used up, waiting %.0f seconds", endpoint, delay + self.margin)
+            metrics.inc('rate_limit_waits_total', endpoint=endpoint)
+            metrics.inc('rate_limit_wait_seconds_total', delay + self.margin, endpoint=endpoint)
+            self.waited += delay + self.margin
+            self.sleep(delay + self.margin)
+
+    def remaining(self, endpoint):
+        """
+        :param endpoint: name of the endpoint
+        :return: the number of requests left in the current window of the endpoint
+        """
+        with self._lock:
+            bucket = self._bucket(endpoint)
+            if bucket.reset is not None and self.clock() >= bucket.reset:
+                return bucket.limit
+            return bucket.remaining
+
+    def reset_time(self, endpoint):
+        """
+        :param endpoint: name of the endpoint
+        :return: the time the current window of the endpoint resets, None if no window is running
+        """
+        with self._lock:
+            return self._bucket(endpoint).reset
+
+    def update(self, endpoint, response):
+        """
+        Update the bucket of an endpoint with the rate limit headers of a response
+        :param endpoint: name of the endpoint
+        :param response: the http response, responses of other endpoints are ignored
+        """
+        if response is None or '/{0}.json'.format(endpoint) not in getattr(response, 'url', ''):
+            return
+        remaining = response.headers.get('x-rate-limit-remaining')
+        reset = response.headers.get('x-rate-limit-reset')
+        with self._lock:
+            self._bucket(endpoint).update(int(remaining) if remaining is not None else None,
+                                          int(reset) if reset is not None else None)
+
+    def exhaust(self, endpoint, response=None):
+        """
+        Mark the window of an endpoint as used up
+        :param endpoint: name of the endpoint
+        :param response: the http response of the rate limit error, if any
+        """
+        reset = None
+        if response is not None and response.headers.get('x-rate-limit-reset') is not None:
+            reset = int(response.headers.get('x-rate-limit-reset'))
+        with self._lock:
+            confirmed = reset is not None
+            if reset is None:
+                reset = self.clock() + WINDOW
+            self._bucket(endpoint).exhaust(reset, confirmed)
+
+    def limited(self, endpoint, method, api):
+        """
+        Wraps a tweepy api method so every call is scheduled on the bucket of the endpoint
+        The wrapper can be used in a tweepy.Cursor
+        :param endpoint: name of the endpoint
+        :param method: the tweepy api method
+        :param api: the tweepy api the method belongs to (holds the last response)
+        :return: the wrapped method
+        """
+        def call(*args, **kwargs):
+            # tweepy's IdIterator asks the method for its APIMethod object, no request is made
+            if kwargs.get('create'):
+                return method(*args, **kwargs)
+            while True:
+                self.acquire(endpoint)
+                metrics.inc('api_calls_total', endpoint=endpoint)
+                start = time.perf_counter()
+                try:
+                    result = method(*args, **kwargs)
+                except tweepy.RateLimitError as e:
+                    # window used up by someone else with the same keys: wait for the reset and retry
+                    metrics.inc('rate_limit_retries_total', endpoint=endpoint)
+                    self.exhaust(endpoint, e.response)
+                    continue
+                except tweepy.TweepError as e:
+                    if e.response is not None and e.response.status_code == 429:
+                        metrics.inc('rate_limit_retries_total', endpoint=endpoint)
+                        self.exhaust(endpoint, e.response)
+                        continue
+                    metrics.inc('api_errors_total', endpoint=endpoint,
+                                status=e.response.status_code if e.response is not None else 'none')
+                    self.update(endpoint, e.response)
+                    raise
+                finally:
+                    metrics.observe('network_seconds', time.perf_counter() - start, endpoint=endpoint)
+                self.update(endpoint, getattr(api, 'last_response', None))
+                return result
+        if hasattr(method, 'pagination_mode'):
+            call.pagination_mode = method.pagination_mode
+        return call
@@ -0,0 +1,157 @@
+import logging
+import random
+import threading
+import time
+
+import tweepy
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# classes of the errors of the API
+RATE_LIMIT = 'rate_limit'
+TRANSIENT = 'transient'
+AUTH = 'auth'
+PROTECTED = 'protected'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+# what is done with every class: retried after a backoff, skipped and recorded, or raised to the caller
+RETRY = 'retry'
+SKIP = 'skip'
+RAISE = 'raise'
+ACTIONS = {
+    RATE_LIMIT: RETRY,
+    TRANSIENT: RETRY,
+    AUTH: RAISE,
+    PROTECTED: SKIP,
+    NOT_FOUND: SKIP,
+    INVALID: SKIP,
+}
+
+# API error codes of keys that are invalid, expired or revoked: retrying or skipping does not help
+AUTH_CODES = frozenset([32, 89, 99, 135, 215])
+# API error codes of users, pages and statuses that do not exist or are suspended
+NOT_FOUND_CODES = frozenset([17, 34, 50, 63, 144])
+
+
+def classify(error):
+    """
+    :param error: tweepy.TweepError
+    :return: the class of the error, from the HTTP status and the API error code
+    """
+    if isinstance(error, tweepy.RateLimitError):
+        return RATE_LIMIT
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    api_code = getattr(error, 'api_code', None)
+    if api_code in AUTH_CODES:
+        return AUTH
+    if status_code == 429 or api_code == 88:
+        return RATE_LIMIT
+    if status_code is None or status_code >= 500:
+        # no response is a network error
+        return TRANSIENT
+    if api_code in NOT_FOUND_CODES or status_code == 404:
+        return NOT_FOUND
+    if status_code in (401, 403):
+        # the ids, timeline and lists of a protected user answer "Not authorized."
+        return PROTECTED
+    return INVALID
+
+
+class RetryPolicy:
+    """
+    Retries the requests that failed with a rate limit or a transient error, after a jittered exponential backoff
+    Errors that do not go away when the request is repeated are raised at once, the collector skips the user,
+    query or page with skip, which records it and raises again for authentication errors
+    The api objects are kept over retries, so the connections of their HTTP sessions are reused
+    """
+    def __init__(self, max_attempts=8, base_delay=2, max_delay=300, rate_limit_delay=60, sleep=time.sleep,
+                 seed=None):
+        """
+        :param max_attempts: number of times a request is sent before its error is raised
+        :param base_delay: seconds before the first retry of a transient error, doubled for every next retry
+        :param max_delay: maximum number of seconds before a retry
+        :param rate_limit_delay: seconds before the first retry of a rate limit error the scheduler did not catch
+        :param sleep: function that waits a number of seconds
+        :param seed: seed of the jitter, None for a random seed
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limit_delay = rate_limit_delay
+        self.sleep = sleep
+        # tuples (collector, target, class of the error, message) of everything that was skipped
+        self.skipped = list()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, kind, attempt):
+        """
+        Full jitter: a random wait up to the exponential backoff, so workers that failed together
+        do not retry together
+        :param kind: class of the error
+        :param attempt: number of the failed attempt, from 1
+        :return: seconds to wait before the next attempt
+        """
+        base = self.rate_limit_delay if kind == RATE_LIMIT else self.base_delay
+        with self._lock:
+            return self._random.uniform(0, min(self.max_delay, base * 2 ** (attempt - 1)))
+
+    def call(self, endpoint, method, *args, **kwargs):
+        """
+        Calls an api method, and calls it again after errors that are retried
+        :param endpoint: name of the endpoint, ex friends/ids
+        :param method: the api method
+        :return: the result of the method
+        """
+        attempt = 0
+        while True:
+            try:
+                return method(*args, **kwargs)
+            except tweepy.TweepError as e:
+                attempt += 1
+                kind = classify(e)
+                if ACTIONS[kind] != RETRY or attempt >= self.max_attempts:
+                    raise
+                delay = self.delay(kind, attempt)
+                metrics.inc('retries_total', endpoint=endpoint, kind=kind)
+                logger.info("%s error on %s (attempt %d/%d), retry in %.1f s: %s",
+                            kind, endpoint, attempt, self.max_attempts, delay, e)
+                self.sleep(delay)
+
+    def wrap(self, endpoint, method):
+        """
+        :param endpoint: name of the endpoint
+        :param method: the api method
+        :return: the method with the retries of the policy, can be used in a tweepy.Cursor
+        """
+        def call(*args, **kwargs):
+            # tweepy's IdIterator asks the method for its APIMethod object, no request is made
+            if kwargs.get('create'):
+                return method(*args, **kwargs)
+            return self.call(endpoint, method, *args, **kwargs)
+        if hasattr(method, 'pagination_mode'):
+            call.pagination_mode = method.pagination_mode
+        return call
+
+    def skip(self, collector, target, error):
+        """
+        Records that a collector skips a user, query or page because of an error, call it in the except block
+        Authentication errors are raised again, every next request would fail the same way
+        :param collector: name of the collector, ex timeline
+        :param target: what is skipped, ex the screen name
+        :param error: the tweepy.TweepError
+        :return: the class of the error
+        """
+        kind = classify(error)
+        if ACTIONS[kind] == RAISE:
+            logger.error("%s error in %s of %s: %s", kind, collector, target, error)
+            raise error
+        with self._lock:
+            self.skipped.append((collector, str(target), kind, str(error)))
+        metrics.inc('skipped_total', collector=collector, kind=kind)
+        logger.warning("Skip %s of %s, %s error: %s", collector, target, kind, error)
+        return kind
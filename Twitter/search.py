@@ -0,0 +1,140 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote_plus
+
+logger = logging.getLogger(__name__)
+
+# maximum length of the URL encoded q of the standard search API, operators included
+MAX_QUERY_LENGTH = 500
+
+# API error code of a search query that is rejected, ex because it has too many terms
+QUERY_REJECTED = 195
+
+
+def pack_queries(terms, format_term, operator=" OR ", max_length=MAX_QUERY_LENGTH, max_terms=None):
+    """
+    Joins terms with the operator into as few queries as possible, every query is filled up to max_length
+    or max_terms
+    The length is that of the URL encoded query (a quote or # takes 3 characters), as the API counts it
+    The terms keep their order, a term that is longer than max_length on its own gets a query of its own
+    A query the API finds too complex is split by the search, see split_query
+    :param terms: iterable of terms, empty terms are skipped
+    :param format_term: function giving the query form of a term, ex '"{0}"'.format
+    :param operator: operator placed between the terms
+    :param max_length: maximum number of URL encoded characters of a query
+    :param max_terms: maximum number of terms of a query, None to only fill up to max_length
+    :return: list of query strings
+    """
+    queries = list()
+    parts = list()
+    length = 0
+    # URL encoding works per character, the encoded length of a query is the sum of its parts
+    operator_length = len(quote_plus(operator))
+    for term in terms:
+        if not term:
+            continue
+        part = format_term(term)
+        part_length = len(quote_plus(part))
+        if parts and (length + operator_length + part_length > max_length or
+                      (max_terms is not None and len(parts) >= max_terms)):
+            queries.append(operator.join(parts))
+            parts = list()
+            length = 0
+        length += part_length + (operator_length if parts else 0)
+        parts.append(part)
+    if parts:
+        queries.append(operator.join(parts))
+    return queries
+
+
+def too_complex(error):
+    """
+    :param error: tweepy.TweepError of a search request
+    :return: True if the API rejected the query itself, a query with fewer terms is accepted
+    """
+    return getattr(error, 'api_code', None) == QUERY_REJECTED or 'too complex' in str(error).lower()
+
+
+def split_query(query, operator=" OR "):
+    """
+    Splits a query of pack_queries in two, the halves together match the same tweets
+    :param query: the query string
+    :param operator: operator placed between the terms
+    :return: tuple with the two halves, None if the query has a single term
+    """
+    parts = query.split(operator)
+    if len(parts) < 2:
+        return None
+    middle = len(parts) // 2
+    return operator.join(parts[:middle]), operator.join(parts[middle:])
+
+
+class SeenIds:
+    """
+    Ids of the tweets stored during one search, shared by its shards
+    A tweet that matches several queries is only stored once
+    """
+    def __init__(self):
+        self._ids = set()
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def new(self, statuses):
+        """
+        :param statuses: list of tweepy statuses or raw status dicts
+        :return: the statuses whose id was not seen before, in the same order
+        """
+        new_statuses = list()
+        with self._lock:
+            for status in statuses:
+                tweet_id = status['id'] if isinstance(status, dict) else status.id
+                if tweet_id in self._ids:
+                    self.duplicates += 1
+                    continue
+                self._ids.add(tweet_id)
+                new_statuses.append(status)
+        return new_statuses
+
+
+class ShardedSearch:
+    """
+    Runs the queries of a search at the same time, every query is walked by its own worker
+    The number of workers is bounded by the requests left for the endpoint over all keys of the pool,
+    the requests themselves are scheduled on the rate limits of the pool
+    """
+    def __init__(self, pool, endpoint, max_workers=8):
+        """
+        :param pool: the KeyPool requests are dispatched to
+        :param endpoint: name of the endpoint the queries use, ex search/tweets
+        :param max_workers: maximum number of queries running at once
+        """
+        self.pool = pool
+        self.endpoint = endpoint
+        self.max_workers = max_workers
+
+    def _workers(self, number_of_queries):
+        # more workers than requests left in the window would only wait on the scheduler
+        budget = self.pool.remaining(self.endpoint)
+        return max(1, min(self.max_workers, budget, number_of_queries))
+
+    def run(self, queries, search_query):
+        """
+        :param queries: list of query strings, or of Slice objects of queries
+        :param search_query: function collecting the tweets of one query
+        :return: dict query -> value returned by search_query
+        """
+        results = dict()
+        if not queries:
+            return results
+        workers = self._workers(len(queries))
+        logger.info("Search {0} queries with {1} workers".format(len(queries), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = dict((executor.submit(search_query, query), query) for query in queries)
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                logger.info("No more tweets for %s (%d/%d)", futures[future], done, len(queries))
+        return results
@@ -0,0 +1,263 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # only the Parquet sink needs pyarrow
+    pa = None
+
+from converter import join_entities
+from metrics import metrics
+from journal import DATE_FORMAT, USER_COLUMNS, user_to_row
+from models import Tweet
+
+# attributes of Tweet that are stored, in column order
+TWEET_COLUMNS = Tweet.__slots__
+
+ENTITY_COLUMNS = ('mentions', 'hashtags', 'hyperlinks')
+
+TWEETS = 'tweets'
+USERS = 'users'
+
+
+def tweet_to_row(tweet):
+    """
+    :param tweet: Tweet object
+    :return: tuple with the values of TWEET_COLUMNS, entities joined, date as text, coordinates as JSON
+    """
+    row = list()
+    for column in TWEET_COLUMNS:
+        value = getattr(tweet, column)
+        if column in ENTITY_COLUMNS and not isinstance(value, str):
+            value = join_entities(value)
+        elif isinstance(value, datetime):
+            value = value.strftime(DATE_FORMAT)
+        elif column == 'coordinates' and value is not None:
+            value = json.dumps(value)
+        row.append(value)
+    return tuple(row)
+
+
+class Sink:
+    """
+    Storage of the collected tweets and users
+    The collectors push batches, the sink buffers them and writes them in bulk once batch_size records
+    are waiting or flush_interval seconds passed since the last write
+    Subclasses implement _write
+    """
+    def __init__(self, batch_size=1000, flush_interval=5, clock=time.time):
+        """
+        :param batch_size: number of buffered records of one kind that triggers a write
+        :param flush_interval: maximum number of seconds records stay buffered, checked when records are added
+        :param clock: function returning the current time
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._buffers = {TWEETS: list(), USERS: list()}
+        self._last_flush = clock()
+        self.written = {TWEETS: 0, USERS: 0}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_tweets(self, tweets):
+        """
+        :param tweets: iterable of Tweet objects
+        """
+        self._add(TWEETS, tweets)
+
+    def add_users(self, users):
+        """
+        :param users: iterable of TwitterUser objects
+        """
+        self._add(USERS, users)
+
+    def _add(self, kind, records):
+        with self._lock:
+            buffer = self._buffers[kind]
+            buffer.extend(records)
+            if len(buffer) >= self.batch_size or self.clock() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """
+        Writes all buffered records
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        # lock must be held
+        for kind, buffer in self._buffers.items():
+            if buffer:
+                with metrics.timer('storage_seconds', kind=kind):
+                    self._write(kind, buffer)
+                metrics.inc('stored_total', len(buffer), kind=kind)
+                self.written[kind] += len(buffer)
+                self._buffers[kind] = list()
+        self._last_flush = self.clock()
+
+    def _write(self, kind, records):
+        """
+        Writes one batch
+        :param kind: TWEETS or USERS
+        :param records: list of Tweet or TwitterUser objects
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Writes the buffered records and releases the storage
+        """
+        self.flush()
+
+
+class SQLiteSink(Sink):
+    """
+    Stores tweets and users in a SQLite database, every batch in one transaction with executemany
+    A tweet is stored once, a user that is stored again is replaced by the newest version
+    """
+    def __init__(self, path, **kwargs):
+        """
+        :param path: path of the database file, created if it does not exist
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS tweets ({0}, PRIMARY KEY (tweet_id))"
+                                     .format(", ".join(TWEET_COLUMNS)))
+            self._connection.execute("CREATE TABLE IF NOT EXISTS users ({0}, PRIMARY KEY (user_id))"
+                                     .format(", ".join(USER_COLUMNS)))
+        self._statements = {
+            TWEETS: "INSERT OR IGNORE INTO tweets VALUES ({0})".format(", ".join("?" * len(TWEET_COLUMNS))),
+            USERS: "INSERT OR REPLACE INTO users VALUES ({0})".format(", ".join("?" * len(USER_COLUMNS))),
+        }
+
+    def _write(self, kind, records):
+        to_row = tweet_to_row if kind == TWEETS else user_to_row
+        with self._connection:
+            self._connection.executemany(self._statements[kind], [to_row(record) for record in records])
+
+    def close(self):
+        with self._lock:
+            if self._connection is None:
+                return
+            self._flush()
+            self._connection.close()
+            self._connection = None
+
+
+class JSONLinesSink(Sink):
+    """
+    Appends tweets and users as gzipped JSON lines to tweets.jsonl.gz and users.jsonl.gz in a directory
+    Every batch is a gzip member of its own, the files stay readable when a run is stopped
+    """
+    def __init__(self, directory, compresslevel=6, **kwargs):
+        """
+        :param directory: directory of the files, created if it does not exist
+        :param compresslevel: gzip compression level, lower is faster
+        """
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.compresslevel = compresslevel
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, kind):
+        """
+        :param kind: TWEETS or USERS
+        :return: path of the file of the kind
+        """
+        return os.path.join(self.directory, "{0}.jsonl.gz".format(kind))
+
+    def _write(self, kind, records):
+        columns, to_row = (TWEET_COLUMNS, tweet_to_row) if kind == TWEETS else (USER_COLUMNS, user_to_row)
+        lines = "".join(json.dumps(dict(zip(columns, to_row(record))), ensure_ascii=False) + "\n"
+                        for record in records)
+        with gzip.open(self.path(kind), 'at', encoding='utf-8', compresslevel=self.compresslevel) as output:
+            output.write(lines)
+
+
+class ParquetSink(Sink):
+    """
+    Writes tweets and users to tweets.parquet and users.parquet in a directory, every batch is a row group
+    Hashtags, mentions and hyperlinks are list columns, dates are UTC timestamps
+    Needs pyarrow, the files are complete once the sink is closed
+    """
+    def __init__(self, directory, compression='snappy', **kwargs):
+        """
+        :param directory: directory of the files, created if it does not exist
+        :param compression: parquet compression codec
+        """
+        if pa is None:
+            raise ImportError("ParquetSink needs pyarrow")
+        kwargs.setdefault('batch_size', 50000)
+        super().__init__(**kwargs)
+        self.directory = directory
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+        entities = pa.list_(pa.string())
+        timestamp = pa.timestamp('s', tz='UTC')
+        self._schemas = {
+            TWEETS: pa.schema([
+                ('tweet_id', pa.string()), ('tweeter_id', pa.int64()), ('tweeter_name', pa.string()),
+                ('tweet_text', pa.string()), ('tweet_date', timestamp), ('is_retweet', pa.bool_()),
+                ('mentions', entities), ('hashtags', entities), ('hyperlinks', entities),
+                ('favorite_count', pa.int64()), ('id_str', pa.string()), ('in_reply_to_screen_name', pa.string()),
+                ('retweet_count', pa.int64()), ('source', pa.string()), ('coordinates', pa.string()),
+                ('quoted_status_id', pa.int64())]),
+            USERS: pa.schema([
+                ('user_id', pa.int64()), ('name', pa.string()), ('screen_name', pa.string()),
+                ('user_description', pa.string()), ('date_created', timestamp), ('url', pa.string()),
+                ('profile_image_url', pa.string()), ('language', pa.string()), ('location', pa.string()),
+                ('default_profile_image', pa.bool_()), ('verified', pa.bool_()), ('friends_count', pa.int64()),
+                ('followers_count', pa.int64()), ('is_protected', pa.bool_()),
+                ('max_followers_exceeded', pa.bool_())]),
+        }
+        self._writers = dict()
+
+    def path(self, kind):
+        """
+        :param kind: TWEETS or USERS
+        :return: path of the file of the kind
+        """
+        return os.path.join(self.directory, "{0}.parquet".format(kind))
+
+    def _write(self, kind, records):
+        schema = self._schemas[kind]
+        columns = dict()
+        for name in schema.names:
+            values = [getattr(record, name) for record in records]
+            if name == 'coordinates':
+                values = [None if value is None else json.dumps(value) for value in values]
+            elif name in ENTITY_COLUMNS:
+                # entities stored by older code are joined strings
+                values = [value.split(";")[:-1] if isinstance(value, str) else value for value in values]
+            columns[name] = values
+        table = pa.Table.from_pydict(columns, schema=schema)
+        writer = self._writers.get(kind)
+        if writer is None:
+            writer = pq.ParquetWriter(self.path(kind), schema, compression=self.compression)
+            self._writers[kind] = writer
+        writer.write_table(table)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = dict()
@@ -0,0 +1,147 @@
+import logging
+import threading
+
+import tweepy
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# backoff of the streaming API guidelines, in seconds
+# HTTP 420: exponential from one minute, at most 15 minutes
+RATE_LIMITED_START = 60
+RATE_LIMITED_CAP = 15 * 60
+# other HTTP errors: exponential from 5 seconds, at most 320 seconds
+HTTP_ERROR_START = 5
+HTTP_ERROR_CAP = 320
+# network errors and dropped connections: linear by 250 milliseconds, at most 16 seconds
+NETWORK_STEP = 0.25
+NETWORK_CAP = 16
+
+
+class StreamSupervisor:
+    """
+    Keeps a filtered stream connected
+    tweepy's own retry is switched off by the listener (on_error returns False), the supervisor reconnects
+    with the backoff of the Twitter guidelines for HTTP 420, other HTTP errors and network errors,
+    and starts again from the lowest backoff once a connection succeeds
+    The filter predicates can be replaced while the stream runs, the stream then reconnects at once
+    """
+    def __init__(self, auth, listener, track=None, follow=None, languages=None, stream_factory=tweepy.Stream,
+                 sleep=None):
+        """
+        :param auth: tweepy OAuthHandler, streaming does not work with app level authentication
+        :param listener: TweetsStreamListener, its last_error and connects attributes are read after a connection
+        :param track: list of terms to track
+        :param follow: list of ids of users to follow, as strings
+        :param languages: list of language codes the tweets are filtered on
+        :param stream_factory: creates the tweepy.Stream, replaced by a fake stream in tests
+        :param sleep: function that sleeps a number of seconds, default a wait that stop interrupts
+        """
+        self.auth = auth
+        self.listener = listener
+        self.stream_factory = stream_factory
+        self.sleep = sleep if sleep is not None else self._wait
+        self._predicates = (track, follow, languages)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        # set when the predicates changed, the next connection is made without backoff
+        self._restart = False
+        self._stream = None
+        self._thread = None
+        self.backoff = 0
+        self.reconnects = 0
+
+    def start(self):
+        """
+        Runs the stream on a background thread
+        :return: the supervisor
+        """
+        self._thread = threading.Thread(target=self.run, name="stream-supervisor", daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """
+        Waits until the supervisor is stopped
+        :param timeout: maximum number of seconds to wait, None to wait forever
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def update(self, track=None, follow=None, languages=None):
+        """
+        Replaces the filter predicates, the running stream is disconnected and connects with the new predicates
+        :param track: list of terms to track
+        :param follow: list of ids of users to follow, as strings
+        :param languages: list of language codes
+        """
+        with self._lock:
+            self._predicates = (track, follow, languages)
+            self._restart = True
+            stream = self._stream
+        if stream is not None:
+            stream.disconnect()
+
+    def stop(self):
+        """
+        Disconnects the stream and stops the supervisor, the queued tweets are stored before run returns
+        """
+        self._stopped.set()
+        with self._lock:
+            stream = self._stream
+        if stream is not None:
+            stream.disconnect()
+
+    def run(self):
+        """
+        Connects, and reconnects after every disconnect and error until stop is called
+        """
+        while not self._stopped.is_set():
+            with self._lock:
+                track, follow, languages = self._predicates
+                self._restart = False
+                self._stream = self.stream_factory(self.auth, self.listener)
+                stream = self._stream
+            connects = self.listener.connects
+            self.listener.last_error = None
+            network_error = None
+            try:
+                stream.filter(track=track, follow=follow, languages=languages)
+            except Exception as e:
+                network_error = e
+            if self._stopped.is_set():
+                break
+            with self._lock:
+                restart = self._restart
+            if self.listener.connects > connects:
+                # the connection worked, errors start from the lowest backoff again
+                self.backoff = 0
+            if restart:
+                logger.info("Stream predicates changed, reconnect")
+                continue
+            self.backoff = self._next_backoff(self.listener.last_error)
+            self.reconnects += 1
+            metrics.inc('stream_reconnects_total')
+            logger.warning("Stream disconnected (%s), reconnect in %s s",
+                           network_error or self.listener.last_error or "disconnect", self.backoff)
+            self.sleep(self.backoff)
+        with self._lock:
+            self._stream = None
+        # store what the listener still has queued
+        self.listener.close()
+
+    def _wait(self, seconds):
+        # returns early when the supervisor is stopped
+        self._stopped.wait(seconds)
+
+    def _next_backoff(self, status_code):
+        """
+        :param status_code: HTTP status of the failed connection, None for network errors and disconnects
+        :return: number of seconds to wait before the next connection
+        """
+        if status_code == 420 or status_code == 429:
+            return min(max(RATE_LIMITED_START, self.backoff * 2), RATE_LIMITED_CAP)
+        if status_code is not None:
+            return min(max(HTTP_ERROR_START, self.backoff * 2), HTTP_ERROR_CAP)
+        return min(self.backoff + NETWORK_STEP, NETWORK_CAP)
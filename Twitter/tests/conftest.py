@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the package import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_client():
+    """
+    :return: function making a TwitterTweepy that collects from a FakeTwitter, rate limit waits and retries
+             run on a FakeClock, api_options are passed to the FakeAPI
+    """
+    pytest.importorskip("tweepy")
+    from fakeapi import FakeAPI, FakeClock
+    from models import TwitterKeys
+    from ratelimit import RateLimitScheduler
+    from retry import RetryPolicy
+    from TwitterTweepy import TwitterTweepy
+    from usercache import UserCache
+
+    def make(world, api_options=None, **kwargs):
+        clock = FakeClock()
+        api = FakeAPI(world, clock=clock, **(api_options or dict()))
+        return TwitterTweepy(TwitterKeys("", "", "", "", None),
+                             scheduler_factory=lambda: RateLimitScheduler(clock=clock.time, sleep=clock.sleep),
+                             user_cache=UserCache(), api_factory=lambda keys: api,
+                             retry_policy=RetryPolicy(sleep=clock.sleep), **kwargs)
+    return make
@@ -0,0 +1,31 @@
+from backfill import BackfillJournal, plan_slices
+
+DAY = 24 * 60 * 60
+
+
+def test_a_restarted_backfill_plans_the_same_slices():
+    now = 1700000000
+    first = plan_slices("#a", slice_hours=24, now=now)
+    again = plan_slices("#a", slice_hours=24, now=now + 3600)
+    assert [piece.start for piece in first] == [piece.start for piece in again]
+    assert all(piece.start % DAY == 0 for piece in first)
+    # the newest slice runs up to now, the others are closed and cover the whole window
+    assert first[0].end is None
+    assert [piece.end for piece in first[1:]] == [piece.start for piece in first[:-1]]
+    assert first[-1].start <= now - 7 * DAY
+
+
+def test_slice_progress_survives_a_restart(tmp_path):
+    path = str(tmp_path / "backfill.db")
+    pieces = plan_slices("#a", slice_hours=24, now=1700000000)
+    journal = BackfillJournal(path)
+    assert journal.progress(pieces[1]) == (None, None, False)
+    journal.save(pieces[1], 1000, 2000)
+    journal.save(pieces[2], 10, 20, done=True)
+    journal.close()
+    journal = BackfillJournal(path)
+    assert journal.progress(pieces[1]) == (1000, 2000, False)
+    assert journal.progress(pieces[2]) == (10, 20, True)
+    # a slice of another query with the same start is not touched
+    assert journal.progress(plan_slices("#b", slice_hours=24, now=1700000000)[1]) == (None, None, False)
+    journal.close()
@@ -0,0 +1,78 @@
+from journal import CrawlJournal
+
+
+def test_unknown_follower_ids_do_not_skip_the_followers_phase(tmp_path, fake_client):
+    from fakeapi import FakeTwitter
+
+    world = FakeTwitter.synthetic(users=300, egos=5, statuses=10)
+    ego_id = world.user_id(screen_name="ego_0")
+    # a batch of ids of deleted users only, users/lookup answers error 17
+    world.followers[ego_id] = world.followers[ego_id][:100] + [1]
+    world.users[ego_id]['followers_count'] = 101
+    path = str(tmp_path / "journal.db")
+    client = fake_client(world)
+    client.profile_information_search("ego_0", followers=True, journal=path)
+    assert client.retry.skipped == []
+    assert len(client.network_users) == 101
+    journal = CrawlJournal(path)
+    assert journal.phase_done("followers:ego_0")
+    journal.close()
+
+
+def test_name_search_pages_the_fake_search_with_a_cursor(fake_client):
+    from fakeapi import FakeTwitter
+    from sink import TWEETS, Sink
+
+    class ListSink(Sink):
+        def __init__(self):
+            super().__init__()
+            self.tweets = list()
+
+        def _write(self, kind, records):
+            if kind == TWEETS:
+                self.tweets.extend(records)
+
+    world = FakeTwitter.synthetic(users=300, egos=5, statuses=10)
+    sink = ListSink()
+    client = fake_client(world, sink=sink)
+    client.get_tweets_names_searchapi(["ego_0", "ego_1"])
+    assert client.retry.skipped == []
+    expected = world.search("from:ego_0 OR to:ego_0 OR from:ego_1 OR to:ego_1")
+    assert sorted(tweet.tweet_id for tweet in sink.tweets) == sorted(str(status_id) for status_id in expected)
+
+
+def test_excluded_ego_is_stored_with_its_flag(tmp_path, fake_client):
+    from fakeapi import FakeTwitter
+    from sink import USERS, Sink
+
+    class ListSink(Sink):
+        def __init__(self):
+            super().__init__()
+            self.users = list()
+
+        def _write(self, kind, records):
+            if kind == USERS:
+                self.users.extend(records)
+
+    world = FakeTwitter.synthetic(users=300, egos=5, statuses=10)
+    # ego_1 has the fewest followers of the EGO-users
+    max_followers = min(user['followers_count'] for user in world.users.values()
+                        if user['screen_name'] in ("ego_0", "ego_2")) - 1
+    world.users[world.user_id(screen_name="ego_1")]['followers_count'] = 0
+    sink = ListSink()
+    path = str(tmp_path / "journal.db")
+    client = fake_client(world, sink=sink)
+    client.profile_information_search("ego_0,ego_1", max_followers=max_followers, journal=path)
+    assert [user.screen_name for user in client.ego_users] == ["ego_1"]
+    stored = dict((user.screen_name, user) for user in sink.users)
+    assert stored["ego_0"].max_followers_exceeded
+    assert not stored["ego_1"].max_followers_exceeded
+    # the user in the cache is shared with other searches
+    assert not client.user_cache.get_by_screen_name("ego_0").max_followers_exceeded
+    journal = CrawlJournal(path)
+    assert [user.screen_name for user in journal.load_users() if user.max_followers_exceeded] == ["ego_0"]
+    journal.close()
+    resumed = fake_client(world)
+    resumed.profile_information_search("ego_0,ego_1", max_followers=max_followers, journal=path)
+    assert [user.screen_name for user in resumed.ego_users] == ["ego_1"]
+    assert "ego_0" not in [user.screen_name for user in resumed.network_users]
@@ -0,0 +1,99 @@
+import sqlite3
+
+import dedup
+from dedup import BloomFilter, TweetIndex
+
+
+def statuses(ids):
+    return [{'id': tweet_id} for tweet_id in ids]
+
+
+def store(index, ids):
+    index.buffered(index.new(statuses(ids)))
+    index.commit()
+
+
+def test_bloom_filter_add_tells_whether_the_value_was_there():
+    bloom = BloomFilter(capacity=1000)
+    assert not bloom.add(42)
+    assert bloom.add(42)
+    assert 42 in bloom
+    assert bloom.count == 1
+
+
+def test_bloom_filter_rate_on_snowflake_ids():
+    bloom = BloomFilter(capacity=100000)
+    base = 1500000000000000000
+    for ms in range(50000):
+        bloom.add(base + (ms << 22) + (1 << 12))
+        bloom.add(base + (ms << 22) + (7 << 12) + 1)
+    probes = [base + (ms << 22) + (3 << 12) for ms in range(100000, 200000)]
+    assert sum(1 for tweet_id in probes if tweet_id in bloom) / len(probes) < 0.003
+
+
+def test_new_drops_duplicates_within_and_across_pages():
+    index = TweetIndex(capacity=1000)
+    assert [status['id'] for status in index.new(statuses([1, 2, 1, 3]))] == [1, 2, 3]
+    # pending ids are duplicates before they are buffered, buffered ones before they are committed
+    assert index.new(statuses([2])) == []
+    index.buffered(statuses([1, 2, 3]))
+    assert index.new(statuses([3])) == []
+    index.commit()
+    assert [status['id'] for status in index.new(statuses([3, 4]))] == [4]
+    assert index.duplicates == 4
+    index.close()
+
+
+def test_new_checks_a_page_in_few_queries(monkeypatch):
+    monkeypatch.setattr(dedup, 'QUERY_SIZE', 100)
+    index = TweetIndex(capacity=10000)
+    store(index, range(250))
+    assert index.new(statuses(range(300))) == statuses(range(250, 300))
+    # the 250 stored ids are in the filter, the new ones almost all are not
+    assert 250 <= index.disk_lookups < 260
+    assert index.disk_queries == 3
+    index.close()
+
+
+def test_rerun_loads_the_stored_filter(tmp_path):
+    path = str(tmp_path / "ids.db")
+    index = TweetIndex(path, capacity=1000)
+    store(index, range(100))
+    index.close()
+    connection = sqlite3.connect(path)
+    # the ids are in the stored filter, a rerun does not read them again
+    assert connection.execute("SELECT COUNT(*) FROM recent_ids").fetchone()[0] == 0
+    connection.execute("DELETE FROM tweet_ids")
+    connection.commit()
+    connection.close()
+    index = TweetIndex(path, capacity=1000)
+    assert len(index) == 100
+    index.close()
+
+
+def test_rerun_adds_the_ids_committed_after_the_filter_was_stored(tmp_path):
+    path = str(tmp_path / "ids.db")
+    index = TweetIndex(path, capacity=1000, snapshot_size=100)
+    store(index, range(100))
+    store(index, range(100, 130))
+    # the process stops without close: the last 30 ids are only in recent_ids
+    index._connection.close()
+    index = TweetIndex(path, capacity=1000)
+    assert len(index) == 130
+    assert index.new(statuses([5, 120, 200])) == statuses([200])
+    index.close()
+
+
+def test_filter_of_another_size_is_built_from_all_ids(tmp_path):
+    path = str(tmp_path / "ids.db")
+    index = TweetIndex(path, capacity=1000)
+    store(index, range(100))
+    index.close()
+    index = TweetIndex(path, capacity=5000)
+    assert len(index) == 100
+    assert index.new(statuses([5, 200])) == statuses([200])
+    index.close()
+    connection = sqlite3.connect(path)
+    # the filter built by the replay is stored for the next run
+    assert connection.execute("SELECT size FROM bloom").fetchone()[0] == BloomFilter(capacity=5000).size
+    connection.close()
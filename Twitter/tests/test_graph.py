@@ -0,0 +1,71 @@
+import random
+from array import array
+
+import pytest
+
+from graph import EgoGraph, IdFilter, Relation, counting_csr
+
+
+def random_edges(count, users, seed=1):
+    generator = random.Random(seed)
+    return [(generator.randrange(users), generator.randrange(users), generator.choice(list(Relation)))
+            for _ in range(count)]
+
+
+def test_counting_csr_sorts_and_removes_duplicates():
+    edges = random_edges(5000, 300)
+    offsets, targets, relations = counting_csr(array('i', [edge[0] for edge in edges]),
+                                               array('i', [edge[1] for edge in edges]),
+                                               array('b', [int(edge[2]) for edge in edges]), 300)
+    expected = sorted(set((source, target, int(relation)) for source, target, relation in edges))
+    assert len(offsets) == 301
+    assert [(source, targets[i], relations[i]) for source in range(300)
+            for i in range(offsets[source], offsets[source + 1])] == expected
+
+
+def test_counting_csr_without_edges():
+    offsets, targets, relations = counting_csr(array('i'), array('i'), array('b'), 3)
+    assert list(offsets) == [0, 0, 0, 0]
+    assert len(targets) == len(relations) == 0
+
+
+def test_graph_queries():
+    graph = EgoGraph()
+    graph.add_edges(10, [30, 20, 30], Relation.FRIENDS)
+    graph.add_edge(10, 20, Relation.FOLLOWERS)
+    graph.add_user(40)
+    assert len(graph) == 4
+    # the targets are ordered by the index of the user, the order the users were added in
+    assert graph.neighbours(10) == [30, 20, 20]
+    assert graph.neighbours(10, Relation.FOLLOWERS) == [20]
+    assert graph.has_edge(10, 30, Relation.FRIENDS)
+    assert not graph.has_edge(10, 30, Relation.FOLLOWERS)
+    assert not graph.has_edge(40, 10)
+    assert graph.neighbours(40) == [] and graph.neighbours(50) == []
+    assert sorted(graph.edges()) == [(10, 20, Relation.FRIENDS), (10, 20, Relation.FOLLOWERS),
+                                     (10, 30, Relation.FRIENDS)]
+    # edges added after a query invalidate the CSR form
+    graph.add_edge(40, 10, Relation.FOLLOWERS)
+    assert graph.neighbours(40) == [10]
+
+
+def test_numpy_build_matches_the_counting_sort(monkeypatch):
+    pytest.importorskip("numpy")
+    import graph as graph_module
+
+    built = list()
+    for numpy in (graph_module.np, None):
+        monkeypatch.setattr(graph_module, "np", numpy)
+        graph = EgoGraph()
+        for source, target, relation in random_edges(5000, 300):
+            graph.add_edge(source, target, relation)
+        built.append(list(graph.edges()))
+    assert built[0] == built[1]
+
+
+def test_id_filter_keeps_the_network_ids_of_a_page():
+    id_filter = IdFilter([1, 2, 3, 10 ** 12])
+    assert len(id_filter) == 4
+    assert sorted(id_filter.filter([3, 4, 10 ** 12, 1, 3], exclude=1)) == [3, 10 ** 12]
+    assert id_filter.filter([], exclude=1) == []
+    assert sorted(id_filter.filter(iter([2, 5]))) == [2]
@@ -0,0 +1,111 @@
+from datetime import datetime
+
+from journal import CrawlJournal
+from models import TwitterUser
+
+
+def make_user(user_id, screen_name):
+    return TwitterUser(user_id, "User", screen_name, "", datetime(2012, 1, 1), None, None, 'nl', None, False, False,
+                       10, 10, False)
+
+
+def test_ego_flag_is_kept_when_an_ego_is_stored_as_friend(tmp_path):
+    journal = CrawlJournal(str(tmp_path / "journal.db"))
+    journal.save_users([make_user(1, "ego_0"), make_user(2, "ego_1")], is_ego=True)
+    # ego_1 is a friend of ego_0, it is stored again with new values
+    friend = make_user(2, "ego_1")
+    friend.followers_count = 20
+    journal.save_users([friend, make_user(3, "user_3")])
+    egos = dict((user.screen_name, user) for user in journal.load_users(is_ego=True))
+    assert sorted(egos) == ["ego_0", "ego_1"]
+    assert egos["ego_1"].followers_count == 20
+    assert [user.screen_name for user in journal.load_users(is_ego=False)] == ["user_3"]
+    journal.close()
+
+
+def test_phases_and_cursors_survive_a_restart(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = CrawlJournal(path)
+    journal.finish_phase("friends:ego_0")
+    journal.save_page(1, 'friends', 42, [(1, 2), (1, 3)])
+    journal.close()
+    journal = CrawlJournal(path)
+    assert journal.phase_done("friends:ego_0")
+    assert not journal.phase_done("followers:ego_0")
+    assert journal.next_cursor(1, 'friends') == 42
+    assert journal.next_cursor(2, 'friends') == -1
+    assert sorted(journal.load_edges('friends')) == [(1, 2), (1, 3)]
+    journal.close()
+
+
+def test_resumed_search_keeps_all_egos(tmp_path, fake_client):
+    from fakeapi import FakeTwitter
+
+    world = FakeTwitter.synthetic(users=300, egos=5, statuses=10)
+    names = ",".join("ego_{0}".format(i) for i in range(5))
+    path = str(tmp_path / "journal.db")
+    first = fake_client(world)
+    first.profile_information_search(names, friends=True, followers=True, journal=path)
+    journal = CrawlJournal(path)
+    assert sorted(user.screen_name for user in journal.load_users(is_ego=True)) == names.split(",")
+    journal.close()
+    # every phase is finished, the second run only reads the journal
+    second = fake_client(world)
+    second.profile_information_search(names, friends=True, followers=True, journal=path)
+    assert sorted(user.screen_name for user in second.ego_users) == names.split(",")
+    assert len(second.network_users) == len(first.network_users)
+
+
+def test_resumed_ego_phase_does_not_page_or_look_up_again(tmp_path, fake_client):
+    import sqlite3
+    from fakeapi import FakeTwitter
+
+    world = FakeTwitter.synthetic(users=300, egos=5, statuses=10)
+    path = str(tmp_path / "journal.db")
+    first = fake_client(world)
+    first.profile_information_search("ego_0", followers=True, journal=path)
+    # the run stopped after the last page, before the phase and its edges were stored
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("DELETE FROM phases WHERE name = 'followers:ego_0'")
+        connection.execute("DELETE FROM edges WHERE relation_used = 'followers'")
+    connection.close()
+    second = fake_client(world)
+    second.profile_information_search("ego_0", followers=True, journal=path)
+    requests = second.pool.credentials[0].api.requests
+    assert requests.get('followers/ids', 0) == 0
+    assert requests.get('users/lookup', 0) == 0
+    assert len(second.graph) == len(first.graph)
+    assert len(second.network_users) == len(first.network_users)
+
+
+def test_interrupted_ego_phase_continues_with_the_next_page(tmp_path, fake_client, monkeypatch):
+    import tweepy
+    from fakeapi import IDS_PAGE_SIZE, LOOKUP_SIZE, FakeAPI, FakeResponse, FakeTwitter
+
+    # every user follows one of the two EGO-users, ego_0 has two pages of followers
+    world = FakeTwitter.synthetic(users=12000, egos=2, statuses=10)
+    follower_count = len(world.followers[world.user_id(screen_name="ego_0")])
+    assert follower_count > IDS_PAGE_SIZE
+    followers_ids = FakeAPI.followers_ids
+
+    def first_page_only(self, **kwargs):
+        if kwargs.get('cursor', -1) != -1:
+            raise tweepy.TweepError("Not authorized.", FakeResponse('followers/ids', 401))
+        return followers_ids(self, **kwargs)
+    first_page_only.pagination_mode = 'cursor'
+    monkeypatch.setattr(FakeAPI, 'followers_ids', first_page_only)
+    path = str(tmp_path / "journal.db")
+    first = fake_client(world)
+    first.profile_information_search("ego_0", followers=True, journal=path)
+    assert len(first.retry.skipped) == 1
+    monkeypatch.undo()
+    second = fake_client(world)
+    second.profile_information_search("ego_0", followers=True, journal=path)
+    requests = second.pool.credentials[0].api.requests
+    assert requests['followers/ids'] == 1
+    # only the users of the second page are looked up
+    assert requests['users/lookup'] <= -(-(follower_count - IDS_PAGE_SIZE) // LOOKUP_SIZE)
+    assert second.retry.skipped == []
+    assert len(second.graph) == follower_count
+    assert len(second.network_users) == follower_count + 1
@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("tweepy")
+
+from ratelimit import WINDOW, RateLimitScheduler, TokenBucket
+
+
+class Clock:
+    """
+    Clock whose sleep only moves the time forward
+    """
+    def __init__(self, now=1000):
+        self.now = now
+        self.slept = list()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_bucket_waits_for_the_reset_when_used_up():
+    bucket = TokenBucket(2)
+    assert bucket.reserve(1000) == 0
+    assert bucket.reserve(1001) == 0
+    assert bucket.reserve(1002) == 1000 + WINDOW - 1002
+    # the window is over, full quota again
+    assert bucket.reserve(1000 + WINDOW) == 0
+    assert bucket.remaining == 1
+
+
+def test_first_header_reset_replaces_the_local_guess():
+    # the window of the keys started before this run, it resets before the local guess
+    bucket = TokenBucket(15)
+    assert bucket.reserve(1000) == 0
+    bucket.update(0, 1300)
+    assert bucket.reserve(1299) == 1
+    assert bucket.reserve(1301) == 0
+
+
+def test_out_of_order_headers_do_not_move_the_reset_back_or_give_back_quota():
+    bucket = TokenBucket(15)
+    bucket.reserve(1000)
+    bucket.update(10, 1300)
+    # a response of the same window that was sent earlier
+    bucket.update(12, 1250)
+    assert bucket.reset == 1300
+    assert bucket.remaining == 10
+    # a later window
+    bucket.update(14, 2200)
+    assert bucket.reset == 2200
+    assert bucket.remaining == 14
+
+
+def test_scheduler_sleeps_until_the_reset_with_a_fake_clock():
+    clock = Clock()
+    scheduler = RateLimitScheduler(limits={'friends/ids': 2}, clock=clock.time, sleep=clock.sleep, margin=2)
+    for _ in range(3):
+        scheduler.acquire('friends/ids')
+    assert clock.slept == [WINDOW + 2]
+    assert scheduler.remaining('friends/ids') == 1
+
+
+def test_rate_limit_error_without_headers_waits_a_full_window():
+    clock = Clock()
+    scheduler = RateLimitScheduler(clock=clock.time, sleep=clock.sleep, margin=0)
+    scheduler.exhaust('search/tweets')
+    scheduler.acquire('search/tweets')
+    assert clock.slept == [WINDOW]
@@ -0,0 +1,67 @@
+from urllib.parse import quote_plus
+
+import pytest
+
+from search import MAX_QUERY_LENGTH, SeenIds, pack_queries, split_query
+
+
+def test_queries_fit_the_encoded_length():
+    terms = ["#hashtag{0}".format(i) for i in range(200)]
+    queries = pack_queries(terms, '"{0}"'.format)
+    assert all(len(quote_plus(query)) <= MAX_QUERY_LENGTH for query in queries)
+    # every query is filled: one more term would not fit
+    assert len(quote_plus(queries[0] + ' OR "#hashtag{0}"'.format(200))) > MAX_QUERY_LENGTH
+    assert [term for query in queries for term in query.split(" OR ")] == ['"{0}"'.format(term) for term in terms]
+
+
+def test_queries_are_capped_on_terms():
+    queries = pack_queries(["a", "", "b", "c", "d", "e"], str, max_terms=2)
+    assert queries == ["a OR b", "c OR d", "e"]
+
+
+def test_long_term_gets_a_query_of_its_own():
+    queries = pack_queries(["a", "x" * 600, "b"], str)
+    assert queries == ["a", "x" * 600, "b"]
+
+
+def test_split_query_halves_the_terms():
+    assert split_query("a OR b OR c") == ("a", "b OR c")
+    assert split_query("a") is None
+
+
+@pytest.mark.parametrize("collect", [
+    lambda client, names, hashtags: client.get_tweets_searchterms_searchapi(hashtags),
+    lambda client, names, hashtags: client.get_tweets_searchterms_searchapi(hashtags, slice_hours=24),
+    lambda client, names, hashtags: client.get_tweets_names_searchapi(names)],
+    ids=["search", "backfill", "names"])
+def test_too_complex_queries_are_split(fake_client, collect):
+    from fakeapi import FakeTwitter
+    from sink import TWEETS, Sink
+
+    class ListSink(Sink):
+        def __init__(self):
+            super().__init__()
+            self.tweet_ids = list()
+
+        def _write(self, kind, records):
+            if kind == TWEETS:
+                self.tweet_ids.extend(tweet.tweet_id for tweet in records)
+
+    world = FakeTwitter.synthetic(users=300, egos=5, statuses=2000, hashtags=50)
+    names = ["ego_{0}".format(i) for i in range(5)] + ["user_{0}".format(i) for i in range(5, 40)]
+    hashtags = ["tag{0}".format(i) for i in range(50)]
+    collected = list()
+    for api_options in (None, dict(max_query_terms=3)):
+        sink = ListSink()
+        client = fake_client(world, api_options=api_options, sink=sink)
+        collect(client, names, hashtags)
+        assert client.retry.skipped == []
+        collected.append(sorted(sink.tweet_ids))
+    assert collected[0] and collected[0] == collected[1]
+
+
+def test_seen_ids_take_dicts():
+    seen = SeenIds()
+    assert seen.new([{'id': 1}, {'id': 2}]) == [{'id': 1}, {'id': 2}]
+    assert seen.new([{'id': 2}, {'id': 3}]) == [{'id': 3}]
+    assert seen.duplicates == 1
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+pytest.importorskip("tweepy")
+
+from stream import StreamSupervisor  # noqa: E402
+
+
+class FakeStream:
+    """
+    tweepy.Stream that plays one step of a script on every connection
+    """
+    def __init__(self, supervisor, script, listener, statuses):
+        self.supervisor = supervisor
+        self.script = script
+        self.listener = listener
+        self.statuses = statuses
+
+    def filter(self, track=None, follow=None, languages=None):
+        if not self.script:
+            self.supervisor.stop()
+            return
+        step = self.script.pop(0)
+        if step == 'reset':
+            # the connection is refused or reset before the stream starts
+            raise ConnectionResetError("Connection reset by peer")
+        if isinstance(step, int):
+            # tweepy calls on_error with the HTTP status, the listener stops tweepy's own retry
+            self.listener.on_error(step)
+            return
+        self.listener.on_connect()
+        for _ in range(25 if step == 'data' else 0):
+            self.listener.on_data(json.dumps(self.statuses.pop()))
+        if step == 'dropped':
+            raise ConnectionResetError("Connection reset by peer")
+        # data: the stream ends with a disconnect
+
+    def disconnect(self):
+        pass
+
+
+def test_supervisor_reconnects_with_the_backoff_of_the_guidelines():
+    from fakeapi import FakeTwitter
+    from sink import TWEETS, Sink
+    from TwitterTweepy import TweetsStreamListener
+
+    class ListSink(Sink):
+        def __init__(self):
+            super().__init__()
+            self.tweet_ids = list()
+
+        def _write(self, kind, records):
+            if kind == TWEETS:
+                self.tweet_ids.extend(tweet.tweet_id for tweet in records)
+
+    world = FakeTwitter.synthetic(users=100, egos=2, statuses=50)
+    statuses = list(world.statuses.values())
+    sink = ListSink()
+    listener = TweetsStreamListener(None, sink=sink)
+    # 420, 420, a reset before connecting, a connection that drops, data, 503, data
+    script = [420, 420, 'reset', 'dropped', 'data', 503, 'data']
+    waits = list()
+    supervisor = StreamSupervisor(None, listener, track=["#a"], sleep=waits.append,
+                                  stream_factory=lambda auth, stream_listener: FakeStream(supervisor, script,
+                                                                                          stream_listener, statuses))
+    supervisor.run()
+    # rate limited from 60 s doubling, a network error adds 0.25 s to the backoff (at most 16 s), a connection
+    # that worked starts again from the lowest backoff, other HTTP errors from 5 s
+    assert waits == [60, 120, 16, 0.25, 0.25, 5, 0.25]
+    assert supervisor.reconnects == 7
+    assert listener.connects == 3
+    # run stores what the listener still has queued
+    assert sorted(sink.tweet_ids) == sorted(str(status_id) for status_id in world.statuses)
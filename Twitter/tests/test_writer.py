@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+
+import pytest
+
+from writer import BLOCK, DROP_OLDEST, SPILL, BackgroundWriter
+
+
+class BlockedHandler:
+    """
+    Handler that holds the worker in its first batch until release is set
+    """
+    def __init__(self):
+        self.items = list()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, items):
+        self.started.set()
+        assert self.release.wait(10)
+        self.items.extend(items)
+
+
+def fill(writer, handler, items):
+    # the worker takes the first item and waits in the handler, the others wait on the queue
+    writer.put(items[0])
+    assert handler.started.wait(10)
+    for item in items[1:]:
+        writer.put(item)
+
+
+def test_block_waits_for_room():
+    handler = BlockedHandler()
+    writer = BackgroundWriter(handler, workers=1, max_size=2, overflow=BLOCK)
+    fill(writer, handler, [0, 1, 2])
+    producer = threading.Thread(target=writer.put, args=(3,), daemon=True)
+    producer.start()
+    producer.join(0.2)
+    # the queue is full, the producer waits
+    assert producer.is_alive()
+    handler.release.set()
+    producer.join(10)
+    writer.close()
+    assert handler.items == [0, 1, 2, 3]
+    assert writer.counters() == dict(received=4, processed=4, dropped=0, spilled=0, errors=0, depth=0,
+                                     lag=writer.lag)
+
+
+def test_drop_oldest_drops_the_oldest_items():
+    handler = BlockedHandler()
+    writer = BackgroundWriter(handler, workers=1, max_size=3, overflow=DROP_OLDEST)
+    fill(writer, handler, list(range(6)))
+    assert writer.depth == 3
+    handler.release.set()
+    writer.close()
+    assert handler.items == [0, 3, 4, 5]
+    counters = writer.counters()
+    assert (counters['received'], counters['processed'], counters['dropped']) == (6, 4, 2)
+
+
+def test_spill_reads_the_spilled_items_back(tmp_path):
+    handler = BlockedHandler()
+    path = str(tmp_path / "spill.jsonl")
+    writer = BackgroundWriter(handler, workers=1, max_size=3, overflow=SPILL, spill_path=path)
+    fill(writer, handler, [{'id': i} for i in range(6)])
+    with open(path) as spill:
+        assert [json.loads(line) for line in spill] == [{'id': 4}, {'id': 5}]
+    handler.release.set()
+    writer.close()
+    assert sorted(item['id'] for item in handler.items) == list(range(6))
+    counters = writer.counters()
+    assert (counters['received'], counters['processed'], counters['spilled']) == (6, 6, 2)
+
+
+def test_handler_errors_are_counted():
+    def handler(items):
+        raise ValueError("broken sink")
+    writer = BackgroundWriter(handler, workers=1)
+    writer.put(1)
+    writer.close()
+    assert writer.counters()['errors'] == 1
+    with pytest.raises(RuntimeError):
+        writer.put(2)
+
+
+def test_drop_oldest_does_not_drop_the_stop_of_close():
+    handler = BlockedHandler()
+    # the put that is running while close starts waits in the clock, after the closed check
+    in_put = threading.Event()
+    go_on = threading.Event()
+
+    def clock():
+        if threading.current_thread().name == "producer":
+            in_put.set()
+            go_on.wait(10)
+        return time.time()
+
+    writer = BackgroundWriter(handler, workers=1, max_size=1, overflow=DROP_OLDEST, clock=clock)
+    fill(writer, handler, [0])
+    producer = threading.Thread(target=writer.put, args=(1,), name="producer", daemon=True)
+    producer.start()
+    assert in_put.wait(10)
+    closer = threading.Thread(target=writer.close, daemon=True)
+    closer.start()
+    # close would queue its stop entry now, and the put would drop it from the full queue
+    deadline = time.time() + 0.5
+    while writer.depth == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    go_on.set()
+    producer.join(10)
+    handler.release.set()
+    closer.join(10)
+    assert not closer.is_alive()
+    assert handler.items == [0, 1]
+    assert writer.counters()['dropped'] == 0
+
+
+def test_listener_queues_statuses_with_the_overflow_policy():
+    pytest.importorskip("tweepy")
+    from fakeapi import FakeTwitter
+    from sink import Sink
+    from TwitterTweepy import TweetsStreamListener
+
+    class BlockedSink(Sink):
+        def __init__(self):
+            super().__init__()
+            self.tweet_ids = list()
+            self.started = threading.Event()
+            self.release = threading.Event()
+
+        def add_tweets(self, tweets):
+            self.started.set()
+            assert self.release.wait(10)
+            self.tweet_ids.extend(tweet.tweet_id for tweet in tweets)
+
+        def _write(self, kind, records):
+            pass
+
+    world = FakeTwitter.synthetic(users=100, egos=2, statuses=6)
+    statuses = sorted(world.statuses.values(), key=lambda status: status['id'])
+    sink = BlockedSink()
+    listener = TweetsStreamListener(None, sink=sink, workers=1, max_queue=3, overflow=DROP_OLDEST)
+    listener.on_data(json.dumps(statuses[0]))
+    assert sink.started.wait(10)
+    for status in statuses[1:]:
+        listener.on_data(json.dumps(status))
+    # other messages are not queued
+    listener.on_data(json.dumps({'delete': {'status': {'id': 1, 'user_id': 2}}}))
+    counters = listener.writer.counters()
+    assert (counters['received'], counters['dropped'], counters['depth']) == (6, 2, 3)
+    sink.release.set()
+    listener.close()
+    assert sink.tweet_ids == [status['id_str'] for status in statuses[:1] + statuses[3:]]
+    assert listener.writer.counters()['processed'] == 4
@@ -0,0 +1,210 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from journal import USER_COLUMNS, user_to_row, row_to_user
+
+
+class UserCache:
+    """
+    Process-wide cache of hydrated users, keyed by user id and by lower case screen name
+    Entries expire after ttl seconds, the least recently used entries are dropped above max_size
+    With a path, the users are also stored in a SQLite database and survive the run
+    """
+    def __init__(self, max_size=500000, ttl=24 * 60 * 60, path=None, clock=time.time):
+        """
+        :param max_size: maximum number of users kept in memory
+        :param ttl: number of seconds a user stays valid
+        :param path: path of the database of the persistent layer, None for memory only
+        :param clock: function returning the current time
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        # user id -> (time stored, TwitterUser), least recently used first
+        self._users = OrderedDict()
+        # lower case screen name -> user id
+        self._names = dict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        if path is not None:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            with self._connection:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+                self._connection.execute("CREATE TABLE IF NOT EXISTS users ({0}, stored_at REAL, "
+                                         "PRIMARY KEY (user_id))".format(", ".join(USER_COLUMNS)))
+                self._connection.execute("CREATE INDEX IF NOT EXISTS users_screen_name "
+                                         "ON users (screen_name COLLATE NOCASE)")
+
+    def __len__(self):
+        return len(self._users)
+
+    def _expired(self, stored_at):
+        return self.clock() - stored_at > self.ttl
+
+    def _remember(self, user, stored_at):
+        # lock must be held
+        self._users[user.user_id] = (stored_at, user)
+        self._users.move_to_end(user.user_id)
+        self._names[user.screen_name.lower()] = user.user_id
+        while len(self._users) > self.max_size:
+            _, (_, old_user) = self._users.popitem(last=False)
+            if self._names.get(old_user.screen_name.lower()) == old_user.user_id:
+                del self._names[old_user.screen_name.lower()]
+
+    def _load(self, column, value):
+        # lock must be held, looks up a user in the persistent layer
+        if self._connection is None:
+            return None
+        row = self._connection.execute("SELECT {0}, stored_at FROM users WHERE {1} = ?{2}"
+                                       .format(", ".join(USER_COLUMNS), column,
+                                               " COLLATE NOCASE" if column == 'screen_name' else ""),
+                                       (value,)).fetchone()
+        if row is None or self._expired(row[-1]):
+            return None
+        user = row_to_user(row[:-1])
+        self._remember(user, row[-1])
+        return user
+
+    def get(self, user_id):
+        """
+        :param user_id: id of the user
+        :return: the TwitterUser object, None if the user is not cached or expired
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and not self._expired(entry[0]):
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            user = self._load('user_id', user_id)
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return user
+
+    def get_by_screen_name(self, screen_name):
+        """
+        :param screen_name: screen name of the user, case insensitive
+        :return: the TwitterUser object, None if the user is not cached or expired
+        """
+        with self._lock:
+            user_id = self._names.get(screen_name.lower())
+            entry = self._users.get(user_id) if user_id is not None else None
+            if entry is not None and not self._expired(entry[0]):
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            user = self._load('screen_name', screen_name)
+            if user is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return user
+
+    def partition(self, ids):
+        """
+        Splits ids into the users that are cached and the ids that have to be looked up
+        :param ids: iterable of user ids
+        :return: (list of TwitterUser objects, list of missing ids)
+        """
+        cached = list()
+        missing = list()
+        for user_id in ids:
+            user = self.get(user_id)
+            if user is None:
+                missing.append(user_id)
+            else:
+                cached.append(user)
+        return cached, missing
+
+    def put(self, user):
+        """
+        :param user: TwitterUser object
+        """
+        self.put_many([user])
+
+    def put_many(self, users):
+        """
+        Stores users, in one transaction in the persistent layer
+        :param users: list of TwitterUser objects
+        """
+        now = self.clock()
+        with self._lock:
+            for user in users:
+                self._remember(user, now)
+            if self._connection is not None and users:
+                with self._connection:
+                    self._connection.executemany("INSERT OR REPLACE INTO users VALUES ({0})"
+                                                 .format(", ".join("?" * (len(USER_COLUMNS) + 1))),
+                                                 [user_to_row(user) + (now,) for user in users])
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class UserIndex:
+    """
+    Users of one search, indexed by case folded screen name and by user id
+    Adding a user that is already in the index replaces it, so the index holds every user once
+    """
+    def __init__(self, users=()):
+        # user id -> TwitterUser, in the order the users were added
+        self._by_id = OrderedDict()
+        # case folded screen name -> TwitterUser
+        self._by_screen_name = dict()
+        self.add_many(users)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def __contains__(self, user_id):
+        return user_id in self._by_id
+
+    def add(self, user):
+        """
+        :param user: TwitterUser object
+        """
+        self._by_id[user.user_id] = user
+        self._by_screen_name[user.screen_name.casefold()] = user
+
+    def add_many(self, users):
+        """
+        :param users: iterable of TwitterUser objects
+        """
+        for user in users:
+            self.add(user)
+
+    def by_id(self, user_id):
+        """
+        :param user_id: id of the user
+        :return: TwitterUser object, None if the user is not in the index
+        """
+        return self._by_id.get(user_id)
+
+    def by_screen_name(self, screen_name):
+        """
+        :param screen_name: screen name of the user, case insensitive
+        :return: TwitterUser object, None if the user is not in the index
+        """
+        return self._by_screen_name.get(screen_name.casefold())
+
+    def ids(self):
+        """
+        :return: set of the ids of all users in the index
+        """
+        return set(self._by_id)
+
+
+# shared by all TwitterTweepy objects of the process
+shared_cache = UserCache()
@@ -0,0 +1,45 @@
+import sqlite3
+import threading
+
+
+class WatermarkStore:
+    """
+    Highest tweet id collected for every query, stored in a SQLite database
+    A repeated search only asks for the tweets newer than its watermark (since_id)
+    """
+    def __init__(self, path=":memory:"):
+        """
+        :param path: path of the database file, created if it does not exist
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS watermarks (query TEXT PRIMARY KEY, "
+                                     "since_id INTEGER NOT NULL)")
+
+    def since_id(self, query):
+        """
+        :param query: key of the query, ex search:#hashtag or timeline:screen_name
+        :return: the highest tweet id collected for the query, None if the query never finished
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT since_id FROM watermarks WHERE query = ?", (query,)).fetchone()
+        return None if row is None else row[0]
+
+    def advance(self, query, since_id):
+        """
+        Stores a new watermark, a lower id than the stored one is ignored
+        Only call this once all tweets up to since_id are collected, the tweets below it are never asked again
+        :param query: key of the query
+        :param since_id: highest tweet id collected
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO watermarks (query, since_id) VALUES "
+                                     "(?, MAX(?, COALESCE((SELECT since_id FROM watermarks WHERE query = ?), 0)))",
+                                     (query, since_id, query))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# what put does when the queue is full
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+# tells a worker to stop
+_STOP = object()
+
+
+class BackgroundWriter:
+    """
+    Decouples a producer (the read thread of a stream) from storage
+    Items are put on a bounded queue that a pool of worker threads drains in batches into handler
+    When the queue is full, the overflow policy decides:
+    BLOCK waits for room, DROP_OLDEST drops the oldest item, SPILL appends the item to a file of JSON lines
+    that the workers read back once the queue is empty
+    """
+    def __init__(self, handler, workers=2, max_size=10000, overflow=BLOCK, spill_path=None, batch_size=100,
+                 clock=time.time):
+        """
+        :param handler: function that receives a list of items, called on the worker threads
+        :param workers: number of worker threads
+        :param max_size: maximum number of items on the queue
+        :param overflow: BLOCK, DROP_OLDEST or SPILL
+        :param spill_path: file the items are spilled to, needed for SPILL, items must be JSON serializable
+        :param batch_size: maximum number of items given to handler at once
+        :param clock: function returning the current time
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy {0}".format(overflow))
+        if overflow == SPILL and spill_path is None:
+            raise ValueError("The spill policy needs a spill_path")
+        self.handler = handler
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.clock = clock
+        # (time put, item)
+        self._queue = queue.Queue(max_size)
+        self._spill_lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+        # put and close do not overlap, DROP_OLDEST would otherwise drop the stop entries of close
+        self._put_lock = threading.Lock()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.errors = 0
+        # seconds between putting and handling of the last handled batch
+        self.lag = 0.0
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, name="writer-{0}".format(i), daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        # counters and queue depth of the running writer, in every metrics snapshot
+        metrics.collect('writer', self.counters)
+
+    @property
+    def depth(self):
+        """
+        :return: number of items waiting on the queue
+        """
+        return self._queue.qsize()
+
+    def counters(self):
+        """
+        :return: dict with the counters of the writer
+        """
+        with self._counter_lock:
+            return {'received': self.received, 'processed': self.processed, 'dropped': self.dropped,
+                    'spilled': self.spilled, 'errors': self.errors, 'depth': self.depth, 'lag': self.lag}
+
+    def put(self, item):
+        """
+        Hands an item to the workers, applies the overflow policy if the queue is full
+        :param item: the item
+        """
+        with self._put_lock:
+            if self._closed:
+                raise RuntimeError("The writer is closed")
+            entry = (self.clock(), item)
+            with self._counter_lock:
+                self.received += 1
+            if self.overflow == BLOCK:
+                self._queue.put(entry)
+                return
+            while True:
+                try:
+                    self._queue.put_nowait(entry)
+                    return
+                except queue.Full:
+                    pass
+                if self.overflow == SPILL:
+                    self._spill(item)
+                    return
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                with self._counter_lock:
+                    self.dropped += 1
+
+    def _spill(self, item):
+        with self._spill_lock:
+            with open(self.spill_path, 'a', encoding='utf-8') as spill:
+                spill.write(json.dumps(item) + "\n")
+        with self._counter_lock:
+            self.spilled += 1
+
+    def _unspill(self):
+        """
+        Handles the items in the spill file, the file is emptied first so new items can be spilled meanwhile
+        :return: True if there were spilled items
+        """
+        if self.spill_path is None:
+            return False
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path) or not os.path.getsize(self.spill_path):
+                return False
+            draining = "{0}.{1}".format(self.spill_path, threading.get_ident())
+            os.replace(self.spill_path, draining)
+        with open(draining, encoding='utf-8') as spill:
+            batch = list()
+            for line in spill:
+                batch.append(json.loads(line))
+                if len(batch) == self.batch_size:
+                    self._handle(batch, None)
+                    batch = list()
+            if batch:
+                self._handle(batch, None)
+        os.remove(draining)
+        return True
+
+    def _handle(self, items, put_at):
+        try:
+            self.handler(items)
+        except Exception as e:
+            logger.error("Error in background writer: %s", e)
+            with self._counter_lock:
+                self.errors += len(items)
+            return
+        with self._counter_lock:
+            self.processed += len(items)
+            if put_at is not None:
+                self.lag = self.clock() - put_at
+
+    def _work(self):
+        while True:
+            try:
+                entry = self._queue.get(timeout=1)
+            except queue.Empty:
+                # spilled items are read back when the queue has room again
+                self._unspill()
+                continue
+            if entry is _STOP:
+                return
+            batch = [entry]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                    break
+                batch.append(entry)
+            self._handle([item for _, item in batch], batch[0][0])
+            if stop:
+                return
+
+    def close(self):
+        """
+        Handles all queued and spilled items and stops the workers
+        """
+        with self._put_lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._threads:
+            # after the items that are still queued
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        while self._unspill():
+            pass
+        metrics.remove('writer')